@@ -0,0 +1,150 @@
+"""
+Семантический кеш ответов RAG для OpenMineralHub
+Перефразированные запросы находятся по косинусной близости эмбеддингов
+"""
+
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    In-process кеш ответов rag_query
+
+    Эмбеддинги запросов хранятся нормализованной матрицей, поиск — одно
+    матричное умножение. Запись кеша привязана к scope (фильтры, n_results)
+    и к id документов-источников: ответ отдается, только если поиск по новому
+    запросу вернул те же документы, а изменение любого источника удаляет запись.
+    Ограничения: TTL и max_entries (вытесняется давно не использованная запись).
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl_seconds: int = 900, max_entries: int = 512):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._keys: List[str] = []
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.source_mismatches = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding: Any) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, keys: Iterable[str]) -> None:
+        """Удаление записей и строк матрицы (под self._lock)"""
+        keys = set(keys)
+        if not keys:
+            return
+        keep = [i for i, key in enumerate(self._keys) if key not in keys]
+        for key in keys:
+            self._entries.pop(key, None)
+        self._keys = [self._keys[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep and self._matrix is not None else None
+
+    def _expire(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        self._remove(expired)
+
+    def lookup(self, embedding: Any, scope: str) -> Optional[Dict[str, Any]]:
+        """
+        Ближайший сохраненный запрос того же scope с косинусной близостью >= threshold.
+        Возвращает запись ({"query", "source_ids", "payload", "similarity"}) или None.
+        """
+        now = time.time()
+        query = self._normalize(embedding)
+        with self._lock:
+            self._expire(now)
+            if self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = self._matrix @ query
+            for row in np.argsort(-similarities):
+                similarity = float(similarities[row])
+                if similarity < self.threshold:
+                    break
+                entry = self._entries[self._keys[row]]
+                if entry["scope"] == scope:
+                    entry["last_used"] = now
+                    self.hits += 1
+                    return {**entry, "similarity": similarity}
+            self.misses += 1
+            return None
+
+    def reject(self) -> None:
+        """Найденная запись не подошла: документы-источники изменились"""
+        with self._lock:
+            self.hits -= 1
+            self.misses += 1
+            self.source_mismatches += 1
+
+    def store(self, query: str, embedding: Any, scope: str, source_ids: List[str], payload: Dict[str, Any]) -> None:
+        """Сохранение ответа"""
+        now = time.time()
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is not None and self._matrix.shape[1] != vector.shape[0]:
+                # Сменилась embedding модель — старые векторы несравнимы
+                self._remove(list(self._keys))
+            self._expire(now)
+            while len(self._keys) >= self.max_entries:
+                oldest = min(self._keys, key=lambda key: self._entries[key]["last_used"])
+                self._remove([oldest])
+                self.evictions += 1
+
+            key = uuid.uuid4().hex
+            self._entries[key] = {
+                "query": query,
+                "scope": scope,
+                "source_ids": list(source_ids),
+                "payload": payload,
+                "expires_at": now + self.ttl_seconds,
+                "last_used": now
+            }
+            self._keys.append(key)
+            row = vector[np.newaxis, :]
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+
+    def invalidate_documents(self, doc_ids: Iterable[str]) -> int:
+        """Удаление ответов, в источниках которых есть измененные документы"""
+        changed = set(doc_ids)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if changed.intersection(entry["source_ids"])]
+            self._remove(stale)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._remove(list(self._keys))
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._keys),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "source_mismatches": self.source_mismatches,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
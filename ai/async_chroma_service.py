@@ -0,0 +1,200 @@
+"""
+Асинхронный фасад ChromaService для OpenMineralHub
+Блокирующие вызовы Chroma и LLM выполняются в выделенном ограниченном пуле потоков,
+чтобы не останавливать event loop uvicorn
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from config.chroma_config import chroma_config
+from ai.chroma_service import ChromaService, close_chroma_services, get_chroma_service
+from ai.filters import DealFilter
+from ai.instrumentation import Timings
+from ai.service_registry import ServiceRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncChromaService:
+    """
+    Async API поверх ChromaService
+
+    Пул потоков выделен под Chroma/LLM и ограничен CHROMA_THREAD_POOL_SIZE:
+    медленные RAG запросы не занимают общий пул starlette и не
+    блокируют остальные запросы, а нагрузка на Chroma Cloud ограничена.
+    """
+
+    def __init__(self, service: ChromaService, max_workers: Optional[int] = None):
+        self.service = service
+        self.max_workers = max_workers or chroma_config.CHROMA_THREAD_POOL_SIZE
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chroma")
+
+    @property
+    def is_test_mode(self) -> bool:
+        return self.service.is_test_mode
+
+    async def _run(self, func, *args, **kwargs):
+        """Выполнение блокирующего метода сервиса в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def search_minerals(self, query: str, n_results: int = 3, filters: Optional[Dict] = None, rerank: Optional[bool] = None) -> Dict[str, Any]:
+        """Семантический поиск по минералам"""
+        return await self._run(self.service.search_minerals, query, n_results=n_results, filters=filters, rerank=rerank)
+
+    async def search_deals(
+        self,
+        query: str,
+        n_results: int = 5,
+        status_filter: Optional[str] = None,
+        risk_filter: Optional[str] = None,
+        rerank: Optional[bool] = None,
+        commodity_filter: Optional[str] = None,
+        region_filter: Optional[str] = None,
+        deal_filter: Optional[DealFilter] = None
+    ) -> Dict[str, Any]:
+        """Поиск по торговым сделкам"""
+        return await self._run(self.service.search_deals, query, n_results=n_results,
+                               status_filter=status_filter, risk_filter=risk_filter, rerank=rerank,
+                               commodity_filter=commodity_filter, region_filter=region_filter,
+                               deal_filter=deal_filter)
+
+    async def search_kyc(self, query: str, n_results: int = 3, aml_filter: Optional[str] = "clean") -> Dict[str, Any]:
+        """Поиск KYC документов"""
+        return await self._run(self.service.search_kyc, query, n_results=n_results, aml_filter=aml_filter)
+
+    async def search_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетный поиск по нескольким коллекциям"""
+        return await self._run(self.service.search_batch, queries)
+
+    async def search_all(self, query: str, n_results: int = 3, collections: Optional[List[str]] = None, aml_filter: Optional[str] = "clean") -> Dict[str, Any]:
+        """Федеративный поиск по всем коллекциям"""
+        return await self._run(self.service.search_all, query, n_results=n_results,
+                               collections=collections, aml_filter=aml_filter)
+
+    async def rag_query(self, query: str, n_results: int = 3, filters: Optional[Dict] = None) -> Dict[str, Any]:
+        """RAG query: поиск + LLM"""
+        return await self._run(self.service.rag_query, query, n_results=n_results, filters=filters)
+
+    async def _stream_llm(self, query: str, context: str) -> AsyncIterator[str]:
+        """Токены ответа LLM через LangChain astream (в тестовом режиме — заглушка по словам)"""
+        if self.service.is_test_mode:
+            for word in self.service.RAG_MOCK_RESPONSE.split(" "):
+                yield word + " "
+                await asyncio.sleep(0)
+            return
+        
+        stream = self.service.rag_chain(streaming=True).astream({"query": query, "context": context})
+        try:
+            async for chunk in stream:
+                if chunk:
+                    yield chunk
+        finally:
+            # Закрытие потока обрывает HTTP запрос к LLM при отмене/отключении клиента
+            await stream.aclose()
+    
+    async def stream_rag_query(self, query: str, n_results: int = 3, filters: Optional[Dict] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый RAG: событие sources сразу после поиска, затем token по мере
+        генерации LLM и done в конце (error при ошибке). Закрытие генератора
+        (отключение клиента) прекращает генерацию LLM.
+        """
+        timings = Timings("rag_stream")
+        search_results = await self.search_minerals(query, n_results=self.service.rag_candidates(n_results), filters=filters)
+        if not search_results["success"]:
+            yield {"event": "error", "data": {"error": search_results.get("error"), "query": query}}
+            return
+        timings.add("search", search_results.get("processing_time_ms", 0.0))
+        
+        started = time.perf_counter()
+        packed = await self._run(self.service.rag_context, query, search_results)
+        timings.add("prompt_build", (time.perf_counter() - started) * 1000)
+        yield {
+            "event": "sources",
+            "data": {
+                "query": query,
+                "chroma_results_count": search_results["results_count"],
+                "sources": [r["metadata"] for r in packed["results"]],
+                "context": self.service.context_stats(packed),
+                "environment": search_results.get("environment")
+            }
+        }
+        
+        started = time.perf_counter()
+        chunks = 0
+        tokens = self._stream_llm(query, packed["context"])
+        try:
+            async for text in tokens:
+                chunks += 1
+                yield {"event": "token", "data": {"text": text}}
+        except Exception as e:
+            logger.error(f"Ошибка потокового RAG: {e}")
+            yield {"event": "error", "data": {"error": str(e), "query": query}}
+            return
+        finally:
+            await tokens.aclose()
+        
+        generation_ms = (time.perf_counter() - started) * 1000
+        timings.add("llm", generation_ms)
+        timings.finish()
+        self.service.instrumentation.record(timings)
+        
+        done = {
+            "llm_model": "mock" if self.service.is_test_mode else self.service.RAG_LLM_MODEL,
+            "chunks": chunks,
+            "generation_ms": round(generation_ms, 1)
+        }
+        if self.service.instrumentation.include_timings:
+            done["timings"] = timings.as_dict()
+        yield {"event": "done", "data": done}
+    
+    async def get_collection_stats(self) -> Dict[str, Any]:
+        """Статистика коллекций"""
+        return await self._run(self.service.get_collection_stats)
+
+    async def get_deal_analytics(
+        self,
+        group_by: List[str],
+        commodity: Optional[str] = None,
+        region: Optional[str] = None,
+        status: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Колоночная аналитика сделок (group-by по commodity/region/month/status)"""
+        return await self._run(self.service.get_deal_analytics, group_by, commodity=commodity, region=region,
+                               status=status, date_from=date_from, date_to=date_to)
+
+    async def add_document(self, collection_name: str, document: str, metadata: Dict[str, Any], id: Optional[str] = None) -> Dict[str, Any]:
+        """Добавление документа"""
+        return await self._run(self.service.add_document, collection_name, document, metadata, id=id)
+
+    def close(self) -> None:
+        """Остановка пула потоков"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def aclose(self) -> None:
+        """Остановка пула потоков и закрытие ресурсов сервиса (HTTP клиенты LLM, кеш)"""
+        self.close()
+        await self.service.aclose()
+
+
+# Async фасады по одному на prod/test сервис
+_facades = ServiceRegistry("async_chroma")
+
+
+def get_async_chroma_service(is_test_mode: bool = False) -> AsyncChromaService:
+    """Получение async фасада Chroma сервиса (prod или test)"""
+    key = "test" if is_test_mode else "prod"
+    return _facades.get(key, lambda: AsyncChromaService(get_chroma_service(is_test_mode=is_test_mode)))
+
+
+async def close_async_chroma_services() -> None:
+    """Закрытие async фасадов и сервисов при остановке приложения"""
+    await _facades.aclose()
+    close_chroma_services()
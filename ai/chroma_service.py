@@ -4,15 +4,37 @@ Chroma RAG Service для OpenMineralHub
 """
 
 import chromadb
+import re
+import hashlib
+import httpx
+import itertools
 import json
 import os
+import sys
+import threading
+import time
 import uuid
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional
 from datetime import datetime
 import logging
 from pydantic import BaseModel
 from fastapi import HTTPException
 from config.chroma_config import chroma_config
+from ai.search_cache import SearchCache
+from ai.embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+from ai.embeddings import build_embedding_function
+from ai.deal_aggregates import DealAggregates
+from ai.filters import DealFilter, and_where, matches_where, with_epoch_dates
+from ai.instrumentation import Instrumentation, build_exporters, instrumented, propagate, stage
+from ai.reranker import CrossEncoderReranker
+from ai.answer_cache import SemanticAnswerCache
+from ai.context_builder import ContextBuilder
+from ai.chunking import build_chunks, collapse_to_parents
+from ai.service_registry import ServiceRegistry
+from ai.sharding import ShardedCollection
+from ai.vector_store import SPACES, InMemoryVectorStore, ReplicatedCollection
+from ai.lexical_index import LexicalIndex, reciprocal_rank_fusion
 
 # New imports for RAG
 from openai import OpenAI
@@ -78,16 +100,104 @@ class ChromaService:
         "kyc": "openmineral_kyc"
     }
     
-    def __init__(self, is_test_mode: bool = False):
-        """Инициализация клиента Chroma (Cloud для prod, локальный для тестов)"""
+    # Суффикс коллекций чанков (для коллекций из CHUNKED_COLLECTIONS)
+    CHUNK_COLLECTION_SUFFIX = "_chunks"
+    
+    # Источник встроенных начальных данных (manifest scope для load_initial_data)
+    SEED_SOURCE = "openmineral_seed"
+    # Поля метаданных, которые меняются при каждой загрузке и не входят в хеш содержимого
+    VOLATILE_METADATA_KEYS = {"loaded_at", "added_at"}
+    # Модель коллекций, созданных без поля embedding_model (функция Chroma по умолчанию)
+    LEGACY_EMBEDDING_MODEL = "onnx/all-MiniLM-L6-v2"
+    # LLM для RAG и ответ-заглушка тестового режима
+    RAG_LLM_MODEL = "gpt-4-turbo-preview"
+    RAG_MOCK_RESPONSE = "Мок-ответ: Для вашего запроса найдена информация о минералах. В production режиме будет использован OpenAI."
+    
+    def __init__(self, is_test_mode: bool = False, test_session: Optional[str] = None):
+        """
+        Инициализация клиента Chroma (Cloud для prod, локальный для тестов).
+        test_session — ключ in-memory базы при CHROMA_TEST_CLIENT=ephemeral
+        (по умолчанию CHROMA_TEST_SESSION).
+        """
         self.is_test_mode = is_test_mode
-        self.test_db_path = "./chroma_test_db"
+        self.test_db_path = chroma_config.TEST_DB_PATH
+        self.is_ephemeral = is_test_mode and chroma_config.TEST_CLIENT == "ephemeral"
+        self.test_database: Optional[str] = None
+        # Время этапов инициализации (мс) для отчета прогрева приложения
+        self.startup_timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        self.search_cache = SearchCache(
+            max_entries=chroma_config.CACHE_MAX_ENTRIES,
+            ttl_seconds=chroma_config.CACHE_TTL_SECONDS,
+            redis_url=chroma_config.REDIS_URL if chroma_config.REDIS_ENABLED else None
+        )
+        # Идентификатор embedding модели (provider/model); хранится в метаданных коллекций
+        self.embedding_model_id: Optional[str] = None
+        self.embedding_function = self._build_embedding_function()
+        self.startup_timings["embedding_function_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        # Лексические индексы коллекций (строятся лениво при первом гибридном поиске)
+        self.lexical_indexes: Dict[str, LexicalIndex] = {}
+        self._lexical_built_at: Dict[str, float] = {}
+        # Записи, пришедшие во время фонового построения индекса (ключ есть — построение идет)
+        self._lexical_pending: Dict[str, List[tuple]] = {}
+        self._lexical_generation = 0
+        self._lexical_lock = threading.Lock()
+        # Агрегаты и колоночная аналитика сделок для статистики и дашбордов (строятся лениво)
+        self.deal_aggregates: Optional[DealAggregates] = None
+        # Счетчики чанков и шардов для get_collection_stats (кешируются вместе с агрегатами)
+        self._stats_counts: Optional[Dict[str, Any]] = None
+        self._stats_generation = 0
+        # Перестроение агрегатов: одно за раз; записи во время чтения (None — чтения нет)
+        self._aggregates_build_lock = threading.Lock()
+        self._aggregates_pending: Optional[List[tuple]] = None
+        self._aggregates_lock = threading.Lock()
+        # Cross-encoder для re-ranking (модель загружается при первом использовании)
+        self.reranker = CrossEncoderReranker(
+            model_name=chroma_config.RERANK_MODEL,
+            batch_size=chroma_config.RERANK_BATCH_SIZE,
+            cache_size=chroma_config.RERANK_CACHE_SIZE,
+            num_threads=chroma_config.EMBEDDING_NUM_THREADS
+        )
+        # Семантический кеш ответов rag_query
+        self.answer_cache = SemanticAnswerCache(
+            threshold=chroma_config.RAG_CACHE_THRESHOLD,
+            ttl_seconds=chroma_config.RAG_CACHE_TTL_SECONDS,
+            max_entries=chroma_config.RAG_CACHE_MAX_ENTRIES
+        )
+        # Упаковка контекста RAG в бюджет токенов модели
+        self.context_builder = ContextBuilder(
+            self.RAG_LLM_MODEL,
+            context_window=chroma_config.RAG_CONTEXT_WINDOW_TOKENS,
+            max_context_tokens=chroma_config.RAG_CONTEXT_MAX_TOKENS,
+            doc_max_tokens=chroma_config.RAG_CONTEXT_DOC_MAX_TOKENS,
+            response_reserve_tokens=chroma_config.RAG_RESPONSE_RESERVE_TOKENS,
+            dedup_threshold=chroma_config.RAG_CONTEXT_DEDUP_THRESHOLD
+        )
+        # Тайминги поиска и RAG по стадиям: гистограммы задержек и экспортеры
+        self.instrumentation = Instrumentation(
+            build_exporters(
+                chroma_config.TIMING_EXPORTERS,
+                otel_enabled=chroma_config.OTEL_ENABLED,
+                service_name=chroma_config.OTEL_SERVICE_NAME,
+                slow_ms=chroma_config.TIMING_SLOW_MS
+            ),
+            include_timings=chroma_config.TIMINGS_IN_RESPONSE
+        )
+        # Пул для параллельных запросов к нескольким коллекциям (search_all)
+        self._fanout_executor = ThreadPoolExecutor(
+            max_workers=chroma_config.CHROMA_THREAD_POOL_SIZE,
+            thread_name_prefix="chroma-fanout"
+        )
+        # LLM клиенты RAG создаются один раз; HTTP пулы соединений общие и закрываются в close()
+        self._rag_llms: Dict[bool, ChatOpenAI] = {}
+        self._llm_lock = threading.Lock()
+        self._llm_http_client: Optional[httpx.Client] = None
+        self._llm_async_http_client: Optional[httpx.AsyncClient] = None
         
         try:
+            started = time.perf_counter()
             if is_test_mode:
-                # Локальный ChromaDB для тестов (persistent)
-                self.client = chromadb.PersistentClient(path=self.test_db_path)
-                logger.info(f"Локальный ChromaDB для тестов инициализирован: {self.test_db_path}")
+                self.client = self._test_client(test_session)
             else:
                 # Cloud ChromaDB для production
                 self.client = chromadb.CloudClient(
@@ -96,12 +206,37 @@ class ChromaService:
                     database=chroma_config.DATABASE
                 )
                 logger.info(f"Chroma Cloud клиент инициализирован: {chroma_config.get_connection_string()}")
+            self.startup_timings["client_ms"] = round((time.perf_counter() - started) * 1000, 1)
             
+            started = time.perf_counter()
             self._setup_collections()
+            self._ensure_embedding_model()
+            self.startup_timings["collections_ms"] = round((time.perf_counter() - started) * 1000, 1)
         except Exception as e:
             logger.error(f"Ошибка инициализации Chroma: {e}")
             raise HTTPException(status_code=500, detail=f"Chroma init error: {str(e)}")
     
+    def _test_client(self, test_session: Optional[str] = None):
+        """
+        Клиент тестового режима: локальная БД на диске или (ephemeral) отдельная
+        in-memory база данных на тестовую сессию — без диска и SQLite файлов,
+        сессии (и процессы pytest-xdist) не видят коллекций друг друга.
+        """
+        if not self.is_ephemeral:
+            client = chromadb.PersistentClient(path=self.test_db_path)
+            logger.info(f"Локальный ChromaDB для тестов инициализирован: {self.test_db_path}")
+            return client
+        
+        session = test_session or chroma_config.TEST_SESSION or "default"
+        self.test_database = "omh_test_" + re.sub(r"[^A-Za-z0-9_]+", "_", session)
+        admin = chromadb.AdminClient(chromadb.Settings(is_persistent=False))
+        try:
+            admin.get_database(self.test_database)
+        except Exception:
+            admin.create_database(self.test_database)
+        logger.info(f"In-memory ChromaDB для тестов: база {self.test_database}")
+        return chromadb.EphemeralClient(database=self.test_database)
+    
     def _setup_collections(self):
         """Создание/получение коллекций"""
         # Коллекция минералов
@@ -111,7 +246,8 @@ class ChromaService:
                 "description": "Каталог минералов OpenMineralHub",
                 "version": "1.0",
                 "project": "OpenMineralHub",
-                "environment": "test" if self.is_test_mode else "production"
+                "environment": "test" if self.is_test_mode else "production",
+                **self._model_metadata()
             }
         )
         
@@ -122,7 +258,8 @@ class ChromaService:
                 "description": "Торговые сделки OpenMineralHub",
                 "version": "1.0", 
                 "project": "OpenMineralHub",
-                "environment": "test" if self.is_test_mode else "production"
+                "environment": "test" if self.is_test_mode else "production",
+                **self._model_metadata()
             }
         )
         
@@ -134,19 +271,218 @@ class ChromaService:
                 "version": "1.0",
                 "project": "OpenMineralHub",
                 "compliance_standard": "AML_KYC",
-                "environment": "test" if self.is_test_mode else "production"
+                "environment": "test" if self.is_test_mode else "production",
+                **self._model_metadata()
             }
         )
         
+        # Коллекции чанков длинных документов (parent_id → документ основной коллекции)
+        self.chunk_collections = {}
+        self.split_collections = {key.strip() for key in chroma_config.CHUNKED_COLLECTIONS.split(",")} & set(self.COLLECTIONS)
+        shard_key = chroma_config.DEALS_SHARD_KEY.strip()
+        for key in sorted(self.split_collections):
+            if key == "deals" and shard_key:
+                continue
+            self.chunk_collections[key] = self.client.get_or_create_collection(
+                name=self.COLLECTIONS[key] + self.CHUNK_COLLECTION_SUFFIX,
+                metadata={
+                    "description": f"Чанки документов {self.COLLECTIONS[key]}",
+                    "version": "1.0",
+                    "project": "OpenMineralHub",
+                    "environment": "test" if self.is_test_mode else "production",
+                    **self._model_metadata()
+                }
+            )
+        
+        # Шардированный индекс сделок (по commodity/region) вместо одной коллекции чанков;
+        # если сделки не режутся на чанки, в шардах лежат целые документы
+        if shard_key:
+            self.chunk_collections["deals"] = ShardedCollection(
+                self.client,
+                self.COLLECTIONS["deals"],
+                shard_key,
+                metadata={
+                    "description": f"Шард сделок по {shard_key}",
+                    "version": "1.0",
+                    "project": "OpenMineralHub",
+                    "environment": "test" if self.is_test_mode else "production",
+                    **self._model_metadata()
+                },
+                max_workers=chroma_config.DEALS_SHARD_FANOUT_WORKERS
+            )
+        
+        self._setup_replicas()
         logger.info("Коллекции Chroma инициализированы")
     
-    def load_initial_data(self) -> bool:
-        """Загрузка начальных тестовых данных"""
-        if self.is_test_mode:
-            print("📊 Загрузка тестовых данных в локальную ChromaDB...")
+    def _setup_replicas(self):
+        """
+        In-process реплики для чтения (VECTOR_REPLICA_COLLECTIONS). Реплицируется
+        коллекция, по которой идет векторный поиск: коллекция чанков, если она есть,
+        иначе основная. Шардированный индекс сделок не реплицируется.
+        """
+        self.replicas: Dict[str, ReplicatedCollection] = {}
+        for key in chroma_config.VECTOR_REPLICA_COLLECTIONS.split(","):
+            key = key.strip()
+            if key not in self.COLLECTIONS:
+                continue
+            chunks = self.chunk_collections.get(key)
+            if isinstance(chunks, ShardedCollection):
+                logger.warning(f"Реплика для шардированной коллекции '{key}' не поддерживается")
+                continue
+            use_chunks = chunks is not None and chroma_config.CHUNKING_ENABLED
+            collection = chunks if use_chunks else getattr(self, f"{key}_collection")
+            space = (collection.metadata or {}).get("hnsw:space", "l2")
+            replica = ReplicatedCollection(
+                collection,
+                InMemoryVectorStore(
+                    space=space if space in SPACES else "l2",
+                    hnsw_threshold=chroma_config.VECTOR_REPLICA_HNSW_THRESHOLD,
+                    hnsw_ef=chroma_config.VECTOR_REPLICA_HNSW_EF,
+                    delta_limit=chroma_config.VECTOR_REPLICA_DELTA_LIMIT
+                ),
+                refresh_seconds=chroma_config.VECTOR_REPLICA_REFRESH_SECONDS,
+                page_size=chroma_config.SCAN_PAGE_SIZE
+            )
+            if use_chunks:
+                self.chunk_collections[key] = replica
+            else:
+                setattr(self, f"{key}_collection", replica)
+            self.replicas[key] = replica
+    
+    def _model_metadata(self) -> Dict[str, Any]:
+        """Поле embedding модели для метаданных создаваемых коллекций"""
+        return {"embedding_model": self.embedding_model_id} if self.embedding_model_id else {}
+    
+    @staticmethod
+    def _model_name(model_id: str) -> str:
+        """Имя модели без backend (onnx/ и sentence_transformers/ дают одинаковые векторы)"""
+        return model_id.rsplit("/", 1)[-1]
+    
+    def _stored_embedding_model(self, collection) -> Optional[str]:
+        """
+        Модель, которой записана коллекция. Коллекции без поля embedding_model
+        писались функцией Chroma по умолчанию (LEGACY_EMBEDDING_MODEL); пустой
+        коллекции без поля модель присваивается текущая. None — проверка невозможна.
+        """
+        metadata = collection.metadata
+        if not isinstance(metadata, dict):
+            return None
+        stored = metadata.get("embedding_model")
+        if stored:
+            return stored
+        if collection.count() == 0:
+            stored = self.embedding_model_id
         else:
-            print("📊 Загрузка начальных данных OpenMineralHub...")
+            stored = self.LEGACY_EMBEDDING_MODEL
+            if self._model_name(stored) != self._model_name(self.embedding_model_id):
+                return stored
+        # Метаданные без hnsw:* (пространство дистанций Chroma изменить не дает)
+        collection.modify(metadata={
+            **{k: v for k, v in metadata.items() if not k.startswith("hnsw:")},
+            "embedding_model": stored
+        })
+        return stored
+    
+    def _ensure_embedding_model(self) -> None:
+        """
+        Проверка, что коллекции записаны текущей embedding моделью. Векторы другой
+        модели несовместимы (другая размерность или пространство), поэтому при
+        несовпадении сервис не стартует (EMBEDDING_MODEL_MISMATCH=error) или
+        переиндексирует коллекции текущей моделью (reindex).
+        """
+        if not self.embedding_model_id:
+            return
+        mismatched = {}
+        for key in self.COLLECTIONS:
+            stored = self._stored_embedding_model(self._base_collection(key))
+            if stored and self._model_name(stored) != self._model_name(self.embedding_model_id):
+                mismatched[key] = stored
+        if not mismatched:
+            return
+        
+        details = ", ".join(f"{key}: {model}" for key, model in mismatched.items())
+        if chroma_config.EMBEDDING_MODEL_MISMATCH != "reindex":
+            raise RuntimeError(
+                f"Коллекции записаны другой embedding моделью ({details}), "
+                f"сервис настроен на {self.embedding_model_id}. Верните прежнюю модель "
+                f"(CHROMA_EMBEDDING_PROVIDER / EMBEDDING_LOCAL_MODEL) или установите "
+                f"EMBEDDING_MODEL_MISMATCH=reindex для переиндексации"
+            )
+        logger.warning(f"Переиндексация коллекций моделью {self.embedding_model_id}: {details}")
+        self.reindex_collections(list(mismatched))
+    
+    def _base_collection(self, key: str):
+        """Основная коллекция Chroma (без обертки реплики)"""
+        collection = getattr(self, f"{key}_collection")
+        return collection.collection if isinstance(collection, ReplicatedCollection) else collection
+    
+    def reindex_collections(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Переиндексация коллекций текущей embedding моделью: документы и метаданные
+        читаются постранично, коллекции (и их чанки/шарды) пересоздаются, документы
+        записываются заново с новыми эмбеддингами.
+        """
+        snapshots = {}
+        for key in keys:
+            snapshots[key] = [
+                {"id": doc_id, "document": doc, "metadata": meta}
+                for page in self._scan_pages(key, include=["documents", "metadatas"])
+                for doc_id, doc, meta in zip(page["ids"], page["documents"], page["metadatas"])
+            ]
+        
+        chunk_names = set(self._chunk_collection_names())
+        for key in keys:
+            names = [self.COLLECTIONS[key]] + [
+                name for name in chunk_names if name.startswith(self.COLLECTIONS[key] + "_")
+            ]
+            for name in names:
+                self.client.delete_collection(name)
+        self._close_shards()
+        self._setup_collections()
+        self._reset_local_state()
+        
+        return {key: self._write_documents(key, documents, None, mode="upsert") for key, documents in snapshots.items()}
+    
+    def sync_replicas(self) -> Dict[str, Any]:
+        """Синхронизация всех реплик из Chroma (прогрев): число записей или ошибка по коллекции"""
+        report = {}
+        for key, replica in self.replicas.items():
+            try:
+                report[key] = replica.sync()
+            except Exception as e:
+                replica.sync_error = str(e)
+                report[key] = f"error: {e}"
+                logger.error(f"Ошибка синхронизации реплики '{key}': {e}")
+        return report
+    
+    def _build_embedding_function(self):
+        """
+        Embedding функция сервиса. Эмбеддинги считаются на клиенте и передаются
+        в Chroma явно, поэтому неизменные тексты берутся из дискового кеша.
+        """
+        # Провайдер из CHROMA_EMBEDDING_PROVIDER: openai или локальная CPU модель
+        base_function, model_id = build_embedding_function(chroma_config.get_embedding_config())
+        self.embedding_model_id = model_id
+        logger.info(f"Embedding модель: {model_id}")
+        if not chroma_config.EMBEDDING_CACHE_ENABLED:
+            return base_function
         
+        cache = EmbeddingCache(chroma_config.EMBEDDING_CACHE_PATH, model_name=model_id)
+        logger.info(f"Кеш эмбеддингов: {chroma_config.EMBEDDING_CACHE_PATH} ({cache.stats()['entries']} векторов)")
+        return CachedEmbeddingFunction(base_function, cache, query_cache_size=chroma_config.EMBEDDING_QUERY_CACHE_SIZE)
+    
+    def _embed(self, texts: List[str], query: bool = False) -> List[Any]:
+        """
+        Эмбеддинги текстов (через кеш, если он включен). query=True — поисковые
+        запросы: в дисковый кеш не записываются, кешируются в памяти.
+        """
+        with stage("embedding"):
+            if query and hasattr(self.embedding_function, "embed_queries"):
+                return list(self.embedding_function.embed_queries(list(texts)))
+            return list(self.embedding_function(list(texts)))
+    
+    def _initial_documents(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Встроенные начальные данные по коллекциям"""
         # 1. Минералы (5 ключевых)
         minerals = [
             {
@@ -256,18 +592,6 @@ class ChromaService:
             }
         ]
         
-        # Добавление минералов
-        mineral_docs = [m["document"] for m in minerals]
-        mineral_meta = [m["metadata"] for m in minerals]
-        mineral_ids = [m["id"] for m in minerals]
-        
-        self.minerals_collection.add(
-            documents=mineral_docs,
-            metadatas=mineral_meta,
-            ids=mineral_ids
-        )
-        print(f"✅ Загружено {len(minerals)} минералов в коллекцию '{self.COLLECTIONS['minerals']}'")
-        
         # 2. Сделки (5 примеров)
         deals = [
             {
@@ -407,18 +731,6 @@ class ChromaService:
             }
         ]
         
-        # Добавление сделок
-        deal_docs = [d["document"] for d in deals]
-        deal_meta = [d["metadata"] for d in deals]
-        deal_ids = [d["id"] for d in deals]
-        
-        self.deals_collection.add(
-            documents=deal_docs,
-            metadatas=deal_meta,
-            ids=deal_ids
-        )
-        print(f"✅ Загружено {len(deals)} сделок в коллекцию '{self.COLLECTIONS['deals']}'")
-        
         # 3. KYC документы (4 контрагента)
         kyc = [
             {
@@ -541,43 +853,582 @@ class ChromaService:
             }
         ]
         
-        # Добавление KYC
-        kyc_docs = [k["document"] for k in kyc]
-        kyc_meta = [k["metadata"] for k in kyc]
-        kyc_ids = [k["id"] for k in kyc]
+        return {"minerals": minerals, "deals": deals, "kyc": kyc}
+    
+    def load_initial_data(self) -> bool:
+        """
+        Загрузка начальных тестовых данных.
+        Инкрементальная: повторный вызов без изменений данных стоит одно чтение метаданных на коллекцию.
+        """
+        if self.is_test_mode:
+            print("📊 Загрузка тестовых данных в локальную ChromaDB...")
+        else:
+            print("📊 Загрузка начальных данных OpenMineralHub...")
         
-        self.kyc_collection.add(
-            documents=kyc_docs,
-            metadatas=kyc_meta,
-            ids=kyc_ids
-        )
-        print(f"✅ Загружено {len(kyc)} KYC профилей в коллекцию '{self.COLLECTIONS['kyc']}'")
+        success = True
+        labels = {"minerals": "минералов", "deals": "сделок", "kyc": "KYC профилей"}
+        for key, documents in self._initial_documents().items():
+            result = self.sync_documents(key, documents, source=self.SEED_SOURCE)
+            success &= result["success"]
+            chunks = self._chunk_collection(key)
+            if chunks is not None and chunks.count() == 0 and result.get("unchanged"):
+                # Данные загружены до включения чанков — чанки строятся из коллекции
+                success &= self.rebuild_chunks(key)["success"]
+            print(
+                f"✅ {len(documents)} {labels[key]} в коллекции '{self.COLLECTIONS[key]}': "
+                f"записано {result.get('written', 0)}, без изменений {result.get('unchanged', 0)}, удалено {result.get('deleted', 0)}"
+            )
         
-        # Обновление статистики
-        stats = self.get_collection_stats()
         print(f"\n📊 Финальная статистика:")
         for key, coll in self.COLLECTIONS.items():
             count = getattr(self, f"{key}_collection").count()
             print(f"   • {key}: {count} документов")
         
-        return True
+        return success
     
-    def search_minerals(self, query: str, n_results: int = 3, filters: Optional[Dict] = None) -> Dict[str, Any]:
-        """Семантический поиск по минералам с фильтрами"""
+    def _get_collection(self, collection_name: str):
+        """Коллекция по короткому имени (minerals/deals/kyc)"""
+        coll_map = {
+            "minerals": self.minerals_collection,
+            "deals": self.deals_collection,
+            "kyc": self.kyc_collection
+        }
+        return coll_map.get(collection_name)
+    
+    def _query_collection(
+        self,
+        collection_name: str,
+        query_texts: List[str],
+        n_results: int,
+        where: Dict[str, Any],
+        query_embeddings: Optional[List[Any]] = None
+    ) -> List[Dict[str, list]]:
+        """
+        Один вызов query() для набора запросов; результаты разбиваются по запросам.
+        Строки результатов кешируются в search_cache, в Chroma уходят только промахи.
+        query_embeddings — уже посчитанные эмбеддинги query_texts (не считаются повторно).
+        """
+        collection = self._get_collection(collection_name)
+        if collection is None:
+            raise ValueError(f"Unknown collection: {collection_name}")
+        
+        cache_keys = [self.search_cache.make_key(collection_name, q, where, n_results) for q in query_texts]
+        rows: List[Optional[Dict[str, list]]] = [self.search_cache.get(key) for key in cache_keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if not missing:
+            return rows
+        
+        if query_embeddings is not None:
+            embeddings = [query_embeddings[i] for i in missing]
+        else:
+            embeddings = self._embed([query_texts[i] for i in missing], query=True)
+        
+        chunks = self._chunk_collection(collection_name)
+        with stage("vector_query"):
+            if chunks is not None and self._chunks_ready(chunks):
+                # Поиск по чанкам: с запасом, т.к. несколько чанков могут принадлежать одному документу
+                results = chunks.query(
+                    query_embeddings=embeddings,
+                    n_results=n_results * chroma_config.CHUNK_OVERSAMPLE,
+                    where=where
+                )
+            else:
+                chunks = None
+                results = collection.query(
+                    query_embeddings=embeddings,
+                    n_results=n_results,
+                    where=where
+                )
+        
+        with stage("postprocess"):
+            for pos, i in enumerate(missing):
+                rows[i] = {
+                    "ids": results["ids"][pos] or [],
+                    "documents": results["documents"][pos] or [],
+                    "metadatas": results["metadatas"][pos] or [],
+                    "distances": results["distances"][pos] or []
+                }
+                if chunks is not None:
+                    rows[i] = collapse_to_parents(rows[i], n_results)
+                self.search_cache.set(cache_keys[i], rows[i])
+        return rows
+    
+    def _chunk_collection(self, collection_name: str):
+        """
+        Коллекция чанков (None — поиск идет по основной коллекции).
+        Шардированный индекс сделок используется и при выключенном CHUNKING_ENABLED.
+        """
+        chunks = self.chunk_collections.get(collection_name)
+        if isinstance(chunks, ShardedCollection) or chroma_config.CHUNKING_ENABLED:
+            return chunks
+        return None
+    
+    @staticmethod
+    def _chunks_ready(chunks) -> bool:
+        """Индекс чанков заполнен (шарды: хотя бы один шард создан, без count() каждого шарда)"""
+        if isinstance(chunks, ShardedCollection):
+            return bool(chunks.shards)
+        return chunks.count() > 0
+    
+    def _chunk_collection_names(self) -> List[str]:
+        """Имена коллекций чанков и шардов в Chroma"""
+        names = []
+        for key, chunks in self.chunk_collections.items():
+            if isinstance(chunks, ShardedCollection):
+                names.extend(chunks.names())
+            else:
+                names.append(self.COLLECTIONS[key] + self.CHUNK_COLLECTION_SUFFIX)
+        return names
+    
+    def _write_chunks(self, collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> int:
+        """
+        Запись чанков документов (upsert) и удаление лишних чанков от прежних версий.
+        Текст короткого документа — единственный чанк, его эмбеддинг берется из кеша.
+        Возвращает число записанных чанков.
+        """
+        chunks_collection = self._chunk_collection(collection_name)
+        if chunks_collection is None or not ids:
+            return 0
+        
+        # Без CHUNKING_ENABLED (шарды сделок) документ записывается одним чанком
+        split = chroma_config.CHUNKING_ENABLED and collection_name in self.split_collections
+        max_tokens = chroma_config.CHUNK_MAX_TOKENS if split else sys.maxsize
+        chunks = [
+            chunk
+            for doc_id, document, metadata in zip(ids, documents, metadatas)
+            for chunk in build_chunks(doc_id, document, metadata, max_tokens, chroma_config.CHUNK_OVERLAP_TOKENS)
+        ]
+        if chunks:
+            texts = [chunk["document"] for chunk in chunks]
+            chunks_collection.upsert(
+                ids=[chunk["id"] for chunk in chunks],
+                documents=texts,
+                metadatas=[chunk["metadata"] for chunk in chunks],
+                embeddings=self._embed(texts)
+            )
+        
+        current = {chunk["id"] for chunk in chunks}
+        existing = chunks_collection.get(where={"parent_id": {"$in": list(ids)}}, include=[])["ids"] or []
+        stale = [chunk_id for chunk_id in existing if chunk_id not in current]
+        if stale:
+            chunks_collection.delete(ids=stale)
+        return len(chunks)
+    
+    def _delete_chunks(self, collection_name: str, ids: List[str]):
+        """Удаление чанков удаленных документов"""
+        chunks_collection = self._chunk_collection(collection_name)
+        if chunks_collection is not None and ids:
+            chunks_collection.delete(where={"parent_id": {"$in": list(ids)}})
+    
+    def rebuild_chunks(self, collection_name: str) -> Dict[str, Any]:
+        """Построение чанков для всех документов коллекции (постранично)"""
+        if self._chunk_collection(collection_name) is None:
+            return {"success": False, "error": f"Chunking is not enabled for collection: {collection_name}"}
+        
+        written = 0
         try:
-            where_filter = filters or {}
-            if self.is_test_mode:
-                where_filter["environment"] = "test"
-            
-            results = self.minerals_collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where=where_filter
+            for page in self._scan_pages(collection_name, include=["documents", "metadatas"]):
+                written += self._write_chunks(collection_name, page["ids"], page["documents"] or [], page["metadatas"] or [])
+            self.search_cache.invalidate(collection_name)
+        except Exception as e:
+            logger.error(f"Ошибка построения чанков '{collection_name}': {e}")
+            return {"success": False, "error": str(e), "collection": collection_name, "chunks": written}
+        
+        logger.info(f"Чанки '{collection_name}' построены: {written}")
+        return {"success": True, "collection": collection_name, "chunks": written}
+    
+    def _lexical_index(self, collection_name: str) -> Optional[LexicalIndex]:
+        """
+        Лексический индекс коллекции или None, пока он не построен. Индекс строится
+        в фоне постраничным чтением коллекции, дальше поддерживается записями сервиса.
+        Записи других процессов индекс не видит, поэтому старше LEXICAL_INDEX_TTL_SECONDS
+        он перечитывается в фоне; до замены поиск идет по прежнему индексу.
+        """
+        with self._lexical_lock:
+            index = self.lexical_indexes.get(collection_name)
+            built_at = self._lexical_built_at.get(collection_name, 0.0)
+            expired = index is None or time.monotonic() - built_at >= chroma_config.LEXICAL_INDEX_TTL_SECONDS
+            if expired and collection_name not in self._lexical_pending:
+                self._lexical_pending[collection_name] = []
+                threading.Thread(
+                    target=self._rebuild_lexical_index,
+                    args=(collection_name, self._lexical_generation),
+                    name="lexical-index-rebuild",
+                    daemon=True
+                ).start()
+            return index
+    
+    def _rebuild_lexical_index(self, collection_name: str, generation: int) -> None:
+        """
+        Фоновое построение индекса: чтение коллекции без блокировки, затем повтор
+        записей, пришедших во время чтения, и замена индекса под блокировкой
+        """
+        try:
+            fresh = LexicalIndex()
+            started = time.monotonic()
+            for page in self._scan_pages(collection_name, include=["documents", "metadatas"]):
+                fresh.add_many(page["ids"], page["documents"] or [], page["metadatas"] or [])
+        except Exception as e:
+            logger.warning(f"Лексический индекс '{collection_name}' не построен, используется прежний: {e}")
+            with self._lexical_lock:
+                if generation == self._lexical_generation:
+                    self._lexical_pending.pop(collection_name, None)
+            return
+        
+        with self._lexical_lock:
+            # Сброс состояния (_reset_local_state) во время чтения — индекс устарел, не сохраняется
+            if generation != self._lexical_generation:
+                return
+            for op, args in self._lexical_pending.pop(collection_name, []):
+                getattr(fresh, op)(*args)
+            self.lexical_indexes[collection_name] = fresh
+            self._lexical_built_at[collection_name] = started
+        logger.info(f"Лексический индекс '{collection_name}' построен: {len(fresh)} документов")
+    
+    def _confirm_exact(self, collection_name: str, index: LexicalIndex, candidates: Dict[int, List[str]], where: Dict[str, Any]) -> Dict[int, Dict[str, list]]:
+        """
+        Проверка точных совпадений в Chroma перед ответом без векторного поиска:
+        индекс может отставать от записей других процессов. Удаленные документы
+        убираются из индекса, найденные — обновляются. Запрос без подтвержденных
+        совпадений уходит в обычный гибридный поиск.
+        """
+        ids = list(dict.fromkeys(doc_id for doc_ids in candidates.values() for doc_id in doc_ids))
+        if not ids:
+            return {}
+        stored = self._get_collection(collection_name).get(ids=ids, include=["documents", "metadatas"])
+        fresh = {
+            doc_id: (doc, meta or {})
+            for doc_id, doc, meta in zip(stored["ids"], stored["documents"] or [], stored["metadatas"] or [])
+        }
+        index.remove([doc_id for doc_id in ids if doc_id not in fresh])
+        index.add_many(list(fresh), [doc for doc, _ in fresh.values()], [meta for _, meta in fresh.values()])
+        
+        rows = {}
+        for i, doc_ids in candidates.items():
+            row = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for doc_id in doc_ids:
+                if doc_id in fresh and matches_where(fresh[doc_id][1], where):
+                    row["ids"].append(doc_id)
+                    row["documents"].append(fresh[doc_id][0])
+                    row["metadatas"].append(fresh[doc_id][1])
+                    row["distances"].append(0.0)
+            if row["ids"]:
+                rows[i] = row
+        return rows
+    
+    def _scan_pages(self, collection_name: str, include: List[str], where: Optional[Dict[str, Any]] = None, page_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Постраничное чтение коллекции через get(limit, offset) вместо одного get() без лимита.
+        Chroma не поддерживает курсор по id, поэтому используется offset; запись
+        в коллекцию во время обхода может сдвинуть страницы.
+        """
+        collection = self._get_collection(collection_name)
+        if collection is None:
+            raise ValueError(f"Unknown collection: {collection_name}")
+        
+        page_size = page_size or chroma_config.SCAN_PAGE_SIZE
+        offset = 0
+        while True:
+            page = collection.get(where=where or None, limit=page_size, offset=offset, include=list(include))
+            ids = page["ids"] or []
+            if ids:
+                yield page
+            if len(ids) < page_size:
+                break
+            offset += page_size
+    
+    def iter_documents(
+        self,
+        collection_name: str,
+        where: Optional[Dict[str, Any]] = None,
+        include: Iterable[str] = ("metadatas",),
+        page_size: Optional[int] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковый обход коллекции: в памяти не больше одной страницы (page_size).
+        
+        include — поля Chroma: "documents", "metadatas", "embeddings" (id возвращается всегда).
+        Элемент: {"id": ..., "document": ..., "metadata": ..., "embedding": ...} только с запрошенными полями.
+        """
+        include = list(include)
+        fields = {"documents": "document", "metadatas": "metadata", "embeddings": "embedding"}
+        unknown = [key for key in include if key not in fields]
+        if unknown:
+            raise ValueError(f"Unsupported include fields: {unknown}")
+        
+        for page in self._scan_pages(collection_name, include, where=where, page_size=page_size):
+            columns = {fields[key]: page.get(key) for key in include}
+            for pos, doc_id in enumerate(page["ids"]):
+                item = {"id": doc_id}
+                for field, values in columns.items():
+                    item[field] = values[pos] if values is not None else None
+                yield item
+    
+    def _deals_aggregates(self, expected_count: Optional[int] = None) -> DealAggregates:
+        """
+        Агрегаты и колоночная аналитика сделок (одна структура, одно чтение).
+        Строятся постраничным чтением метаданных при первом обращении и пересобираются,
+        если число сделок разошлось с count() коллекции или агрегаты старше
+        STATS_REFRESH_SECONDS (запись из другого процесса, в том числе upsert
+        без изменения числа сделок).
+        
+        Чтение идет вне _aggregates_lock: записи сервиса не ждут его и повторяются
+        поверх новых агрегатов, остальные читатели во время перестроения получают
+        прежние агрегаты.
+        """
+        with self._aggregates_lock:
+            aggregates = self.deal_aggregates
+            stale = aggregates is not None and (
+                (expected_count is not None and len(aggregates) != expected_count)
+                or time.time() - aggregates.built_at >= chroma_config.STATS_REFRESH_SECONDS
             )
+            if aggregates is not None and not stale:
+                return aggregates
+        
+        # Первое построение ждет идущее; перестроение при уже идущем отдает прежние агрегаты
+        if not self._aggregates_build_lock.acquire(blocking=aggregates is None):
+            return aggregates
+        try:
+            with self._aggregates_lock:
+                current = self.deal_aggregates
+                if current is not None and current is not aggregates:
+                    return current  # построены другим потоком
+                self._aggregates_pending = []
+            
+            fresh = DealAggregates()
+            try:
+                for page in self._scan_pages("deals", include=["metadatas"]):
+                    fresh.apply(page["ids"], page["metadatas"] or [])
+            except Exception:
+                with self._aggregates_lock:
+                    self._aggregates_pending = None
+                raise
             
+            with self._aggregates_lock:
+                pending, self._aggregates_pending = self._aggregates_pending, None
+                # None — состояние сброшено (_reset_local_state) во время чтения
+                if pending is not None:
+                    for op, args in pending:
+                        getattr(fresh, op)(*args)
+                    self.deal_aggregates = fresh
+            logger.info(f"Агрегаты сделок построены: {len(fresh)} сделок")
+            return fresh
+        finally:
+            self._aggregates_build_lock.release()
+    
+    def _stats_counts_cached(self) -> Dict[str, Any]:
+        """
+        Число чанков по коллекциям и сделок по шардам для статистики. Кешируется
+        вместе с агрегатами: сбрасывается записью сервиса и перечитывается
+        не реже раза в STATS_REFRESH_SECONDS (записи других процессов).
+        """
+        with self._aggregates_lock:
+            cached = self._stats_counts
+            if cached is not None and time.time() - cached["counted_at"] < chroma_config.STATS_REFRESH_SECONDS:
+                return cached
+            generation = self._stats_generation
+        
+        counts = {
+            "counted_at": time.time(),
+            "document_chunks": {key: chunks.count() for key, chunks in self.chunk_collections.items()}
+        }
+        deal_shards = self.chunk_collections.get("deals")
+        if isinstance(deal_shards, ShardedCollection):
+            counts["deal_shards"] = {"key": deal_shards.shard_key, "counts": deal_shards.counts()}
+        with self._aggregates_lock:
+            # Запись во время подсчета сбросила кеш — счетчики могли устареть, не сохраняются
+            if generation == self._stats_generation:
+                self._stats_counts = counts
+        return counts
+    
+    def _on_documents_written(self, collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Обновление производных структур (кеши, лексический индекс, агрегаты) после записи"""
+        self.search_cache.invalidate(collection_name)
+        self.answer_cache.invalidate_documents(ids)
+        with self._lexical_lock:
+            if collection_name in self._lexical_pending:
+                self._lexical_pending[collection_name].append(("add_many", (list(ids), list(documents), list(metadatas))))
+            index = self.lexical_indexes.get(collection_name)
+            if index is not None:
+                index.add_many(ids, documents, metadatas)
+        with self._aggregates_lock:
+            self._stats_counts = None
+            self._stats_generation += 1
+            if collection_name == "deals":
+                if self._aggregates_pending is not None:
+                    self._aggregates_pending.append(("apply", (list(ids), list(metadatas))))
+                if self.deal_aggregates is not None:
+                    self.deal_aggregates.apply(ids, metadatas)
+    
+    def _on_documents_deleted(self, collection_name: str, ids: List[str]):
+        """Обновление производных структур после удаления"""
+        self.search_cache.invalidate(collection_name)
+        self.answer_cache.invalidate_documents(ids)
+        with self._lexical_lock:
+            if collection_name in self._lexical_pending:
+                self._lexical_pending[collection_name].append(("remove", (list(ids),)))
+            index = self.lexical_indexes.get(collection_name)
+            if index is not None:
+                index.remove(ids)
+        with self._aggregates_lock:
+            self._stats_counts = None
+            self._stats_generation += 1
+            if collection_name == "deals":
+                if self._aggregates_pending is not None:
+                    self._aggregates_pending.append(("remove", (list(ids),)))
+                if self.deal_aggregates is not None:
+                    self.deal_aggregates.remove(ids)
+    
+    def _search_rows(
+        self,
+        collection_name: str,
+        query_texts: List[str],
+        n_results: int,
+        where: Dict[str, Any],
+        query_embeddings: Optional[List[Any]] = None
+    ) -> List[Dict[str, list]]:
+        """
+        Гибридный поиск: точные совпадения идентификаторов, затем BM25 и векторные
+        кандидаты, объединенные reciprocal-rank fusion. Запрос, состоящий только из
+        найденных идентификаторов (OMH-004, LEI), отвечается без векторного поиска
+        (совпадения подтверждаются get(ids) в Chroma).
+        """
+        index = self._lexical_index(collection_name) if chroma_config.HYBRID_SEARCH_ENABLED else None
+        if index is None:
+            # Гибридный поиск выключен или индекс еще строится — только векторный поиск
+            return self._query_collection(collection_name, query_texts, n_results, where, query_embeddings)
+        
+        with stage("postprocess"):
+            exact = [index.lookup(q, where) for q in query_texts]
+            confirmed = self._confirm_exact(
+                collection_name,
+                index,
+                {i: exact[i][:n_results] for i, q in enumerate(query_texts) if exact[i] and index.is_identifier_query(q)},
+                where
+            )
+        vector_needed = [i for i in range(len(query_texts)) if i not in confirmed]
+        vector_rows = {}
+        if vector_needed:
+            fetched = self._query_collection(
+                collection_name,
+                [query_texts[i] for i in vector_needed],
+                n_results,
+                where,
+                [query_embeddings[i] for i in vector_needed] if query_embeddings is not None else None
+            )
+            vector_rows = dict(zip(vector_needed, fetched))
+        
+        with stage("postprocess"):
+            rows = []
+            for i, query in enumerate(query_texts):
+                if i in confirmed:
+                    rows.append(confirmed[i])
+                    continue
+                vector_row = vector_rows[i]
+                lexical = [doc_id for doc_id, _ in index.search(query, where, limit=n_results)]
+                fused = reciprocal_rank_fusion([vector_row["ids"], lexical], k=chroma_config.HYBRID_RRF_K)
+                order = exact[i] + [doc_id for doc_id in fused if doc_id not in exact[i]]
+                rows.append(self._fused_row(index, vector_row, order[:n_results], set(exact[i])))
+        return rows
+    
+    def _fused_row(self, index: LexicalIndex, vector_row: Dict[str, list], ids: List[str], exact: set) -> Dict[str, list]:
+        """
+        Строка результатов в формате query(). Документы только из BM25 получают
+        худшую векторную дистанцию строки, точные совпадения — 0.
+        """
+        vector = {
+            doc_id: (doc, meta, dist)
+            for doc_id, doc, meta, dist in zip(vector_row["ids"], vector_row["documents"], vector_row["metadatas"], vector_row["distances"])
+        }
+        worst_distance = max(vector_row["distances"], default=1.0)
+        row = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for doc_id in ids:
+            if doc_id in vector:
+                doc, meta, dist = vector[doc_id]
+            else:
+                stored = index.get(doc_id)
+                if stored is None:
+                    continue
+                doc, meta = stored
+                dist = worst_distance
+            row["ids"].append(doc_id)
+            row["documents"].append(doc)
+            row["metadatas"].append(meta)
+            row["distances"].append(0.0 if doc_id in exact else dist)
+        return row
+    
+    def _rerank_candidates(self, n_results: int, rerank: bool) -> int:
+        """Число кандидатов из Chroma: с re-ranking запрашивается n_results × RERANK_OVERSAMPLE"""
+        if not rerank:
+            return n_results
+        return max(n_results, min(n_results * chroma_config.RERANK_OVERSAMPLE, chroma_config.RERANK_MAX_CANDIDATES))
+    
+    def _rerank_row(self, query: str, row: Dict[str, list], n_results: int) -> tuple:
+        """
+        Re-ranking строки результатов cross-encoder в пределах RERANK_BUDGET_MS.
+        При исчерпании бюджета или ошибке модели остается векторный порядок.
+        Возвращает (строка из n_results лучших, отчет re-ranking).
+        """
+        try:
+            with stage("rerank"):
+                info = self.reranker.rerank(query, row["ids"], row["documents"], budget_ms=chroma_config.RERANK_BUDGET_MS)
+            order = info.pop("order")
+            info.pop("scores")
+        except Exception as e:
+            logger.error(f"Ошибка re-ranking, используется векторный порядок: {e}")
+            order = list(range(len(row["ids"])))
+            info = {"reranked": False, "error": str(e)}
+        
+        info["candidates"] = len(order)
+        top = order[:n_results]
+        return {key: [values[i] for i in top] for key, values in row.items()}, info
+    
+    def _minerals_where(self, filters: Optional[Dict] = None) -> Dict[str, Any]:
+        """where-фильтр для поиска минералов: каждое условие отдельной клаузой через $and"""
+        where_filter = dict(filters or {})
+        if self.is_test_mode:
+            where_filter["environment"] = "test"
+        return and_where([{key: value} for key, value in where_filter.items()])
+    
+    @staticmethod
+    def _deal_filter(
+        deal_filter: Optional[DealFilter] = None,
+        status_filter: Optional[str] = None,
+        risk_filter: Optional[str] = None,
+        commodity_filter: Optional[str] = None,
+        region_filter: Optional[str] = None
+    ) -> DealFilter:
+        """DealFilter из typed фильтра и отдельных аргументов (отдельные аргументы имеют приоритет)"""
+        overrides = {
+            "status": status_filter,
+            "risk_level": risk_filter,
+            "commodity": commodity_filter,
+            "region": region_filter
+        }
+        base = deal_filter.model_dump() if deal_filter is not None else {}
+        return DealFilter(**{**base, **{key: value for key, value in overrides.items() if value}})
+    
+    def _deals_where(self, deal_filter: Optional[DealFilter] = None) -> Dict[str, Any]:
+        """
+        where-фильтр для поиска сделок: условия DealFilter через $and, включая
+        диапазоны суммы и дат. commodity/region выбирают шарды при DEALS_SHARD_KEY.
+        """
+        return (deal_filter or DealFilter()).to_where("test" if self.is_test_mode else None)
+    
+    def _kyc_where(self, aml_filter: Optional[str] = "clean") -> Dict[str, Any]:
+        """where-фильтр для поиска KYC"""
+        return and_where([
+            {"aml_status": aml_filter} if aml_filter else {},
+            {"environment": "test"} if self.is_test_mode else {}
+        ])
+    
+    def _minerals_response(self, query: str, filters: Optional[Dict], row: Dict[str, list]) -> Dict[str, Any]:
+        """Формирование ответа поиска минералов из строки результатов Chroma"""
+        with stage("postprocess"):
             enriched_results = []
-            for doc, meta, dist in zip(results["documents"][0] or [], results["metadatas"][0] or [], results["distances"][0] or []):
+            for doc_id, doc, meta, dist in zip(row["ids"], row["documents"], row["metadatas"], row["distances"]):
                 enriched = {
+                    "id": doc_id,
                     "document": doc,
                     "metadata": meta,
                     "distance": dist,
@@ -586,96 +1437,27 @@ class ChromaService:
                     "current_price": f"${meta.get('current_price', 0):,.0f}/{meta.get('unit', 'N/A')}"
                 }
                 enriched_results.append(enriched)
-            
-            return {
-                "success": True,
-                "query": query,
-                "filters": filters,
-                "results_count": len(enriched_results),
-                "results": enriched_results,
-                "processing_time_ms": 0,  # TODO: измерить реальное время
-                "environment": "test" if self.is_test_mode else "production"
-            }
-        except Exception as e:
-            logger.error(f"Ошибка поиска минералов: {e}")
-            return {"success": False, "error": str(e), "query": query}
-
-    def rag_query(self, query: str, n_results: int = 3, filters: Optional[Dict] = None) -> Dict[str, Any]:
-        """RAG query: Chroma search + OpenAI LLM summary"""
-        try:
-            # Step 1: Chroma search
-            search_results = self.search_minerals(query, n_results, filters)
-            if not search_results["success"]:
-                return search_results
-            
-            # Step 2: Prepare context from results
-            context_docs = [r["document"] for r in search_results["results"]]
-            context = "\n\n".join(context_docs)
-            
-            # Step 3: LLM prompt
-            prompt_template = PromptTemplate(
-                input_variables=["query", "context"],
-                template="""Based on the following mineral commodity information, answer the user's query in Russian.
-
-Context:
-{context}
-
-User Query: {query}
-
-Provide a concise, informative response focusing on key facts, prices, producers, and risks. Include any relevant market insights."""
-            )
-            
-            # Step 4: OpenAI call
-            if self.is_test_mode:
-                # Mock response for testing
-                llm_response = "Мок-ответ: Для вашего запроса найдена информация о минералах. В production режиме будет использован OpenAI."
-            else:
-                llm = ChatOpenAI(
-                    model="gpt-4-turbo-preview",
-                    temperature=0.1,
-                    openai_api_key=os.getenv("OPENAI_API_KEY")
-                )
-                chain = prompt_template | llm | StrOutputParser()
-                llm_response = chain.invoke({"query": query, "context": context})
-            
-            return {
-                "success": True,
-                "query": query,
-                "rag_enabled": True,
-                "chroma_results_count": search_results["results_count"],
-                "llm_model": "gpt-4-turbo-preview" if not self.is_test_mode else "mock",
-                "response": llm_response,
-                "sources": [r["metadata"] for r in search_results["results"]],
-                "environment": "test" if self.is_test_mode else "production"
-            }
-        except Exception as e:
-            logger.error(f"Ошибка RAG query: {e}")
-            return {"success": False, "error": str(e), "query": query}
+        
+        return {
+            "success": True,
+            "query": query,
+            "filters": filters,
+            "results_count": len(enriched_results),
+            "results": enriched_results,
+            "environment": "test" if self.is_test_mode else "production"
+        }
     
-    def search_deals(self, query: str, n_results: int = 5, status_filter: Optional[str] = None, risk_filter: Optional[str] = None) -> Dict[str, Any]:
-        """Поиск по торговым сделкам"""
-        try:
-            where_filter = {}
-            if status_filter:
-                where_filter["status"] = status_filter
-            if risk_filter:
-                where_filter["risk_level"] = risk_filter
-            if self.is_test_mode:
-                where_filter["environment"] = "test"
-            
-            results = self.deals_collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where=where_filter
-            )
-            
+    def _deals_response(self, query: str, deal_filter: Optional[DealFilter], row: Dict[str, list]) -> Dict[str, Any]:
+        """Формирование ответа поиска сделок из строки результатов Chroma"""
+        with stage("postprocess"):
             enriched_results = []
             total_value = 0
-            for doc, meta, dist in zip(results["documents"][0] or [], results["metadatas"][0] or [], results["distances"][0] or []):
+            for doc_id, doc, meta, dist in zip(row["ids"], row["documents"], row["metadatas"], row["distances"]):
                 deal_value = meta.get("total_amount_usd", 0)
                 total_value += deal_value
                 
                 enriched = {
+                    "id": doc_id,
                     "document": doc,
                     "metadata": meta,
                     "distance": dist,
@@ -686,38 +1468,25 @@ Provide a concise, informative response focusing on key facts, prices, producers
                     "counterparty": meta.get("counterparty", "N/A")
                 }
                 enriched_results.append(enriched)
-            
-            return {
-                "success": True,
-                "query": query,
-                "filters": {"status": status_filter, "risk": risk_filter},
-                "results_count": len(enriched_results),
-                "total_deal_value_usd": total_value,
-                "results": enriched_results,
-                "environment": "test" if self.is_test_mode else "production"
-            }
-        except Exception as e:
-            logger.error(f"Ошибка поиска сделок: {e}")
-            return {"success": False, "error": str(e), "query": query}
+        
+        return {
+            "success": True,
+            "query": query,
+            "filters": (deal_filter or DealFilter()).describe(),
+            "results_count": len(enriched_results),
+            "total_deal_value_usd": total_value,
+            "results": enriched_results,
+            "environment": "test" if self.is_test_mode else "production"
+        }
     
-    def search_kyc(self, query: str, n_results: int = 3, aml_filter: Optional[str] = "clean") -> Dict[str, Any]:
-        """Поиск KYC документов с compliance фильтрами"""
-        try:
-            where_filter = {"aml_status": aml_filter}
-            if self.is_test_mode:
-                where_filter["environment"] = "test"
-            
-            results = self.kyc_collection.query(
-                query_texts=[query],
-                n_results=n_results,
-                where=where_filter
-            )
-            
+    def _kyc_response(self, query: str, aml_filter: Optional[str], row: Dict[str, list]) -> Dict[str, Any]:
+        """Формирование ответа поиска KYC из строки результатов Chroma"""
+        with stage("postprocess"):
             clean_count = 0
             total_risk_score = 0
             enriched_results = []
             
-            for doc, meta, dist in zip(results["documents"][0] or [], results["metadatas"][0] or [], results["distances"][0] or []):
+            for doc_id, doc, meta, dist in zip(row["ids"], row["documents"], row["metadatas"], row["distances"]):
                 risk_score = meta.get("risk_score", 0)
                 total_risk_score += risk_score
                 
@@ -725,6 +1494,7 @@ Provide a concise, informative response focusing on key facts, prices, producers
                     clean_count += 1
                 
                 enriched = {
+                    "id": doc_id,
                     "document": doc,
                     "metadata": meta,
                     "distance": dist,
@@ -740,61 +1510,470 @@ Provide a concise, informative response focusing on key facts, prices, producers
                 enriched_results.append(enriched)
             
             avg_risk = total_risk_score / len(enriched_results) if enriched_results else 0
+        
+        return {
+            "success": True,
+            "query": query,
+            "aml_filter": aml_filter,
+            "results_count": len(enriched_results),
+            "clean_entities": clean_count,
+            "average_risk_score": round(avg_risk, 1),
+            "results": enriched_results,
+            "environment": "test" if self.is_test_mode else "production"
+        }
+    
+    @instrumented("search_minerals")
+    def search_minerals(
+        self,
+        query: str,
+        n_results: int = 3,
+        filters: Optional[Dict] = None,
+        rerank: Optional[bool] = None,
+        query_embedding: Optional[Any] = None
+    ) -> Dict[str, Any]:
+        """
+        Семантический поиск по минералам с фильтрами (rerank=None → RERANK_ENABLED).
+        query_embedding — уже посчитанный эмбеддинг запроса.
+        """
+        try:
+            rerank = chroma_config.RERANK_ENABLED if rerank is None else rerank
+            row = self._search_rows(
+                "minerals",
+                [query],
+                self._rerank_candidates(n_results, rerank),
+                self._minerals_where(filters),
+                [query_embedding] if query_embedding is not None else None
+            )[0]
+            if not rerank:
+                return self._minerals_response(query, filters, row)
+            row, rerank_info = self._rerank_row(query, row, n_results)
+            return {**self._minerals_response(query, filters, row), "rerank": rerank_info}
+        except Exception as e:
+            logger.error(f"Ошибка поиска минералов: {e}")
+            return {"success": False, "error": str(e), "query": query}
+
+    def rag_prompt(self) -> PromptTemplate:
+        """Prompt RAG запроса по минералам"""
+        return PromptTemplate(
+            input_variables=["query", "context"],
+            template="""Based on the following mineral commodity information, answer the user's query in Russian.
+
+Context:
+{context}
+
+User Query: {query}
+
+Provide a concise, informative response focusing on key facts, prices, producers, and risks. Include any relevant market insights."""
+        )
+    
+    def rag_llm(self, streaming: bool = False) -> ChatOpenAI:
+        """
+        ChatOpenAI клиент RAG. Создается один раз на режим streaming; sync и async
+        HTTP пулы общие, поэтому соединение, прогретое при старте, переиспользуется.
+        """
+        with self._llm_lock:
+            llm = self._rag_llms.get(streaming)
+            if llm is None:
+                if self._llm_http_client is None:
+                    self._llm_http_client = httpx.Client(timeout=60.0)
+                    self._llm_async_http_client = httpx.AsyncClient(timeout=60.0)
+                llm = ChatOpenAI(
+                    model=self.RAG_LLM_MODEL,
+                    temperature=0.1,
+                    openai_api_key=os.getenv("OPENAI_API_KEY"),
+                    streaming=streaming,
+                    http_client=self._llm_http_client,
+                    http_async_client=self._llm_async_http_client
+                )
+                self._rag_llms[streaming] = llm
+            return llm
+    
+    def rag_chain(self, streaming: bool = False):
+        """LangChain цепочка prompt → OpenAI → str (streaming=True для astream)"""
+        return self.rag_prompt() | self.rag_llm(streaming) | StrOutputParser()
+    
+    def warm_up_llm(self) -> Optional[str]:
+        """
+        Прогрев LLM клиента: создание ChatOpenAI и metadata запрос к модели
+        (без генерации токенов) через общий HTTP пул. None — клиент прогрет,
+        иначе причина пропуска ("mock", "not_configured").
+        """
+        if self.is_test_mode:
+            return "mock"
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return "not_configured"
+        self.rag_llm()
+        OpenAI(api_key=api_key, http_client=self._llm_http_client, max_retries=0).models.retrieve(self.RAG_LLM_MODEL)
+        return None
+    
+    @staticmethod
+    def rag_candidates(n_results: int) -> int:
+        """Число документов поиска для RAG: с запасом, чтобы заполнить бюджет контекста"""
+        return max(n_results, min(n_results * chroma_config.RAG_CONTEXT_OVERFETCH, chroma_config.RAG_CONTEXT_MAX_CANDIDATES))
+    
+    def rag_context(self, query: str, search_results: Dict[str, Any]) -> Dict[str, Any]:
+        """Контекст для LLM из результатов поиска в пределах бюджета токенов (см. ContextBuilder.build)"""
+        return self.context_builder.build(query, search_results["results"])
+    
+    @staticmethod
+    def context_stats(packed: Dict[str, Any]) -> Dict[str, Any]:
+        """Сводка упаковки контекста для ответа API"""
+        return {
+            "tokens": packed["tokens"],
+            "budget": packed["budget"],
+            "documents": len(packed["results"]),
+            "candidates": packed["candidates"],
+            "duplicates": packed["duplicates"],
+            "trimmed": packed["trimmed"]
+        }
+    
+    @instrumented("rag_query")
+    def rag_query(self, query: str, n_results: int = 3, filters: Optional[Dict] = None) -> Dict[str, Any]:
+        """
+        RAG query: Chroma search + OpenAI LLM summary.
+        Поиск берет документы с запасом (rag_candidates), контекст упаковывается
+        в бюджет токенов модели; sources — документы, вошедшие в контекст.
+        Ответ на перефразированный запрос берется из семантического кеша, если поиск
+        вернул те же документы-источники (вызов LLM пропускается).
+        """
+        try:
+            # Step 1: Chroma search (эмбеддинг запроса считается один раз для поиска и кеша)
+            embedding = self._embed([query], query=True)[0]
+            search_results = self.search_minerals(query, self.rag_candidates(n_results), filters, query_embedding=embedding)
+            if not search_results["success"]:
+                return search_results
+            source_ids = [r["id"] for r in search_results["results"]]
             
-            return {
+            # Step 2: Semantic answer cache
+            cache_scope = json.dumps({"filters": filters or {}, "n_results": n_results}, sort_keys=True, default=str)
+            if chroma_config.RAG_CACHE_ENABLED:
+                cached = self.answer_cache.lookup(embedding, cache_scope)
+                if cached is not None:
+                    if set(cached["source_ids"]) == set(source_ids):
+                        return {
+                            **cached["payload"],
+                            "query": query,
+                            "cache": {"hit": True, "similarity": round(cached["similarity"], 4), "cached_query": cached["query"]}
+                        }
+                    self.answer_cache.reject()
+            
+            # Step 3: Pack context into the model token budget
+            with stage("prompt_build"):
+                packed = self.rag_context(query, search_results)
+            context = packed["context"]
+            
+            # Step 4: OpenAI call
+            with stage("llm"):
+                if self.is_test_mode:
+                    # Mock response for testing
+                    llm_response = self.RAG_MOCK_RESPONSE
+                else:
+                    chain = self.rag_chain()
+                    llm_response = chain.invoke({"query": query, "context": context})
+            
+            payload = {
                 "success": True,
-                "query": query,
-                "aml_filter": aml_filter,
-                "results_count": len(enriched_results),
-                "clean_entities": clean_count,
-                "average_risk_score": round(avg_risk, 1),
-                "results": enriched_results,
+                "rag_enabled": True,
+                "chroma_results_count": search_results["results_count"],
+                "llm_model": self.RAG_LLM_MODEL if not self.is_test_mode else "mock",
+                "response": llm_response,
+                "sources": [r["metadata"] for r in packed["results"]],
+                "context": self.context_stats(packed),
                 "environment": "test" if self.is_test_mode else "production"
             }
+            if chroma_config.RAG_CACHE_ENABLED:
+                self.answer_cache.store(query, embedding, cache_scope, source_ids, payload)
+            
+            return {**payload, "query": query, "cache": {"hit": False}}
+        except Exception as e:
+            logger.error(f"Ошибка RAG query: {e}")
+            return {"success": False, "error": str(e), "query": query}
+    
+    @instrumented("search_deals")
+    def search_deals(
+        self,
+        query: str,
+        n_results: int = 5,
+        status_filter: Optional[str] = None,
+        risk_filter: Optional[str] = None,
+        rerank: Optional[bool] = None,
+        commodity_filter: Optional[str] = None,
+        region_filter: Optional[str] = None,
+        deal_filter: Optional[DealFilter] = None
+    ) -> Dict[str, Any]:
+        """
+        Поиск по торговым сделкам (rerank=None → RERANK_ENABLED).
+        deal_filter — контрагент, диапазоны суммы и дат; все условия выполняются
+        в Chroma (where), а не фильтрацией результатов.
+        При DEALS_SHARD_KEY фильтр по ключу шардирования опрашивает только свой шард.
+        """
+        try:
+            rerank = chroma_config.RERANK_ENABLED if rerank is None else rerank
+            deal_filter = self._deal_filter(deal_filter, status_filter, risk_filter, commodity_filter, region_filter)
+            row = self._search_rows("deals", [query], self._rerank_candidates(n_results, rerank), self._deals_where(deal_filter))[0]
+            if not rerank:
+                return self._deals_response(query, deal_filter, row)
+            row, rerank_info = self._rerank_row(query, row, n_results)
+            return {**self._deals_response(query, deal_filter, row), "rerank": rerank_info}
+        except Exception as e:
+            logger.error(f"Ошибка поиска сделок: {e}")
+            return {"success": False, "error": str(e), "query": query}
+    
+    @instrumented("search_kyc")
+    def search_kyc(self, query: str, n_results: int = 3, aml_filter: Optional[str] = "clean") -> Dict[str, Any]:
+        """Поиск KYC документов с compliance фильтрами"""
+        try:
+            row = self._search_rows("kyc", [query], n_results, self._kyc_where(aml_filter))[0]
+            return self._kyc_response(query, aml_filter, row)
         except Exception as e:
             logger.error(f"Ошибка поиска KYC: {e}")
             return {"success": False, "error": str(e), "query": query}
     
+    def _batch_item_spec(self, item: Dict[str, Any]):
+        """Разбор элемента пакетного поиска: (коллекция, where, n_results, форматтер ответа)"""
+        collection_name = item.get("collection", "minerals")
+        query = item["query"]
+        
+        if collection_name == "minerals":
+            filters = item.get("filters")
+            n_results = item.get("n_results", 3)
+            return collection_name, self._minerals_where(filters), n_results, \
+                lambda row: self._minerals_response(query, filters, row)
+        if collection_name == "deals":
+            deal_filter = self._deal_filter(
+                DealFilter(**(item.get("deal_filter") or {})),
+                item.get("status_filter"),
+                item.get("risk_filter"),
+                item.get("commodity_filter"),
+                item.get("region_filter")
+            )
+            n_results = item.get("n_results", 5)
+            return collection_name, self._deals_where(deal_filter), n_results, \
+                lambda row: self._deals_response(query, deal_filter, row)
+        if collection_name == "kyc":
+            aml_filter = item.get("aml_filter", "clean")
+            n_results = item.get("n_results", 3)
+            return collection_name, self._kyc_where(aml_filter), n_results, \
+                lambda row: self._kyc_response(query, aml_filter, row)
+        raise ValueError(f"Unknown collection: {collection_name}")
+    
+    @instrumented("search_batch")
+    def search_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Пакетный поиск по нескольким запросам и коллекциям.
+        Запросы группируются по (коллекция, where-фильтр): на каждую группу
+        выполняется один query() со многими query_texts, результаты
+        раскладываются обратно в исходном порядке.
+        
+        Элемент запроса: {"collection": "minerals"|"deals"|"kyc", "query": ..., "n_results": ...}
+        плюс фильтры одиночного метода: filters / status_filter, risk_filter, deal_filter (поля DealFilter) / aml_filter.
+        """
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        groups: Dict[tuple, List[tuple]] = {}
+        
+        for idx, item in enumerate(queries):
+            try:
+                collection_name, where_filter, n_results, formatter = self._batch_item_spec(item)
+            except Exception as e:
+                responses[idx] = {"success": False, "error": str(e), "query": item.get("query")}
+                continue
+            group_key = (collection_name, json.dumps(where_filter, sort_keys=True, default=str))
+            groups.setdefault(group_key, []).append((idx, item["query"], n_results, where_filter, formatter))
+        
+        for (collection_name, _), members in groups.items():
+            try:
+                rows = self._search_rows(
+                    collection_name,
+                    [m[1] for m in members],
+                    max(m[2] for m in members),
+                    members[0][3]
+                )
+                for (idx, query, n_results, _, formatter), row in zip(members, rows):
+                    # Группа запрошена с максимальным n_results — обрезаем под каждый запрос
+                    responses[idx] = formatter({k: v[:n_results] for k, v in row.items()})
+            except Exception as e:
+                logger.error(f"Ошибка пакетного поиска в '{collection_name}': {e}")
+                for idx, query, *_ in members:
+                    responses[idx] = {"success": False, "error": str(e), "query": query}
+        
+        return {
+            "success": all(r["success"] for r in responses),
+            "results_count": len(responses),
+            "round_trips": len(groups),
+            "results": responses,
+            "environment": "test" if self.is_test_mode else "production"
+        }
+    
+    def search_minerals_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетный поиск по минералам (элементы: query, n_results, filters)"""
+        return self.search_batch([{**q, "collection": "minerals"} for q in queries])
+    
+    def search_deals_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетный поиск по сделкам (элементы: query, n_results, status_filter, risk_filter, deal_filter)"""
+        return self.search_batch([{**q, "collection": "deals"} for q in queries])
+    
+    def search_kyc_batch(self, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетный поиск по KYC (элементы: query, n_results, aml_filter)"""
+        return self.search_batch([{**q, "collection": "kyc"} for q in queries])
+    
+    @staticmethod
+    def normalized_score(distance: float) -> float:
+        """Дистанция → score в (0, 1]; сравним между коллекциями с одной embedding моделью"""
+        return 1.0 / (1.0 + max(distance, 0.0))
+    
+    @instrumented("search_all")
+    def search_all(
+        self,
+        query: str,
+        n_results: int = 3,
+        collections: Optional[List[str]] = None,
+        aml_filter: Optional[str] = "clean"
+    ) -> Dict[str, Any]:
+        """
+        Федеративный поиск по minerals, deals и KYC.
+        Запрос эмбеддится один раз, коллекции опрашиваются параллельно; ответ содержит
+        результаты по коллекциям и общий список, отсортированный по normalized_score.
+        Ошибка одной коллекции не отменяет результаты остальных.
+        """
+        collections = collections or list(self.COLLECTIONS)
+        unknown = [name for name in collections if name not in self.COLLECTIONS]
+        if unknown:
+            return {"success": False, "error": f"Unknown collection: {', '.join(unknown)}", "query": query}
+        
+        try:
+            embedding = self._embed([query], query=True)[0]
+        except Exception as e:
+            logger.error(f"Ошибка эмбеддинга запроса федеративного поиска: {e}")
+            return {"success": False, "error": str(e), "query": query}
+        
+        wheres = {
+            "minerals": self._minerals_where(),
+            "deals": self._deals_where(),
+            "kyc": self._kyc_where(aml_filter)
+        }
+        formatters = {
+            "minerals": lambda row: self._minerals_response(query, None, row),
+            "deals": lambda row: self._deals_response(query, None, row),
+            "kyc": lambda row: self._kyc_response(query, aml_filter, row)
+        }
+        futures = {
+            name: self._fanout_executor.submit(propagate(self._search_rows, name, [query], n_results, wheres[name], [embedding]))
+            for name in collections
+        }
+        
+        by_collection: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        merged = []
+        for name, future in futures.items():
+            try:
+                row = future.result()[0]
+            except Exception as e:
+                logger.error(f"Ошибка федеративного поиска в '{name}': {e}")
+                errors[name] = str(e)
+                continue
+            by_collection[name] = formatters[name](row)
+            for doc_id, doc, meta, dist in zip(row["ids"], row["documents"], row["metadatas"], row["distances"]):
+                merged.append({
+                    "collection": name,
+                    "id": doc_id,
+                    "document": doc,
+                    "metadata": meta,
+                    "distance": dist,
+                    "score": self.normalized_score(dist)
+                })
+        merged.sort(key=lambda item: item["score"], reverse=True)
+        
+        return {
+            "success": len(errors) < len(collections),
+            "partial": bool(errors),
+            "query": query,
+            "results_count": len(merged),
+            "results": merged,
+            "by_collection": by_collection,
+            "errors": errors,
+            "environment": "test" if self.is_test_mode else "production"
+        }
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """Статистика всех коллекций"""
         try:
+            counts = {key: self._get_collection(key).count() for key in self.COLLECTIONS}
             stats = {
-                "minerals": self.minerals_collection.count(),
-                "deals": self.deals_collection.count(),
-                "kyc": self.kyc_collection.count(),
-                "total_vectors": self.minerals_collection.count() + self.deals_collection.count() + self.kyc_collection.count(),
+                **counts,
+                "total_vectors": sum(counts.values()),
                 "status": "healthy",
                 "last_updated": datetime.now().isoformat(),
                 "environment": "test" if self.is_test_mode else "production"
             }
             
-            # Дополнительная статистика по сделкам
-            deals_meta = self.deals_collection.get()["metadatas"] or []
-            total_deal_value = sum(d.get("total_amount_usd", 0) for d in deals_meta)
-            confirmed_deals = sum(1 for d in deals_meta if d.get("status") == "confirmed")
-            
-            stats["deals_value_usd"] = total_deal_value
-            stats["confirmed_deals"] = confirmed_deals
-            stats["deals_avg_value"] = total_deal_value / len(deals_meta) if deals_meta else 0
+            # Статистика по сделкам из материализованных агрегатов (без чтения коллекции)
+            deals = self._deals_aggregates(expected_count=counts["deals"]).snapshot()
+            stats["deals_value_usd"] = deals["total_value_usd"]
+            stats["confirmed_deals"] = deals["confirmed"]
+            stats["deals_avg_value"] = deals["avg_value_usd"]
+            stats["deals_by_status"] = deals["by_status"]
+            stats["deals_by_commodity"] = deals["by_commodity"]
+            stats["deals_by_region"] = deals["by_region"]
+            # Счетчики чанков и шардов — из кеша рядом с агрегатами
+            chunk_counts = self._stats_counts_cached()
+            stats["document_chunks"] = chunk_counts["document_chunks"]
+            if "deal_shards" in chunk_counts:
+                stats["deal_shards"] = chunk_counts["deal_shards"]
+            if self.replicas:
+                stats["vector_replicas"] = {key: replica.stats() for key, replica in self.replicas.items()}
+            stats["search_cache"] = self.search_cache.stats()
+            stats["latency"] = self.instrumentation.snapshot()
+            stats["rag_cache"] = self.answer_cache.stats()
             
             return {"success": True, "data": stats}
         except Exception as e:
             logger.error(f"Ошибка получения статистики: {e}")
             return {"success": False, "error": str(e)}
     
+    def get_deal_analytics(
+        self,
+        group_by: Iterable[str] = ("commodity", "region", "month"),
+        commodity: Optional[str] = None,
+        region: Optional[str] = None,
+        status: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Аналитика сделок по колонкам метаданных: объем и стоимость по группам
+        (commodity × region × month и т.д.), структура статусов, итоги и средняя цена
+        """
+        started = time.perf_counter()
+        try:
+            group_by = tuple(group_by)
+            analytics = self._deals_aggregates(expected_count=self.deals_collection.count()).analytics
+            filters = {"commodity": commodity, "region": region, "status": status}
+            totals = analytics.group_by((), filters, date_from, date_to)
+            return {
+                "success": True,
+                "group_by": list(group_by),
+                "filters": {**filters, "date_from": date_from, "date_to": date_to},
+                "groups": analytics.group_by(group_by, filters, date_from, date_to),
+                "status_mix": analytics.status_mix({"commodity": commodity, "region": region}, date_from, date_to),
+                "totals": totals[0] if totals else {"count": 0, "volume_tons": 0.0, "value_usd": 0.0, "avg_price_usd_per_ton": None, "value_per_ton_usd": None},
+                "deals": len(analytics),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+                "environment": "test" if self.is_test_mode else "production"
+            }
+        except Exception as e:
+            logger.error(f"Ошибка аналитики сделок: {e}")
+            return {"success": False, "error": str(e)}
+    
     def add_document(self, collection_name: str, document: str, metadata: Dict[str, Any], id: Optional[str] = None) -> Dict[str, Any]:
         """Добавление одного документа в коллекцию"""
         try:
-            coll_map = {
-                "minerals": self.minerals_collection,
-                "deals": self.deals_collection,
-                "kyc": self.kyc_collection
-            }
-            
-            if collection_name not in coll_map:
+            collection = self._get_collection(collection_name)
+            if collection is None:
                 return {"success": False, "error": f"Unknown collection: {collection_name}"}
             
             doc_id = id or f"doc_{uuid.uuid4().hex[:8]}"
+            metadata.update(with_epoch_dates(self._flatten_metadata(metadata)))
             metadata["added_at"] = datetime.now().isoformat()
             metadata["source"] = "api_add_document"
             if self.is_test_mode:
@@ -803,66 +1982,328 @@ Provide a concise, informative response focusing on key facts, prices, producers
             else:
                 metadata["environment"] = "production"
             
-            coll_map[collection_name].add(
+            collection.add(
                 documents=[document],
                 metadatas=[metadata],
-                ids=[doc_id]
+                ids=[doc_id],
+                embeddings=self._embed([document])
             )
+            self._write_chunks(collection_name, [doc_id], [document], [metadata])
+            self._on_documents_written(collection_name, [doc_id], [document], [metadata])
             
             return {
                 "success": True,
                 "collection": collection_name,
                 "document_id": doc_id,
-                "new_count": coll_map[collection_name].count(),
+                "new_count": collection.count(),
                 "test_mode": self.is_test_mode
             }
         except Exception as e:
             logger.error(f"Ошибка добавления документа: {e}")
             return {"success": False, "error": str(e)}
 
+    @staticmethod
+    def _flatten_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Списки в метаданных → строка через запятую (Chroma хранит только скалярные значения)"""
+        return {
+            key: ", ".join(map(str, value)) if isinstance(value, (list, tuple)) else value
+            for key, value in metadata.items()
+        }
+    
+    def _ingest_metadata(self, metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Служебные поля метаданных при массовой загрузке (и epoch поля дат для range-фильтров)"""
+        meta = with_epoch_dates(self._flatten_metadata(dict(metadata or {})))
+        meta.setdefault("added_at", datetime.now().isoformat())
+        meta.setdefault("source", "bulk_ingest")
+        if self.is_test_mode:
+            meta["test_mode"] = True
+            meta["environment"] = "test"
+        else:
+            meta["environment"] = "production"
+        return meta
+    
+    def _write_documents(self, collection_name: str, documents: Iterable[Dict[str, Any]], batch_size: Optional[int], mode: str) -> Dict[str, Any]:
+        """
+        Массовая запись документов чанками: один вызов embedding функции
+        и один add()/upsert() на чанк. Ошибка чанка фиксируется в отчете,
+        загрузка продолжается со следующего чанка. Документы коллекций из
+        CHUNKED_COLLECTIONS дополнительно режутся на чанки для поиска (document_chunks).
+        """
+        collection = self._get_collection(collection_name)
+        if collection is None:
+            return {"success": False, "error": f"Unknown collection: {collection_name}"}
+        
+        batch_size = batch_size or chroma_config.INGEST_BATCH_SIZE
+        write = collection.upsert if mode == "upsert" else collection.add
+        iterator = iter(documents)
+        chunks = []
+        written = failed = document_chunks = 0
+        started = time.perf_counter()
+        
+        for chunk_index in itertools.count():
+            chunk = list(itertools.islice(iterator, batch_size))
+            if not chunk:
+                break
+            
+            chunk_started = time.perf_counter()
+            error = None
+            try:
+                ids = [d.get("id") or f"doc_{uuid.uuid4().hex[:8]}" for d in chunk]
+                docs = [d["document"] for d in chunk]
+                metas = [self._ingest_metadata(d.get("metadata")) for d in chunk]
+                write(ids=ids, documents=docs, metadatas=metas, embeddings=self._embed(docs))
+                try:
+                    chunk_count = self._write_chunks(collection_name, ids, docs, metas)
+                finally:
+                    # Основная запись уже прошла: кеши и индексы обновляются и при ошибке чанков
+                    self._on_documents_written(collection_name, ids, docs, metas)
+                # Документы считаются записанными только вместе с их чанками
+                written += len(chunk)
+                document_chunks += chunk_count
+            except Exception as e:
+                failed += len(chunk)
+                error = str(e)
+                logger.error(f"Ошибка записи чанка {chunk_index} в '{collection_name}': {e}")
+            
+            elapsed = time.perf_counter() - chunk_started
+            chunks.append({
+                "chunk": chunk_index,
+                "size": len(chunk),
+                "success": error is None,
+                "elapsed_ms": round(elapsed * 1000, 1),
+                "docs_per_sec": round(len(chunk) / elapsed, 1) if elapsed > 0 else None,
+                "error": error
+            })
+            logger.info(f"Чанк {chunk_index} → '{collection_name}': {len(chunk)} документов за {elapsed * 1000:.0f} мс")
+        
+        elapsed = time.perf_counter() - started
+        return {
+            "success": failed == 0,
+            "collection": collection_name,
+            "mode": mode,
+            "total": written + failed,
+            "written": written,
+            "failed": failed,
+            "batch_size": batch_size,
+            "chunks": chunks,
+            "document_chunks": document_chunks,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "docs_per_sec": round(written / elapsed, 1) if elapsed > 0 else None,
+            "test_mode": self.is_test_mode
+        }
+    
+    def add_documents(self, collection_name: str, documents: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Массовое добавление документов ({"id", "document", "metadata"}) чанками"""
+        return self._write_documents(collection_name, documents, batch_size, mode="add")
+    
+    def upsert_documents(self, collection_name: str, documents: Iterable[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Массовый upsert документов ({"id", "document", "metadata"}) чанками"""
+        return self._write_documents(collection_name, documents, batch_size, mode="upsert")
+    
+    @classmethod
+    def content_hash(cls, document: str, metadata: Optional[Dict[str, Any]] = None, model: Optional[str] = None) -> str:
+        """
+        Хеш содержимого документа (текст + стабильные метаданные, включая epoch поля дат,
+        поэтому документы, записанные до появления date_ts, перезаписываются один раз)
+        и embedding модели: при смене модели sync_documents пересчитывает эмбеддинги.
+        """
+        stable_meta = {k: v for k, v in with_epoch_dates(metadata or {}).items() if k not in cls.VOLATILE_METADATA_KEYS}
+        payload = json.dumps({"d": document, "m": stable_meta, "e": model}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _read_manifest(self, collection_name: str, source: str) -> Dict[str, str]:
+        """Manifest источника: id документа -> content_hash (только метаданные, без документов и векторов)"""
+        return {
+            item["id"]: (item["metadata"] or {}).get("content_hash")
+            for item in self.iter_documents(collection_name, where={"ingest_source": source}, include=["metadatas"])
+        }
+    
+    def sync_documents(self, collection_name: str, documents: Iterable[Dict[str, Any]], source: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Инкрементальная синхронизация источника с коллекцией.
+        Хеш содержимого каждого документа хранится в его метаданных (content_hash,
+        ingest_source). Записываются только новые и измененные документы, документы
+        источника, отсутствующие во входных данных, удаляются.
+        """
+        collection = self._get_collection(collection_name)
+        if collection is None:
+            return {"success": False, "error": f"Unknown collection: {collection_name}"}
+        
+        try:
+            manifest = self._read_manifest(collection_name, source)
+        except Exception as e:
+            logger.error(f"Ошибка чтения manifest '{source}' в '{collection_name}': {e}")
+            return {"success": False, "error": str(e), "collection": collection_name, "source": source}
+        
+        seen = set()
+        unchanged = 0
+        
+        def changed_documents():
+            nonlocal unchanged
+            for doc in documents:
+                doc_id = doc["id"]
+                seen.add(doc_id)
+                digest = self.content_hash(doc["document"], doc.get("metadata"), self.embedding_model_id)
+                if manifest.get(doc_id) == digest:
+                    unchanged += 1
+                    continue
+                yield {
+                    "id": doc_id,
+                    "document": doc["document"],
+                    "metadata": {**(doc.get("metadata") or {}), "content_hash": digest, "ingest_source": source}
+                }
+        
+        report = self._write_documents(collection_name, changed_documents(), batch_size, mode="upsert")
+        
+        removed = [doc_id for doc_id in manifest if doc_id not in seen]
+        delete_error = None
+        if removed:
+            try:
+                collection.delete(ids=removed)
+                self._delete_chunks(collection_name, removed)
+                self._on_documents_deleted(collection_name, removed)
+            except Exception as e:
+                delete_error = str(e)
+                logger.error(f"Ошибка удаления устаревших документов '{source}' из '{collection_name}': {e}")
+        
+        logger.info(
+            f"Синхронизация '{source}' → '{collection_name}': записано {report['written']}, "
+            f"без изменений {unchanged}, удалено {0 if delete_error else len(removed)}"
+        )
+        return {
+            **report,
+            "success": report["success"] and delete_error is None,
+            "mode": "sync",
+            "source": source,
+            "unchanged": unchanged,
+            "deleted": 0 if delete_error else len(removed),
+            "delete_error": delete_error
+        }
+    
+    def _reset_local_state(self) -> None:
+        """Сброс производных in-process структур после замены содержимого коллекций"""
+        for key in self.COLLECTIONS:
+            self.search_cache.invalidate(key)
+        with self._lexical_lock:
+            self.lexical_indexes.clear()
+            self._lexical_built_at.clear()
+            self._lexical_pending.clear()
+            self._lexical_generation += 1
+        with self._aggregates_lock:
+            self.deal_aggregates = None
+            self._aggregates_pending = None
+            self._stats_counts = None
+            self._stats_generation += 1
+        self.answer_cache.clear()
+    
     def cleanup_test_db(self) -> bool:
-        """Очистка тестовой БД (удаление локальных коллекций и файлов)"""
+        """Очистка тестовой БД (удаление и пересоздание пустых коллекций)"""
         if not self.is_test_mode:
             logger.warning("cleanup_test_db вызван не в тестовом режиме")
             return False
         
         try:
             # Удаление всех коллекций
-            for coll_name in self.COLLECTIONS.values():
+            for coll_name in list(self.COLLECTIONS.values()) + self._chunk_collection_names():
                 try:
                     self.client.delete_collection(coll_name)
                     logger.info(f"Коллекция {coll_name} удалена")
                 except Exception as coll_e:
                     logger.debug(f"Коллекция {coll_name} не найдена для удаления: {coll_e}")
             
-            # Удаление файлов БД
-            import shutil
-            if os.path.exists(self.test_db_path):
-                shutil.rmtree(self.test_db_path)
-                logger.info(f"Тестовая БД {self.test_db_path} удалена")
-            
-            # Пересоздание пустого клиента
-            self.client = chromadb.PersistentClient(path=self.test_db_path)
+            # Клиент не пересоздается: файлы БД на диске остаются (пустые), а rmtree
+            # с новым PersistentClient на том же пути оставлял клиент на удаленном SQLite
+            self._close_shards()
             self._setup_collections()
+            self._reset_local_state()
             
             return True
         except Exception as e:
             logger.error(f"Ошибка очистки тестовой БД: {e}")
             return False
+    
+    def snapshot_test_db(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Снимок всех коллекций тестовой БД (документы, метаданные, эмбеддинги)
+        для быстрого restore_test_db() между тестами без повторной загрузки данных
+        """
+        if not self.is_test_mode:
+            logger.warning("snapshot_test_db вызван не в тестовом режиме")
+            return None
+        
+        snapshot = {}
+        for collection in self.client.list_collections():
+            data = collection.get(include=["documents", "metadatas", "embeddings"])
+            snapshot[collection.name] = {
+                "metadata": dict(collection.metadata or {}),
+                "ids": list(data["ids"]),
+                "documents": list(data["documents"] or []),
+                "metadatas": [dict(meta or {}) for meta in (data["metadatas"] or [])],
+                "embeddings": [list(map(float, embedding)) for embedding in data["embeddings"]] if len(data["ids"]) else []
+            }
+        return snapshot
+    
+    def restore_test_db(self, snapshot: Dict[str, Dict[str, Any]]) -> bool:
+        """Восстановление тестовой БД из snapshot_test_db(): коллекции вне снимка удаляются"""
+        if not self.is_test_mode:
+            logger.warning("restore_test_db вызван не в тестовом режиме")
+            return False
+        
+        try:
+            for collection in self.client.list_collections():
+                self.client.delete_collection(collection.name)
+            for name, data in snapshot.items():
+                collection = self.client.get_or_create_collection(name=name, metadata=data["metadata"] or None)
+                if data["ids"]:
+                    collection.add(
+                        ids=data["ids"],
+                        documents=data["documents"] or None,
+                        metadatas=data["metadatas"] or None,
+                        embeddings=data["embeddings"]
+                    )
+            self._close_shards()
+            self._setup_collections()
+            self._reset_local_state()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка восстановления тестовой БД: {e}")
+            return False
 
-# Глобальный singleton экземпляр
-chroma_service: Optional[ChromaService] = None
-test_chroma_service: Optional[ChromaService] = None
+    def _close_shards(self) -> None:
+        for chunks in self.chunk_collections.values():
+            if isinstance(chunks, ShardedCollection):
+                chunks.close()
+    
+    def close(self) -> None:
+        """Освобождение ресурсов: пулы fan-out, HTTP клиенты LLM, соединения кеша"""
+        self._fanout_executor.shutdown(wait=False, cancel_futures=True)
+        self._close_shards()
+        with self._llm_lock:
+            if self._llm_http_client is not None:
+                self._llm_http_client.close()
+            self._llm_http_client = self._llm_async_http_client = None
+            self._rag_llms.clear()
+        self.search_cache.close()
+        logger.info("ChromaService закрыт")
+    
+    async def aclose(self) -> None:
+        """close() вместе с async HTTP клиентом LLM"""
+        if self._llm_async_http_client is not None:
+            await self._llm_async_http_client.aclose()
+        self.close()
+
+# Синглтоны сервиса ("prod"/"test"): потокобезопасно, пересоздаются после fork
+_services = ServiceRegistry("chroma")
 
 def get_chroma_service(is_test_mode: bool = False) -> ChromaService:
     """Получение экземпляра Chroma сервиса (prod или test)"""
-    global chroma_service, test_chroma_service
-    
-    if is_test_mode:
-        if test_chroma_service is None:
-            test_chroma_service = ChromaService(is_test_mode=True)
-        return test_chroma_service
-    else:
-        if chroma_service is None:
-            chroma_service = ChromaService(is_test_mode=False)
-        return chroma_service
+    key = "test" if is_test_mode else "prod"
+    return _services.get(key, lambda: ChromaService(is_test_mode=is_test_mode))
+
+def peek_chroma_service(is_test_mode: bool = False) -> Optional[ChromaService]:
+    """Созданный экземпляр Chroma сервиса без создания нового (health проверки)"""
+    return _services.peek("test" if is_test_mode else "prod")
+
+def close_chroma_services() -> None:
+    """Закрытие созданных сервисов; следующий get_chroma_service() создаст новый экземпляр"""
+    _services.close()
@@ -0,0 +1,112 @@
+"""
+Разбиение документов на чанки для OpenMineralHub
+Окна из предложений с перекрытием; чанк хранит parent_id исходного документа
+"""
+
+from typing import Any, Callable, Dict, List
+
+from ai.context_builder import split_sentences
+from ai.lexical_index import tokenize
+
+# Служебные поля метаданных чанка (не входят в метаданные родительского документа)
+CHUNK_FIELDS = ("parent_id", "chunk_index", "chunk_count")
+
+
+def count_words(text: str) -> int:
+    return len(tokenize(text))
+
+
+def _word_windows(sentence: str, max_tokens: int, overlap_tokens: int) -> List[str]:
+    """Предложение длиннее окна режется по словам с перекрытием"""
+    words = sentence.split()
+    step = max(1, max_tokens - overlap_tokens)
+    windows = []
+    for start in range(0, len(words), step):
+        windows.append(" ".join(words[start:start + max_tokens]))
+        if start + max_tokens >= len(words):
+            break
+    return windows
+
+
+def split_text(
+    text: str,
+    max_tokens: int = 80,
+    overlap_tokens: int = 20,
+    count: Callable[[str], int] = count_words
+) -> List[str]:
+    """
+    Чанки текста не длиннее max_tokens. Границы чанков проходят по предложениям;
+    следующий чанк начинается с последних предложений предыдущего в пределах
+    overlap_tokens. Короткий текст возвращается одним чанком без изменений.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    if count(text) <= max_tokens:
+        return [text]
+
+    units = []
+    for sentence in split_sentences(text):
+        if count(sentence) <= max_tokens:
+            units.append(sentence)
+        else:
+            units.extend(_word_windows(sentence, max_tokens, overlap_tokens))
+
+    chunks: List[str] = []
+    window: List[str] = []
+    size = 0
+    for unit in units:
+        cost = count(unit)
+        if window and size + cost > max_tokens:
+            chunks.append(" ".join(window))
+            # Перекрытие: хвост окна в пределах overlap_tokens, не выходящий за max_tokens с новым предложением
+            tail: List[str] = []
+            tail_size = 0
+            for previous in reversed(window):
+                previous_cost = count(previous)
+                if tail_size + previous_cost > overlap_tokens or tail_size + previous_cost + cost > max_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_size += previous_cost
+            window, size = tail, tail_size
+        window.append(unit)
+        size += cost
+    if window:
+        chunks.append(" ".join(window))
+    return chunks
+
+
+def build_chunks(parent_id: str, text: str, metadata: Dict[str, Any], max_tokens: int = 80, overlap_tokens: int = 20) -> List[Dict[str, Any]]:
+    """Чанки документа для записи в Chroma: {"id", "document", "metadata"} с метаданными родителя и parent_id"""
+    pieces = split_text(text, max_tokens, overlap_tokens)
+    return [
+        {
+            "id": f"{parent_id}#{index}",
+            "document": piece,
+            "metadata": {**(metadata or {}), "parent_id": parent_id, "chunk_index": index, "chunk_count": len(pieces)}
+        }
+        for index, piece in enumerate(pieces)
+    ]
+
+
+def collapse_to_parents(row: Dict[str, list], n_results: int) -> Dict[str, list]:
+    """
+    Строка результатов по чанкам → строка по родительским документам.
+    Документ представлен лучшим (ближайшим) чанком, а не полным текстом;
+    порядок родителей — по дистанции их лучшего чанка.
+    """
+    collapsed = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    seen = set()
+    ranked = sorted(zip(row["ids"], row["documents"], row["metadatas"], row["distances"]), key=lambda item: item[3])
+    for chunk_id, doc, meta, dist in ranked:
+        parent_id = (meta or {}).get("parent_id", chunk_id)
+        if parent_id in seen:
+            continue
+        seen.add(parent_id)
+        collapsed["ids"].append(parent_id)
+        collapsed["documents"].append(doc)
+        collapsed["metadatas"].append({k: v for k, v in (meta or {}).items() if k not in CHUNK_FIELDS})
+        collapsed["distances"].append(dist)
+        if len(seen) >= n_results:
+            break
+    return collapsed
@@ -0,0 +1,192 @@
+"""
+Упаковка контекста RAG в бюджет токенов для OpenMineralHub
+Дедупликация похожих фрагментов и обрезка документов до релевантных предложений
+"""
+
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Set
+
+from ai.lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Окно контекста модели по умолчанию (RAG_CONTEXT_WINDOW_TOKENS в конфигурации сервиса)
+DEFAULT_CONTEXT_WINDOW = 8192
+
+SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+# Кодировка TokenCounter еще не загружена
+_UNLOADED = object()
+
+
+@lru_cache(maxsize=16)
+def _encoding(model_name: str):
+    """tiktoken кодировка модели (None — tiktoken недоступен или нет файлов BPE)"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken недоступен для {model_name}, оценка по длине текста: {e}")
+        return None
+
+
+class TokenCounter:
+    """
+    Подсчет токенов для модели: tiktoken, иначе консервативная оценка ~3 символа на токен.
+    Кодировка загружается при первом подсчете (tiktoken может скачивать файлы BPE),
+    а не при создании сервиса.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._encoding = _UNLOADED
+
+    @property
+    def encoding(self):
+        """tiktoken кодировка (None — оценка по длине текста)"""
+        if self._encoding is _UNLOADED:
+            self._encoding = _encoding(self.model_name)
+        return self._encoding
+
+    @property
+    def exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        encoding = self.encoding
+        if encoding is not None:
+            return len(encoding.encode(text))
+        return math.ceil(len(text) / 3)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        encoding = self.encoding
+        if encoding is not None:
+            tokens = encoding.encode(text)
+            return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * 3]
+
+
+def _stem(token: str) -> str:
+    """Грубая основа слова: 'меди' и 'медь' → 'мед'"""
+    return token if len(token) <= 3 else token[:max(3, min(len(token) - 1, 5))]
+
+
+def _terms(text: str) -> Set[str]:
+    return {_stem(token) for token in tokenize(text)}
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_RE.split(text or "") if sentence.strip()]
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class ContextBuilder:
+    """
+    Сборка контекста LLM из результатов поиска
+
+    Бюджет = min(max_context_tokens, context_window модели − response_reserve_tokens).
+    Документы берутся в порядке релевантности; почти дубликаты уже взятых
+    (Jaccard по словам >= dedup_threshold) пропускаются; документ длиннее
+    doc_max_tokens (или остатка бюджета) сокращается до предложений с наибольшим
+    пересечением с запросом, в исходном порядке. Упаковка идет до исчерпания бюджета.
+    """
+
+    SEPARATOR = "\n\n"
+    # Меньший остаток бюджета не заполняется обрезками длинных документов
+    MIN_PIECE_TOKENS = 24
+
+    def __init__(
+        self,
+        model_name: str,
+        context_window: int = DEFAULT_CONTEXT_WINDOW,
+        max_context_tokens: int = 3000,
+        doc_max_tokens: int = 600,
+        response_reserve_tokens: int = 1024,
+        dedup_threshold: float = 0.85
+    ):
+        self.model_name = model_name
+        self.context_window = context_window
+        self.budget = max(0, min(max_context_tokens, self.context_window - response_reserve_tokens))
+        self.doc_max_tokens = doc_max_tokens
+        self.dedup_threshold = dedup_threshold
+        self.counter = TokenCounter(model_name)
+
+    def _trim(self, query_terms: Set[str], text: str, limit: int) -> str:
+        """Наиболее релевантные запросу предложения документа в пределах limit токенов"""
+        if self.counter.count(text) <= limit:
+            return text
+
+        sentences = split_sentences(text)
+        # Пересечение с запросом, при равенстве — более раннее предложение
+        ranked = sorted(range(len(sentences)), key=lambda i: (-len(query_terms & _terms(sentences[i])), i))
+        chosen, used = [], 0
+        for i in ranked:
+            cost = self.counter.count(sentences[i]) + (1 if chosen else 0)
+            if used + cost <= limit:
+                chosen.append(i)
+                used += cost
+        if not chosen:
+            return self.counter.truncate(sentences[ranked[0]], limit) if sentences else ""
+        return " ".join(sentences[i] for i in sorted(chosen))
+
+    def build(self, query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Контекст из результатов поиска (в порядке релевантности, с ключами id/document).
+        Возвращает {"context", "results" (вошедшие), "tokens", "budget", "candidates",
+        "duplicates", "trimmed", "over_budget"}.
+        """
+        query_terms = _terms(query)
+        separator_tokens = self.counter.count(self.SEPARATOR)
+        selected, parts, seen = [], [], []
+        used = duplicates = trimmed = over_budget = 0
+
+        for result in results:
+            text = (result.get("document") or "").strip()
+            if not text:
+                continue
+            terms = _terms(text)
+            if any(jaccard(terms, other) >= self.dedup_threshold for other in seen):
+                duplicates += 1
+                continue
+
+            limit = min(self.doc_max_tokens, self.budget - used - (separator_tokens if parts else 0))
+            fits = self.counter.count(text) <= limit
+            piece = self._trim(query_terms, text, limit) if fits or limit >= self.MIN_PIECE_TOKENS else ""
+            if not piece:
+                over_budget += 1
+                continue
+
+            trimmed += piece != text
+            used += self.counter.count(piece) + (separator_tokens if parts else 0)
+            parts.append(piece)
+            seen.append(terms)
+            selected.append(result)
+
+        context = self.SEPARATOR.join(parts)
+        return {
+            "context": context,
+            "results": selected,
+            "tokens": self.counter.count(context),
+            "budget": self.budget,
+            "candidates": len(results),
+            "duplicates": duplicates,
+            "trimmed": trimmed,
+            "over_budget": over_budget
+        }
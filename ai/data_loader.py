@@ -13,6 +13,22 @@ logger = logging.getLogger(__name__)
 class DataLoader:
     """Загрузчик данных для OpenMineralHub"""
     
+    @staticmethod
+    def _log_ingest_report(result: dict, label: str):
+        """Лог отчета массовой загрузки: пропускная способность и ошибки по чанкам"""
+        if "chunks" not in result:
+            logger.error(f"Ошибка загрузки {label}: {result.get('error')}")
+            return
+        for chunk in result["chunks"]:
+            if not chunk["success"]:
+                logger.warning(f"Чанк {chunk['chunk']} ({chunk['size']} документов) не записан: {chunk['error']}")
+        logger.info(
+            f"✅ Загружено {result['written']}/{result['total']} {label} "
+            f"({len(result['chunks'])} чанков, {result['docs_per_sec']} док/с, "
+            f"{result.get('document_chunks', 0)} чанков документов для поиска), "
+            f"без изменений {result.get('unchanged', 0)}, удалено {result.get('deleted', 0)}"
+        )
+    
     @classmethod
     def load_minerals_catalog(cls, test_mode: bool = False):
         """Загрузка каталога минералов из JSON"""
@@ -31,40 +47,36 @@ class DataLoader:
             
             minerals = data.get("minerals", [])
             
-            success_count = 0
-            for mineral in minerals:
-                # Формирование полного документа
-                doc = f"{mineral['name']['ru']} ({mineral['name']['en']}) - {mineral['description']}. "
-                doc += f"Символ: {mineral['symbol']}. Тип: {mineral['type']}. "
-                doc += f"Текущая цена: ${mineral['current_price']:,}/{mineral['unit']} ({mineral['market']}). "
-                doc += f"Годовое производство: {mineral['annual_production']:,} тонн. "
-                if 'documents' in mineral:
-                    doc += " ".join(mineral['documents'])
-                
-                # Метаданные
-                metadata = {
-                    **mineral,
-                    "document_type": "mineral_catalog",
-                    "loaded_at": datetime.now().isoformat(),
-                    "source_file": "minerals_catalog.json",
-                    "data_source": "openmineral_catalog",
-                    "environment": "production"
-                }
-                
-                # Добавление в Chroma
-                result = service.add_document(
-                    collection_name="minerals",
-                    document=doc,
-                    metadata=metadata,
-                    id=mineral.get("id", f"mineral_{mineral['symbol'].lower()}")
-                )
-                
-                if result["success"]:
-                    success_count += 1
-                    logger.info(f"Загружен минерал: {mineral['name']['ru']}")
+            def mineral_documents():
+                for mineral in minerals:
+                    # Формирование полного документа
+                    doc = f"{mineral['name']['ru']} ({mineral['name']['en']}) - {mineral['description']}. "
+                    doc += f"Символ: {mineral['symbol']}. Тип: {mineral['type']}. "
+                    doc += f"Текущая цена: ${mineral['current_price']:,}/{mineral['unit']} ({mineral['market']}). "
+                    doc += f"Годовое производство: {mineral['annual_production']:,} тонн. "
+                    if 'documents' in mineral:
+                        doc += " ".join(mineral['documents'])
+                    
+                    # Метаданные
+                    metadata = {
+                        **mineral,
+                        "document_type": "mineral_catalog",
+                        "loaded_at": datetime.now().isoformat(),
+                        "source_file": "minerals_catalog.json",
+                        "data_source": "openmineral_catalog",
+                        "environment": "production"
+                    }
+                    
+                    yield {
+                        "id": mineral.get("id", f"mineral_{mineral['symbol'].lower()}"),
+                        "document": doc,
+                        "metadata": metadata
+                    }
             
-            logger.info(f"✅ Загружено {success_count}/{len(minerals)} минералов из каталога")
-            return success_count == len(minerals)
+            # Инкрементальная синхронизация: записываются только новые/измененные минералы
+            result = service.sync_documents("minerals", mineral_documents(), source="minerals_catalog.json")
+            cls._log_ingest_report(result, "минералов из каталога")
+            return result["success"]
             
         except FileNotFoundError:
             logger.warning("Файл data/minerals_catalog.json не найден")
@@ -132,24 +144,12 @@ class DataLoader:
                 }
             ]
             
-            success_count = 0
-            for deal_data in sample_deals:
-                doc = deal_data["document"]
-                metadata = deal_data["metadata"]
-                
-                result = service.add_document(
-                    collection_name="deals",
-                    document=doc,
-                    metadata=metadata,
-                    id=f"deal_{deal_data['deal_id']}"
-                )
-                
-                if result["success"]:
-                    success_count += 1
-                    logger.info(f"Загружена производственная сделка: {deal_data['deal_id']}")
-            
-            logger.info(f"✅ Загружено {success_count} производственных сделок")
-            return success_count == len(sample_deals)
+            result = service.sync_documents("deals", (
+                {"id": f"deal_{deal_data['deal_id']}", "document": deal_data["document"], "metadata": deal_data["metadata"]}
+                for deal_data in sample_deals
+            ), source="production_deals")
+            cls._log_ingest_report(result, "производственных сделок")
+            return result["success"]
             
         except Exception as e:
             logger.error(f"Ошибка загрузки производственных сделок: {e}")
@@ -209,24 +209,9 @@ class DataLoader:
                 }
             ]
             
-            success_count = 0
-            for kyc_data in sample_kyc:
-                doc = kyc_data["document"]
-                metadata = kyc_data["metadata"]
-                
-                result = service.add_document(
-                    collection_name="kyc",
-                    document=doc,
-                    metadata=metadata,
-                    id=kyc_data["id"]
-                )
-                
-                if result["success"]:
-                    success_count += 1
-                    logger.info(f"Загружен KYC профиль: {kyc_data['metadata']['company_name']}")
-            
-            logger.info(f"✅ Загружено {success_count} производственных KYC профилей")
-            return success_count == len(sample_kyc)
+            result = service.sync_documents("kyc", sample_kyc, source="production_kyc")
+            cls._log_ingest_report(result, "производственных KYC профилей")
+            return result["success"]
             
         except Exception as e:
             logger.error(f"Ошибка загрузки KYC: {e}")
@@ -241,17 +226,22 @@ class DataLoader:
         
         success = True
         
-        # Загрузка минералов
-        print("📊 Загружаю каталог минералов...")
-        success &= cls.load_minerals_catalog(test_mode=test_mode)
-        
-        # Загрузка сделок
-        print("💼 Загружаю торговые сделки...")
-        success &= cls.load_sample_deals(test_mode=test_mode)
-        
-        # Загрузка KYC
-        print("🛡️ Загружаю KYC документы...")
-        success &= cls.load_sample_kyc(test_mode=test_mode)
+        if test_mode:
+            # Все тестовые данные встроены в ChromaService — одна инкрементальная загрузка вместо трех
+            print("📊 Загружаю встроенные тестовые данные...")
+            success &= get_chroma_service(is_test_mode=True).load_initial_data()
+        else:
+            # Загрузка минералов
+            print("📊 Загружаю каталог минералов...")
+            success &= cls.load_minerals_catalog(test_mode=test_mode)
+            
+            # Загрузка сделок
+            print("💼 Загружаю торговые сделки...")
+            success &= cls.load_sample_deals(test_mode=test_mode)
+            
+            # Загрузка KYC
+            print("🛡️ Загружаю KYC документы...")
+            success &= cls.load_sample_kyc(test_mode=test_mode)
         
         if success:
             print("🎉 Все данные успешно загружены в Chroma!")
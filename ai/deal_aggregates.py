@@ -0,0 +1,101 @@
+"""
+Материализованные агрегаты сделок для OpenMineralHub
+Счетчики коллекции сделок, обновляемые при записи вместо полного сканирования
+"""
+
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from ai.deal_analytics import DealAnalytics
+
+# (сумма, статус, товар, регион) — вклад одной сделки в агрегаты
+_Contribution = Tuple[float, str, str, str]
+
+
+def _contribution(metadata: Optional[Dict[str, Any]]) -> _Contribution:
+    meta = metadata or {}
+    amount = meta.get("total_amount_usd") or 0
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        amount = 0.0
+    return (
+        amount,
+        str(meta.get("status") or "unknown"),
+        str(meta.get("commodity") or "unknown"),
+        str(meta.get("region") or "unknown")
+    )
+
+
+class DealAggregates:
+    """
+    Бегущие агрегаты коллекции сделок
+
+    Для каждого id хранится его вклад (сумма, статус, товар, регион), поэтому
+    upsert и delete корректно вычитают старые значения. snapshot() — O(число групп)
+    и не зависит от размера коллекции. Колоночная аналитика (analytics) строится
+    и обновляется вместе с агрегатами. Потокобезопасен.
+    """
+
+    def __init__(self):
+        self._deals: Dict[str, _Contribution] = {}
+        self._total_value = 0.0
+        self._groups: Dict[str, Dict[str, Dict[str, float]]] = {
+            "status": {}, "commodity": {}, "region": {}
+        }
+        self._lock = threading.Lock()
+        self.analytics = DealAnalytics()
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self._deals)
+
+    def _bump(self, contribution: _Contribution, sign: int) -> None:
+        amount, status, commodity, region = contribution
+        self._total_value += sign * amount
+        for dimension, key in (("status", status), ("commodity", commodity), ("region", region)):
+            group = self._groups[dimension].setdefault(key, {"count": 0, "value_usd": 0.0})
+            group["count"] += sign
+            group["value_usd"] += sign * amount
+            if group["count"] <= 0:
+                del self._groups[dimension][key]
+
+    def apply(self, ids: Iterable[str], metadatas: Iterable[Optional[Dict[str, Any]]]) -> None:
+        """Учет записанных сделок (add/upsert)"""
+        ids, metadatas = list(ids), list(metadatas)
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                previous = self._deals.pop(doc_id, None)
+                if previous is not None:
+                    self._bump(previous, -1)
+                contribution = _contribution(metadata)
+                self._deals[doc_id] = contribution
+                self._bump(contribution, +1)
+        self.analytics.apply(ids, metadatas)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """Учет удаленных сделок"""
+        ids = list(ids)
+        with self._lock:
+            for doc_id in ids:
+                previous = self._deals.pop(doc_id, None)
+                if previous is not None:
+                    self._bump(previous, -1)
+        self.analytics.remove(ids)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущие значения агрегатов"""
+        with self._lock:
+            count = len(self._deals)
+            confirmed = self._groups["status"].get("confirmed", {}).get("count", 0)
+            return {
+                "count": count,
+                "total_value_usd": self._total_value,
+                "confirmed": confirmed,
+                "avg_value_usd": self._total_value / count if count else 0,
+                "by_status": {k: dict(v) for k, v in self._groups["status"].items()},
+                "by_commodity": {k: dict(v) for k, v in self._groups["commodity"].items()},
+                "by_region": {k: dict(v) for k, v in self._groups["region"].items()},
+                "built_at": self.built_at
+            }
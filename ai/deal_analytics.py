@@ -0,0 +1,249 @@
+"""
+Колоночная аналитика сделок для OpenMineralHub
+Метаданные сделок в numpy колонках (измерения — словарное кодирование), group-by через bincount
+"""
+
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from ai.filters import to_epoch
+
+# Измерения группировки; month — YYYY-MM из поля date
+DIMENSIONS = ("commodity", "region", "month", "status")
+UNKNOWN = "unknown"
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _month(value: Any) -> str:
+    text = str(value or "")
+    return text[:7] if len(text) >= 7 and text[4] == "-" else UNKNOWN
+
+
+def _epoch(metadata: Dict[str, Any]) -> float:
+    """date_ts сделки (epoch секунды UTC) или NaN, если дата не указана или не распознана"""
+    value = metadata.get("date_ts")
+    if value is None:
+        try:
+            value = to_epoch(metadata.get("date"))
+        except (TypeError, ValueError):
+            value = None
+    return float(value) if value is not None else np.nan
+
+
+def date_bounds(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """
+    Границы периода в epoch секундах: YYYY-MM — с первого дня месяца / по последний
+    день месяца включительно, YYYY-MM-DD или ISO 8601 — с точностью до дня (секунды).
+    ValueError для нераспознанной даты.
+    """
+    lower = upper = None
+    if date_from:
+        lower = to_epoch(f"{date_from}-01" if len(date_from) == 7 else date_from)
+    if date_to:
+        if len(date_to) == 7:
+            year, month = int(date_to[:4]), int(date_to[5:])
+            next_month = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+            upper = to_epoch(next_month) - 1
+        else:
+            upper = to_epoch(date_to, end_of_day=True)
+    return lower, upper
+
+
+class _Categories:
+    """Словарное кодирование значений измерения: строка ↔ int код"""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def get(self, value: str) -> Optional[int]:
+        return self._codes.get(value)
+
+
+class DealAnalytics:
+    """
+    Колонки метаданных сделок: сумма, объем, цена и коды измерений
+
+    Строка на сделку в предвыделенных numpy массивах (емкость удваивается),
+    дата — epoch колонка date_ts;
+    upsert перезаписывает строку сделки, delete помечает ее свободной. Агрегации —
+    векторные маски и np.bincount по составному ключу группы, без цикла по сделкам.
+    Потокобезопасен.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = max(capacity, 1)
+        self._size = 0
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._valid = np.zeros(self._capacity, dtype=bool)
+        self._value = np.zeros(self._capacity, dtype=np.float64)
+        self._volume = np.zeros(self._capacity, dtype=np.float64)
+        self._price = np.zeros(self._capacity, dtype=np.float64)
+        self._has_price = np.zeros(self._capacity, dtype=bool)
+        self._date_ts = np.full(self._capacity, np.nan, dtype=np.float64)
+        self._codes = {dimension: np.zeros(self._capacity, dtype=np.int32) for dimension in DIMENSIONS}
+        self._categories = {dimension: _Categories() for dimension in DIMENSIONS}
+        self._lock = threading.Lock()
+        self.built_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _grow(self) -> None:
+        self._capacity *= 2
+        for name in ("_valid", "_value", "_volume", "_price", "_has_price", "_date_ts"):
+            column = getattr(self, name)
+            grown = np.full(self._capacity, np.nan) if name == "_date_ts" else np.zeros(self._capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        for dimension, column in self._codes.items():
+            grown = np.zeros(self._capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            self._codes[dimension] = grown
+
+    def _row(self, doc_id: str) -> int:
+        row = self._rows.get(doc_id)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._size == self._capacity:
+                self._grow()
+            row = self._size
+            self._size += 1
+        self._rows[doc_id] = row
+        return row
+
+    def apply(self, ids: Iterable[str], metadatas: Iterable[Optional[Dict[str, Any]]]) -> None:
+        """Учет записанных сделок (add/upsert)"""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                meta = metadata or {}
+                row = self._row(doc_id)
+                price = meta.get("price_usd_per_ton")
+                self._valid[row] = True
+                self._value[row] = _number(meta.get("total_amount_usd"))
+                self._volume[row] = _number(meta.get("quantity_tons"))
+                self._price[row] = _number(price)
+                self._has_price[row] = price is not None
+                self._date_ts[row] = _epoch(meta)
+                for dimension in DIMENSIONS:
+                    raw = _month(meta.get("date")) if dimension == "month" else str(meta.get(dimension) or UNKNOWN)
+                    self._codes[dimension][row] = self._categories[dimension].encode(raw)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """Учет удаленных сделок"""
+        with self._lock:
+            for doc_id in ids:
+                row = self._rows.pop(doc_id, None)
+                if row is not None:
+                    self._valid[row] = False
+                    self._free.append(row)
+
+    def _mask(self, filters: Dict[str, Any], date_from: Optional[str], date_to: Optional[str]) -> np.ndarray:
+        n = self._size
+        mask = self._valid[:n].copy()
+        for dimension, value in filters.items():
+            if value is None:
+                continue
+            code = self._categories[dimension].get(str(value))
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            mask &= self._codes[dimension][:n] == code
+        lower, upper = date_bounds(date_from, date_to)
+        # Сравнение с NaN ложно: сделки без даты в период не попадают
+        if lower is not None:
+            mask &= self._date_ts[:n] >= lower
+        if upper is not None:
+            mask &= self._date_ts[:n] <= upper
+        return mask
+
+    def group_by(
+        self,
+        dimensions: Sequence[str] = ("commodity", "region", "month"),
+        filters: Optional[Dict[str, Any]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Агрегаты по группам измерений: count, volume_tons, value_usd,
+        avg_price_usd_per_ton (среднее price_usd_per_ton) и value_per_ton_usd
+        (value_usd / volume_tons). Группы отсортированы по value_usd.
+        filters — точные значения измерений, date_from/date_to — YYYY-MM[-DD]
+        (диапазон по колонке date_ts с точностью до дня).
+        """
+        unknown = [d for d in list(dimensions) + list(filters or {}) if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Unknown analytics dimension: {', '.join(unknown)}")
+
+        with self._lock:
+            mask = self._mask(filters or {}, date_from, date_to)
+            codes = [self._codes[d][:self._size][mask] for d in dimensions]
+            labels = [list(self._categories[d].values) for d in dimensions]
+            value = self._value[:self._size][mask]
+            volume = self._volume[:self._size][mask]
+            has_price = self._has_price[:self._size][mask]
+            price = np.where(has_price, self._price[:self._size][mask], 0.0)
+
+        if not len(value):
+            return []
+        if dimensions:
+            keys = np.ravel_multi_index(codes, [max(len(l), 1) for l in labels])
+            group_keys, inverse = np.unique(keys, return_inverse=True)
+        else:
+            group_keys, inverse = np.zeros(1, dtype=np.int64), np.zeros(len(value), dtype=np.int64)
+
+        n_groups = len(group_keys)
+        counts = np.bincount(inverse, minlength=n_groups)
+        values = np.bincount(inverse, weights=value, minlength=n_groups)
+        volumes = np.bincount(inverse, weights=volume, minlength=n_groups)
+        price_sums = np.bincount(inverse, weights=price, minlength=n_groups)
+        price_counts = np.bincount(inverse, weights=has_price.astype(np.float64), minlength=n_groups)
+
+        if dimensions:
+            group_codes = np.unravel_index(group_keys, [max(len(l), 1) for l in labels])
+        groups = []
+        for g in np.argsort(-values, kind="stable"):
+            group = {d: labels[i][group_codes[i][g]] for i, d in enumerate(dimensions)} if dimensions else {}
+            group.update({
+                "count": int(counts[g]),
+                "volume_tons": float(volumes[g]),
+                "value_usd": float(values[g]),
+                "avg_price_usd_per_ton": float(price_sums[g] / price_counts[g]) if price_counts[g] else None,
+                "value_per_ton_usd": float(values[g] / volumes[g]) if volumes[g] else None
+            })
+            groups.append(group)
+        return groups
+
+    def status_mix(self, filters: Optional[Dict[str, Any]] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Доля сделок и стоимости по статусам"""
+        groups = self.group_by(("status",), filters, date_from, date_to)
+        total_count = sum(g["count"] for g in groups)
+        total_value = sum(g["value_usd"] for g in groups)
+        return {
+            g["status"]: {
+                "count": g["count"],
+                "value_usd": g["value_usd"],
+                "count_share": g["count"] / total_count if total_count else 0.0,
+                "value_share": g["value_usd"] / total_value if total_value else 0.0
+            }
+            for g in groups
+        }
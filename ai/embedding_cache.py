@@ -0,0 +1,228 @@
+"""
+Дисковый content-addressed кеш эмбеддингов для OpenMineralHub
+Ключ: sha256(модель + текст), хранение: float32 матрица (memmap) + индекс смещений
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Кеш эмбеддингов одной модели на диске
+
+    Файлы в каталоге кеша:
+    - <model>.f32 — строки float32 матрицы [n, dim], только дозапись
+    - <model>.idx — строки "<sha256>\\t<номер строки>", только дозапись
+
+    Матрица читается через np.memmap, поэтому в памяти процесса
+    держится только индекс hash -> смещение. Дозапись защищена
+    flock, новые строки других процессов подхватываются при промахе.
+    """
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.model_name = model_name
+        os.makedirs(path, exist_ok=True)
+
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.vectors_path = os.path.join(path, f"{slug}.f32")
+        self.index_path = os.path.join(path, f"{slug}.idx")
+
+        self.dim: Optional[int] = None
+        self._index: Dict[str, int] = {}
+        self._index_offset = 0
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock:
+            self._refresh_index()
+
+    def key(self, text: str) -> str:
+        """Content-addressed ключ текста"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _refresh_index(self) -> None:
+        """Подгрузка новых строк индекса (в том числе записанных другими процессами)"""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="ascii") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # незавершенная запись другого процесса
+                self._index_offset += len(line)
+                parts = line.split("\t")
+                if parts[0] == "dim":
+                    self.dim = int(parts[1])
+                else:
+                    self._index[parts[0]] = int(parts[1])
+
+    def _matrix(self) -> Optional[np.memmap]:
+        """memmap матрицы, переоткрывается после дозаписи"""
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return None
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        if self._mmap is None or self._mmap.shape[0] != rows:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+        return self._mmap
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Эмбеддинги из кеша; None для отсутствующих текстов"""
+        keys = [self.key(t) for t in texts]
+        with self._lock:
+            if any(k not in self._index for k in keys):
+                self._refresh_index()
+            matrix = self._matrix()
+            result: List[Optional[np.ndarray]] = []
+            for k in keys:
+                row = self._index.get(k)
+                if matrix is not None and row is not None and row < matrix.shape[0]:
+                    result.append(np.array(matrix[row]))
+                    self.hits += 1
+                else:
+                    result.append(None)
+                    self.misses += 1
+            return result
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Дозапись эмбеддингов в матрицу и индекс"""
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(texts):
+            raise ValueError("Ожидается матрица [len(texts), dim]")
+
+        with self._lock, open(self.index_path, "a", encoding="ascii") as index_file:
+            if fcntl is not None:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                if self.dim is None:
+                    self.dim = matrix.shape[1]
+                    index_file.write(f"dim\t{self.dim}\n")
+                elif self.dim != matrix.shape[1]:
+                    raise ValueError(f"Размерность {matrix.shape[1]} не совпадает с кешем ({self.dim})")
+
+                lines = []
+                new_rows = []
+                row = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+                for text, vector in zip(texts, matrix):
+                    k = self.key(text)
+                    if k in self._index:
+                        continue
+                    self._index[k] = row
+                    lines.append(f"{k}\t{row}\n")
+                    new_rows.append(vector)
+                    row += 1
+
+                if new_rows:
+                    # Сначала векторы, затем индекс: индекс никогда не ссылается на незаписанные строки
+                    with open(self.vectors_path, "ab") as vectors_file:
+                        vectors_file.write(np.ascontiguousarray(new_rows, dtype=np.float32).tobytes())
+                        vectors_file.flush()
+                        os.fsync(vectors_file.fileno())
+                    index_file.write("".join(lines))
+                index_file.flush()
+                self._index_offset = index_file.tell()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(index_file, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, object]:
+        """Статистика кеша"""
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "entries": len(self._index),
+                "dim": self.dim,
+                "hits": self.hits,
+                "misses": self.misses,
+                "size_bytes": os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            }
+
+
+class CachedEmbeddingFunction:
+    """
+    Обертка над embedding функцией: тексты из кеша не передаются в модель,
+    промахи эмбеддятся одним вызовом и дописываются в кеш
+
+    Запросы пользователей (embed_queries) на диск не пишутся: их тексты
+    не повторяются так, как документы, и дисковый кеш рос бы с каждым
+    новым запросом. Они держатся в in-memory LRU на query_cache_size строк.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Callable[[List[str]], Sequence[Sequence[float]]],
+        cache: EmbeddingCache,
+        query_cache_size: int = 1024
+    ):
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.query_cache_size = query_cache_size
+        self._queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        """Эмбеддинги документов (ингест): промахи дописываются в дисковый кеш"""
+        return self._embed(list(input), persist=True)
+
+    def embed_queries(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """Эмбеддинги поисковых запросов: дисковый кеш только читается, промахи — в LRU"""
+        texts = list(texts)
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._queries_lock:
+            for i, text in enumerate(texts):
+                vector = self._queries.get(text)
+                if vector is not None:
+                    self._queries.move_to_end(text)
+                    vectors[i] = vector
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        if pending:
+            computed = self._embed([texts[i] for i in pending], persist=False)
+            with self._queries_lock:
+                for i, vector in zip(pending, computed):
+                    vectors[i] = vector
+                    self._queries[texts[i]] = vector
+                    self._queries.move_to_end(texts[i])
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return vectors
+
+    def _embed(self, texts: List[str], persist: bool) -> List[np.ndarray]:
+        vectors = self.cache.get_many(texts)
+
+        # Повторы внутри одного вызова эмбеддятся один раз
+        missing: Dict[str, List[int]] = {}
+        for i, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(text, []).append(i)
+
+        if missing:
+            missing_texts = list(missing)
+            computed = np.asarray(self.embedding_function(missing_texts), dtype=np.float32)
+            if persist:
+                self.cache.put_many(missing_texts, computed)
+            for text, vector in zip(missing_texts, computed):
+                for i in missing[text]:
+                    vectors[i] = vector
+
+        return vectors
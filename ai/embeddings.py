@@ -0,0 +1,182 @@
+"""
+Embedding провайдеры для OpenMineralHub
+OpenAI (через API) или локальная CPU модель (sentence-transformers / ONNX Runtime)
+с micro-batching, ограничением потоков и опциональным пулом процессов
+"""
+
+import importlib.util
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from chromadb.utils import embedding_functions
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = "all-MiniLM-L6-v2"
+
+
+class _ThreadCappedONNXMiniLM(ONNXMiniLM_L6_V2):
+    """ONNX all-MiniLM-L6-v2 из Chroma с ограничением числа потоков ONNX Runtime"""
+
+    def __init__(self, num_threads: int):
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self._num_threads = num_threads
+
+    @cached_property
+    def model(self) -> Any:
+        so = self.ort.SessionOptions()
+        so.log_severity_level = 3
+        so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self._num_threads:
+            so.intra_op_num_threads = self._num_threads
+            so.inter_op_num_threads = 1
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=["CPUExecutionProvider"],
+            sess_options=so
+        )
+
+
+def resolve_backend(backend: str) -> str:
+    """auto → sentence_transformers, если пакет установлен, иначе onnx (зависимость chromadb)"""
+    if backend != "auto":
+        return backend
+    return "sentence_transformers" if importlib.util.find_spec("sentence_transformers") else "onnx"
+
+
+def _create_encoder(backend: str, model_name: str, num_threads: int) -> Callable[[List[str]], np.ndarray]:
+    """Загрузка локальной модели; возвращает функцию батч → матрица float32"""
+    if backend == "sentence_transformers":
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = SentenceTransformer(model_name, device="cpu")
+        return lambda batch: model.encode(
+            batch, batch_size=len(batch), normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+    if backend == "onnx":
+        if model_name != DEFAULT_LOCAL_MODEL:
+            raise ValueError(f"ONNX backend поддерживает только {DEFAULT_LOCAL_MODEL}, получено {model_name}")
+        model = _ThreadCappedONNXMiniLM(num_threads)
+        return lambda batch: np.asarray(model(batch), dtype=np.float32)
+
+    raise ValueError(f"Неизвестный embedding backend: {backend}")
+
+
+# Модель внутри процесса пула (создается один раз на процесс)
+_worker_encoder: Optional[Callable[[List[str]], np.ndarray]] = None
+
+
+def _init_worker(backend: str, model_name: str, num_threads: int) -> None:
+    global _worker_encoder
+    _worker_encoder = _create_encoder(backend, model_name, num_threads)
+
+
+def _encode_in_worker(batch: List[str]) -> np.ndarray:
+    return _worker_encoder(batch)
+
+
+class LocalEmbeddingFunction:
+    """
+    Локальная CPU embedding функция без сетевых вызовов и оплаты за токены
+
+    Тексты разбиваются на micro-batch по batch_size. При num_workers > 0
+    батчи распределяются по пулу процессов (spawn), в каждом процессе
+    модель загружается один раз и использует не более num_threads потоков.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_LOCAL_MODEL,
+        backend: str = "auto",
+        batch_size: int = 32,
+        num_threads: int = 4,
+        num_workers: int = 0
+    ):
+        self.model_name = model_name
+        self.backend = resolve_backend(backend)
+        self.batch_size = max(1, batch_size)
+        self.num_threads = num_threads
+        self.num_workers = num_workers
+        self._encoder: Optional[Callable[[List[str]], np.ndarray]] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        """Идентификатор модели для кеша эмбеддингов"""
+        return f"{self.backend}/{self.model_name}"
+
+    def _get_encoder(self) -> Callable[[List[str]], np.ndarray]:
+        with self._lock:
+            if self._encoder is None:
+                self._encoder = _create_encoder(self.backend, self.model_name, self.num_threads)
+                logger.info(f"Локальная embedding модель загружена: {self.model_id} (потоков: {self.num_threads or 'auto'})")
+            return self._encoder
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.backend, self.model_name, self.num_threads)
+                )
+            return self._pool
+
+    def __call__(self, input: List[str]) -> List[np.ndarray]:
+        texts = list(input)
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        if self.num_workers > 0 and len(batches) > 1:
+            matrices = list(self._get_pool().map(_encode_in_worker, batches))
+        else:
+            encoder = self._get_encoder()
+            matrices = [encoder(batch) for batch in batches]
+
+        return [row for matrix in matrices for row in np.asarray(matrix, dtype=np.float32)]
+
+    def close(self) -> None:
+        """Остановка пула процессов"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def build_embedding_function(config: Dict[str, Any]) -> Tuple[Callable[[List[str]], Any], str]:
+    """
+    Embedding функция по конфигурации chroma_config.get_embedding_config()
+    Возвращает (функция, идентификатор модели для кеша эмбеддингов)
+    """
+    if config.get("provider") == "openai":
+        if config.get("api_key"):
+            function = embedding_functions.OpenAIEmbeddingFunction(
+                api_key=config["api_key"],
+                model_name=config["model"]
+            )
+            return function, f"openai/{config['model']}"
+        logger.warning("Embedding провайдер openai выбран, но OPENAI_API_KEY не настроен — используется локальная CPU модель")
+        config = {**config, "provider": "sentence_transformers", "model": DEFAULT_LOCAL_MODEL}
+
+    function = LocalEmbeddingFunction(
+        model_name=config.get("model", DEFAULT_LOCAL_MODEL),
+        backend=config.get("backend", "auto"),
+        batch_size=config.get("batch_size", 32),
+        num_threads=config.get("num_threads", 4),
+        num_workers=config.get("num_workers", 0)
+    )
+    return function, function.model_id
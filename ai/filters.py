@@ -0,0 +1,178 @@
+"""
+Metadata фильтры Chroma для OpenMineralHub
+Построение where-клауз (DealFilter) и их проверка на стороне процесса
+(локальные индексы и реплики)
+"""
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, field_validator
+
+# Поля дат метаданных → поля epoch секунд (UTC), по которым работают range-фильтры
+DATE_FIELDS = {"date": "date_ts"}
+
+
+def _compare(value: Any, op: str, operand: Any) -> bool:
+    """Один оператор сравнения Chroma"""
+    if op == "$eq":
+        return value == operand
+    if op == "$ne":
+        return value != operand
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    if value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Неподдерживаемый оператор фильтра: {op}")
+
+
+def matches_where(metadata: Optional[Dict[str, Any]], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    Соответствие метаданных where-клаузе Chroma
+    Поддерживаются $and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin и неявное равенство
+    """
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def to_epoch(value: Any, end_of_day: bool = False) -> Optional[int]:
+    """
+    Дата → epoch секунды UTC: date/datetime, "YYYY-MM-DD" или ISO 8601.
+    Время без часового пояса считается UTC. end_of_day — для даты без времени
+    возвращается последняя секунда дня (включительная верхняя граница).
+    None для пустого значения, ValueError для нераспознанной строки.
+    """
+    if value is None or value == "":
+        return None
+    date_only = False
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, date):
+        moment, date_only = datetime(value.year, value.month, value.day), True
+    else:
+        text = str(value).strip()
+        date_only = len(text) == 10
+        moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    if date_only and end_of_day:
+        moment += timedelta(days=1, seconds=-1)
+    return int(moment.timestamp())
+
+
+def with_epoch_dates(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Метаданные с epoch полями для дат из DATE_FIELDS (нераспознанная дата — без epoch поля)"""
+    result = dict(metadata)
+    for field, epoch_field in DATE_FIELDS.items():
+        try:
+            epoch = to_epoch(result.get(field))
+        except (TypeError, ValueError):
+            epoch = None
+        if epoch is None:
+            result.pop(epoch_field, None)
+        else:
+            result[epoch_field] = epoch
+    return result
+
+
+def and_where(clauses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Объединение условий: одно условие — как есть, несколько — $and (Chroma принимает один ключ верхнего уровня)"""
+    clauses = [clause for clause in clauses if clause]
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+class DealFilter(BaseModel):
+    """
+    Фильтр поиска сделок, компилируемый в where-клаузу Chroma
+
+    Точные значения (status, risk_level, commodity, region, counterparty),
+    диапазон total_amount_usd и диапазон дат сделки по полю date_ts (epoch).
+    Границы диапазонов включительные; date_to без времени — до конца дня.
+    """
+
+    status: Optional[str] = None
+    risk_level: Optional[str] = None
+    commodity: Optional[str] = None
+    region: Optional[str] = None
+    counterparty: Optional[str] = None
+    min_amount_usd: Optional[float] = None
+    max_amount_usd: Optional[float] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+    @field_validator("date_from", "date_to")
+    @classmethod
+    def _valid_date(cls, value: Optional[str]) -> Optional[str]:
+        to_epoch(value)
+        return value
+
+    def to_where(self, environment: Optional[str] = None) -> Dict[str, Any]:
+        """where-клауза Chroma ({} — без фильтра)"""
+        clauses: List[Dict[str, Any]] = [
+            {key: value}
+            for key, value in (
+                ("status", self.status),
+                ("risk_level", self.risk_level),
+                ("commodity", self.commodity),
+                ("region", self.region),
+                ("counterparty", self.counterparty)
+            )
+            if value
+        ]
+        if self.min_amount_usd is not None:
+            clauses.append({"total_amount_usd": {"$gte": self.min_amount_usd}})
+        if self.max_amount_usd is not None:
+            clauses.append({"total_amount_usd": {"$lte": self.max_amount_usd}})
+        if self.date_from:
+            clauses.append({DATE_FIELDS["date"]: {"$gte": to_epoch(self.date_from)}})
+        if self.date_to:
+            clauses.append({DATE_FIELDS["date"]: {"$lte": to_epoch(self.date_to, end_of_day=True)}})
+        if environment:
+            clauses.append({"environment": environment})
+        return and_where(clauses)
+
+    def describe(self) -> Dict[str, Any]:
+        """Фильтры для ответа API (risk — прежнее имя risk_level)"""
+        return {
+            "status": self.status,
+            "risk": self.risk_level,
+            "commodity": self.commodity,
+            "region": self.region,
+            "counterparty": self.counterparty,
+            "min_amount_usd": self.min_amount_usd,
+            "max_amount_usd": self.max_amount_usd,
+            "date_from": self.date_from,
+            "date_to": self.date_to
+        }
@@ -0,0 +1,285 @@
+"""
+Тайминги поиска и RAG для OpenMineralHub
+Стадии операции (embedding, vector_query, postprocess, prompt_build, llm),
+гистограммы задержек и подключаемые экспортеры (log, Prometheus, OpenTelemetry)
+"""
+
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import prometheus_client
+except ImportError:  # Prometheus экспортер опционален
+    prometheus_client = None
+
+try:
+    from opentelemetry import metrics as otel_metrics
+except ImportError:  # OpenTelemetry экспортер опционален
+    otel_metrics = None
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм, мс
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_current: "contextvars.ContextVar[Optional[Timings]]" = contextvars.ContextVar("omh_timings", default=None)
+
+
+class Timings:
+    """
+    Тайминги одной операции по стадиям, мс
+
+    Стадия, вызванная несколько раз (или из параллельных потоков fan-out),
+    накапливает суммарное время. Потокобезопасен.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.stages: Dict[str, float] = {}
+        self.total_ms = 0.0
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + elapsed_ms
+
+    def finish(self) -> float:
+        self.total_ms = (time.perf_counter() - self._started) * 1000
+        return self.total_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: round(ms, 3) for name, ms in self.stages.items()}
+        return {"operation": self.operation, "total_ms": round(self.total_ms, 3), "stages": stages}
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Замер стадии текущей операции (без активной операции — no-op)"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def propagate(func: Callable, *args, **kwargs) -> Callable[[], Any]:
+    """Функция для пула потоков, выполняемая в контексте текущей операции (стадии fan-out)"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func, *args, **kwargs)
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными бакетами; перцентили — оценка по бакетам"""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_ms: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+            self.count += 1
+            self.sum_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Верхняя граница бакета, в который попадает квантиль q (последний бакет — max)"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for i, bucket_count in enumerate(self.counts):
+                seen += bucket_count
+                if seen >= rank:
+                    return float(self.buckets[i]) if i < len(self.buckets) else self.max_ms
+            return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum_ms / self.count, 3) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3)
+        }
+
+
+class LogExporter:
+    """Тайминги в лог: debug для каждой операции, warning для медленных"""
+
+    def __init__(self, slow_ms: float = 1000.0):
+        self.slow_ms = slow_ms
+
+    def export(self, timings: Timings) -> None:
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in timings.stages.items())
+        message = f"{timings.operation}: {timings.total_ms:.1f}ms ({stages})"
+        if self.slow_ms and timings.total_ms >= self.slow_ms:
+            logger.warning(f"Медленная операция {message}")
+        else:
+            logger.debug(message)
+
+
+class PrometheusExporter:
+    """Гистограмма omh_operation_latency_seconds{operation, stage} в реестре prometheus_client"""
+
+    _histogram = None
+    _histogram_lock = threading.Lock()
+
+    def __init__(self):
+        if prometheus_client is None:
+            raise ImportError("prometheus_client не установлен")
+        with self._histogram_lock:
+            # Метрика регистрируется один раз на процесс (повторная регистрация — ошибка)
+            if PrometheusExporter._histogram is None:
+                PrometheusExporter._histogram = prometheus_client.Histogram(
+                    "omh_operation_latency_seconds",
+                    "Latency of OpenMineralHub search and RAG operations by stage",
+                    ["operation", "stage"],
+                    buckets=[b / 1000 for b in BUCKETS_MS]
+                )
+
+    def export(self, timings: Timings) -> None:
+        histogram = PrometheusExporter._histogram
+        histogram.labels(timings.operation, "total").observe(timings.total_ms / 1000)
+        for name, ms in timings.stages.items():
+            histogram.labels(timings.operation, name).observe(ms / 1000)
+
+
+class OTelExporter:
+    """Гистограмма omh.operation.duration (мс) через OpenTelemetry metrics API"""
+
+    def __init__(self, service_name: str = "openmineral-chroma"):
+        if otel_metrics is None:
+            raise ImportError("opentelemetry-api не установлен")
+        self._histogram = otel_metrics.get_meter(service_name).create_histogram(
+            "omh.operation.duration",
+            unit="ms",
+            description="Latency of OpenMineralHub search and RAG operations by stage"
+        )
+
+    def export(self, timings: Timings) -> None:
+        self._histogram.record(timings.total_ms, {"operation": timings.operation, "stage": "total"})
+        for name, ms in timings.stages.items():
+            self._histogram.record(ms, {"operation": timings.operation, "stage": name})
+
+
+def build_exporters(names: str, otel_enabled: bool = False, service_name: str = "openmineral-chroma", slow_ms: float = 1000.0) -> List[Any]:
+    """
+    Экспортеры по списку имен через запятую (log, prometheus, otel).
+    OTEL_ENABLED добавляет otel; недоступный экспортер пропускается с предупреждением.
+    """
+    selected = [name.strip() for name in (names or "").split(",") if name.strip()]
+    if otel_enabled and "otel" not in selected:
+        selected.append("otel")
+
+    exporters = []
+    for name in selected:
+        try:
+            if name == "log":
+                exporters.append(LogExporter(slow_ms))
+            elif name == "prometheus":
+                exporters.append(PrometheusExporter())
+            elif name == "otel":
+                exporters.append(OTelExporter(service_name))
+            else:
+                logger.warning(f"Неизвестный экспортер таймингов: {name}")
+        except ImportError as e:
+            logger.warning(f"Экспортер таймингов '{name}' отключен: {e}")
+    return exporters
+
+
+class Instrumentation:
+    """
+    Замер операций сервиса: гистограммы задержек по (операция, стадия)
+    и передача таймингов экспортерам
+
+    Вложенная операция (поиск внутри rag_query) записывается отдельно
+    и добавляет свои стадии во внешнюю операцию.
+    """
+
+    def __init__(self, exporters: Optional[List[Any]] = None, include_timings: bool = False):
+        self.exporters = list(exporters or [])
+        # Тайминги по стадиям в ответах API (отладочный режим)
+        self.include_timings = include_timings
+        self._histograms: Dict[tuple, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, operation: str) -> Iterator[Timings]:
+        timings = Timings(operation)
+        parent = _current.get()
+        token = _current.set(timings)
+        try:
+            yield timings
+        finally:
+            _current.reset(token)
+            timings.finish()
+            if parent is not None:
+                for name, ms in timings.stages.items():
+                    parent.add(name, ms)
+            self.record(timings)
+
+    def record(self, timings: Timings) -> None:
+        """Учет завершенной операции в гистограммах и экспортерах"""
+        self._histogram(timings.operation, "total").observe(timings.total_ms)
+        for name, ms in timings.stages.items():
+            self._histogram(timings.operation, name).observe(ms)
+        for exporter in self.exporters:
+            try:
+                exporter.export(timings)
+            except Exception as e:
+                logger.debug(f"Ошибка экспорта таймингов {type(exporter).__name__}: {e}")
+
+    def _histogram(self, operation: str, stage_name: str) -> LatencyHistogram:
+        key = (operation, stage_name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Сводка гистограмм: {операция: {стадия: count/avg/p50/p95/p99/max}}"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+        result: Dict[str, Dict[str, Any]] = {}
+        for (operation, stage_name), histogram in items:
+            result.setdefault(operation, {})[stage_name] = histogram.snapshot()
+        return result
+
+
+def instrumented(operation: str):
+    """
+    Декоратор метода сервиса с атрибутом instrumentation: замер операции,
+    processing_time_ms в ответе-словаре и timings по стадиям при include_timings
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.instrumentation.measure(operation) as timings:
+                result = method(self, *args, **kwargs)
+            if isinstance(result, dict):
+                result = {**result, "processing_time_ms": round(timings.total_ms, 3)}
+                if self.instrumentation.include_timings:
+                    result["timings"] = timings.as_dict()
+            return result
+        return wrapper
+    return decorator
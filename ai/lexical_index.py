@@ -0,0 +1,212 @@
+"""
+Лексический индекс коллекций для OpenMineralHub
+BM25 по инвертированному индексу и точный поиск идентификаторов (LEI, ID сделок, символы)
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from typing import AbstractSet, Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from ai.filters import matches_where
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Идентификаторы в тексте запроса/документа (проверяются в верхнем регистре).
+# ID сделки — префикс и номер (OMH-004), а не любое слово через дефис (long-term);
+# символы (Ni, Cu) — только значения поля symbol метаданных коллекции.
+LEI_RE = re.compile(r"^[A-Z0-9]{18,20}$")
+DEAL_ID_RE = re.compile(r"^[A-Z]{2,6}-\d+$")
+# Поля метаданных, значения которых индексируются как идентификаторы
+IDENTIFIER_FIELDS = ("deal_id", "lei", "symbol")
+
+_STRIP_CHARS = ".,;:!?()[]{}\"'«»"
+
+
+def tokenize(text: str) -> List[str]:
+    """Токены для BM25 (нижний регистр, без пунктуации)"""
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def _is_lei(token: str) -> bool:
+    return bool(LEI_RE.match(token)) and any(ch.isdigit() for ch in token) and any(ch.isalpha() for ch in token)
+
+
+def _is_deal_id(token: str) -> bool:
+    return bool(DEAL_ID_RE.match(token.upper()))
+
+
+def identifier_tokens(text: str, symbols: AbstractSet[str] = frozenset()) -> List[str]:
+    """
+    Токены запроса, похожие на идентификаторы: LEI, ID сделок (OMH-004)
+    и символы из symbols (значения поля symbol в верхнем регистре, например NI)
+    """
+    tokens = []
+    for raw in (text or "").split():
+        token = raw.strip(_STRIP_CHARS)
+        if token and (_is_lei(token) or _is_deal_id(token) or token.upper() in symbols):
+            tokens.append(token)
+    return tokens
+
+
+def is_identifier_query(text: str, symbols: AbstractSet[str] = frozenset()) -> bool:
+    """Запрос целиком состоит из идентификаторов (OMH-004, LEI, известные символы)"""
+    return bool(text and text.split()) and len(identifier_tokens(text, symbols)) == len(text.split())
+
+
+def _document_identifiers(doc_id: str, document: str, metadata: Dict[str, Any]) -> Set[str]:
+    """Идентификаторы документа: id, поля IDENTIFIER_FIELDS, LEI и ID сделок из текста"""
+    identifiers = {doc_id.upper()}
+    for field in IDENTIFIER_FIELDS:
+        value = metadata.get(field)
+        if isinstance(value, str) and value:
+            identifiers.add(value.upper())
+    # Символы (Ni, Cu) берутся только из метаданных: в тексте слишком много коротких слов
+    for raw in (document or "").split():
+        token = raw.strip(_STRIP_CHARS)
+        if _is_lei(token) or _is_deal_id(token):
+            identifiers.add(token.upper())
+    return identifiers
+
+
+def _symbol(metadata: Dict[str, Any]) -> Optional[str]:
+    value = metadata.get("symbol")
+    return value.upper() if isinstance(value, str) and value else None
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс одной коллекции
+
+    Хранит term → {doc_id: tf} для BM25 и identifier → {doc_id} для точного
+    поиска за O(1). Документы и метаданные хранятся рядом, поэтому точные
+    совпадения отдаются без обращения к Chroma. Потокобезопасен.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._identifiers: Dict[str, Set[str]] = {}
+        self._docs: Dict[str, Tuple[str, Dict[str, Any], int, Set[str]]] = {}
+        # Символ (верхний регистр) → число документов с таким значением поля symbol
+        self._symbols: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id: str, document: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Добавление или замена документа"""
+        metadata = dict(metadata or {})
+        terms = Counter(tokenize(document))
+        identifiers = _document_identifiers(doc_id, document, metadata)
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            for identifier in identifiers:
+                self._identifiers.setdefault(identifier, set()).add(doc_id)
+            length = sum(terms.values())
+            self._docs[doc_id] = (document, metadata, length, identifiers)
+            symbol = _symbol(metadata)
+            if symbol:
+                self._symbols[symbol] = self._symbols.get(symbol, 0) + 1
+            self._total_length += length
+
+    def add_many(self, ids: Iterable[str], documents: Iterable[str], metadatas: Iterable[Optional[Dict[str, Any]]]) -> None:
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self.add(doc_id, document, metadata)
+
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        document, metadata, length, identifiers = entry
+        self._total_length -= length
+        symbol = _symbol(metadata)
+        if symbol:
+            self._symbols[symbol] -= 1
+            if not self._symbols[symbol]:
+                del self._symbols[symbol]
+        for term in set(tokenize(document)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        for identifier in identifiers:
+            ids = self._identifiers.get(identifier)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._identifiers[identifier]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._identifiers.clear()
+            self._docs.clear()
+            self._symbols.clear()
+            self._total_length = 0
+
+    def lookup(self, query: str, where: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Точные совпадения идентификаторов из запроса (в порядке токенов запроса)"""
+        found: List[str] = []
+        with self._lock:
+            for token in identifier_tokens(query, self._symbols.keys()):
+                for doc_id in sorted(self._identifiers.get(token.upper(), ())):
+                    if doc_id not in found and matches_where(self._docs[doc_id][1], where):
+                        found.append(doc_id)
+        return found
+
+    def is_identifier_query(self, query: str) -> bool:
+        """Запрос целиком из идентификаторов; символы — только известные индексу"""
+        with self._lock:
+            return is_identifier_query(query, self._symbols.keys())
+
+    def search(self, query: str, where: Optional[Dict[str, Any]] = None, limit: int = 10) -> List[Tuple[str, float]]:
+        """BM25 ранжирование документов, удовлетворяющих where"""
+        terms = set(tokenize(query))
+        scores: Dict[str, float] = {}
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs or not terms:
+                return []
+            avg_length = self._total_length / n_docs or 1.0
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id][2]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            return [
+                (doc_id, score) for doc_id, score in ranked
+                if matches_where(self._docs[doc_id][1], where)
+            ][:limit]
+
+    def get(self, doc_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(документ, метаданные) из индекса"""
+        with self._lock:
+            entry = self._docs.get(doc_id)
+            return (entry[0], entry[1]) if entry else None
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Слияние ранжированных списков id: score = Σ 1 / (k + rank)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
@@ -0,0 +1,142 @@
+"""
+Cross-encoder re-ranking для OpenMineralHub
+Второй этап поиска: переоценка кандидатов Chroma локальной CPU моделью
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# Функция оценки: список пар (запрос, документ) → список score
+ScoreFunction = Callable[[List[Tuple[str, str]]], Sequence[float]]
+
+
+def _load_cross_encoder(model_name: str, num_threads: int) -> ScoreFunction:
+    """Загрузка sentence-transformers CrossEncoder на CPU"""
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model = CrossEncoder(model_name, device="cpu")
+    return lambda pairs: model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+
+class CrossEncoderReranker:
+    """
+    Переранжирование кандидатов cross-encoder моделью
+
+    Пары (запрос, документ) оцениваются батчами по batch_size. Score кешируются
+    в LRU по (хеш запроса, id документа); вместе со score хранится хеш текста,
+    поэтому измененный документ переоценивается. Между батчами проверяется
+    бюджет времени: если он исчерпан, возвращается исходный (векторный) порядок,
+    а уже посчитанные score остаются в кеше для следующих запросов.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        batch_size: int = 16,
+        cache_size: int = 4096,
+        num_threads: int = 4,
+        score_function: Optional[ScoreFunction] = None
+    ):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.num_threads = num_threads
+        self._score_function = score_function
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_score_function(self) -> ScoreFunction:
+        with self._lock:
+            if self._score_function is None:
+                self._score_function = _load_cross_encoder(self.model_name, self.num_threads)
+                logger.info(f"Cross-encoder загружен: {self.model_name}")
+            return self._score_function
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+    def _cached(self, key: Tuple[str, str], doc_digest: str) -> Optional[float]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != doc_digest:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _store(self, key: Tuple[str, str], doc_digest: str, score: float) -> None:
+        with self._lock:
+            self._cache[key] = (doc_digest, score)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, ids: List[str], documents: List[str], budget_ms: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Порядок кандидатов по score cross-encoder.
+        Возвращает {"order": индексы кандидатов, "reranked": bool, "scores", "scored", "cached", "elapsed_ms"}.
+        """
+        started = time.perf_counter()
+        deadline = started + budget_ms / 1000 if budget_ms else None
+        query_hash = self._digest(" ".join(query.lower().split()))
+
+        scores: List[Optional[float]] = []
+        digests = []
+        for doc_id, document in zip(ids, documents):
+            digest = self._digest(document)
+            digests.append(digest)
+            scores.append(self._cached((query_hash, doc_id), digest))
+        cached = sum(score is not None for score in scores)
+
+        pending = [i for i, score in enumerate(scores) if score is None]
+        scored = 0
+        for start in range(0, len(pending), self.batch_size):
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            batch = pending[start:start + self.batch_size]
+            batch_scores = self._get_score_function()([(query, documents[i]) for i in batch])
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+                self._store((query_hash, ids[i]), digests[i], scores[i])
+            scored += len(batch)
+
+        complete = all(score is not None for score in scores)
+        if complete:
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        else:
+            order = list(range(len(scores)))
+            logger.warning(f"Бюджет re-ranking {budget_ms} мс исчерпан: оценено {scored + cached}/{len(scores)}, векторный порядок")
+
+        return {
+            "order": order,
+            "reranked": complete,
+            "scores": scores,
+            "scored": scored,
+            "cached": cached,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
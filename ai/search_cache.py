@@ -0,0 +1,180 @@
+"""
+Кеш результатов поиска Chroma для OpenMineralHub
+In-process LRU уровень + опциональный Redis уровень, TTL и инвалидация по коллекции
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+try:
+    import redis
+except ImportError:  # Redis уровень опционален
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """
+    Двухуровневый кеш результатов collection.query()
+
+    Ключ: коллекция + нормализованный запрос + where-фильтр + n_results.
+    Каждая коллекция имеет счетчик поколений: запись в коллекцию увеличивает
+    его, и все ранее закешированные результаты этой коллекции становятся
+    недоступны. При включенном Redis счетчик хранится в Redis, поэтому
+    инвалидация видна всем процессам.
+    """
+
+    KEY_PREFIX = "omh:search"
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 3600, redis_url: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                logger.warning("REDIS_ENABLED=true, но пакет redis не установлен — используется только локальный кеш")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Нормализация запроса: регистр и пробелы не влияют на ключ"""
+        return " ".join((query or "").lower().split())
+
+    def make_key(self, collection: str, query: str, where: Optional[Dict[str, Any]], n_results: int) -> str:
+        """Ключ кеша без учета поколения коллекции"""
+        payload = json.dumps(
+            {"q": self.normalize_query(query), "w": where or {}, "n": n_results},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return f"{collection}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+    def _generation(self, collection: str) -> int:
+        """Текущее поколение коллекции (из Redis, если он доступен)"""
+        if self._redis is not None:
+            try:
+                value = self._redis.get(f"{self.KEY_PREFIX}:gen:{collection}")
+                return int(value or 0)
+            except Exception as e:
+                logger.debug(f"Redis недоступен при чтении поколения: {e}")
+        return self._generations.get(collection, 0)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Результат из кеша или None"""
+        collection = key.split(":", 1)[0]
+        generation = self._generation(collection)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, entry_generation, value = entry
+                if expires_at > now and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(f"{self.KEY_PREFIX}:{generation}:{key}")
+            except Exception as e:
+                logger.debug(f"Redis недоступен при чтении кеша: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._store_local(key, generation, value)
+                with self._lock:
+                    self.hits += 1
+                    self.redis_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """Сохранение результата в оба уровня"""
+        collection = key.split(":", 1)[0]
+        generation = self._generation(collection)
+        self._store_local(key, generation, value)
+
+        if self._redis is not None:
+            try:
+                self._redis.setex(
+                    f"{self.KEY_PREFIX}:{generation}:{key}",
+                    self.ttl_seconds,
+                    json.dumps(value, ensure_ascii=False, default=str)
+                )
+            except Exception as e:
+                logger.debug(f"Redis недоступен при записи кеша: {e}")
+
+    def _store_local(self, key: str, generation: int, value: Any) -> None:
+        """Запись в локальный LRU с вытеснением самых старых записей"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, collection: str) -> None:
+        """Сброс всех закешированных результатов коллекции"""
+        with self._lock:
+            self._generations[collection] = self._generations.get(collection, 0) + 1
+            prefix = f"{collection}:"
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+            self.invalidations += 1
+
+        if self._redis is not None:
+            try:
+                self._redis.incr(f"{self.KEY_PREFIX}:gen:{collection}")
+            except Exception as e:
+                logger.warning(f"Не удалось инвалидировать Redis кеш коллекции {collection}: {e}")
+
+    def clear(self) -> None:
+        """Полная очистка локального уровня"""
+        with self._lock:
+            self._entries.clear()
+
+    def close(self) -> None:
+        """Закрытие соединений с Redis"""
+        if self._redis is not None:
+            try:
+                self._redis.close()
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия Redis клиента кеша: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий/промахов для get_collection_stats"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "redis_hits": self.redis_hits,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl_seconds,
+                "redis_enabled": self._redis is not None
+            }
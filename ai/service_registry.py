@@ -0,0 +1,104 @@
+"""
+Реестр сервисов-синглтонов OpenMineralHub
+Потокобезопасное ленивое создание и пересоздание в дочернем процессе после fork
+"""
+
+import functools
+import inspect
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _reset_in_child(ref: "weakref.ref") -> None:
+    registry = ref()
+    if registry is not None:
+        registry._reset_after_fork()
+
+
+class ServiceRegistry:
+    """
+    Ленивые синглтоны по ключу (например, "prod"/"test")
+
+    get() использует double-checked locking: готовый экземпляр читается без
+    блокировки, фабрика под блокировкой вызывается не больше одного раза на ключ,
+    даже если get() одновременно вызывают десятки потоков. Ошибка фабрики не
+    запоминается — следующий get() пробует снова.
+
+    После fork (gunicorn --preload, Celery prefork) дочерний процесс получает
+    пустой реестр и новую блокировку: клиенты, пулы потоков и сокеты родителя
+    в дочернем процессе не используются и не закрываются (они принадлежат родителю).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._instances: Dict[str, Any] = {}
+        self._pid = os.getpid()
+        self.created = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=functools.partial(_reset_in_child, weakref.ref(self)))
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._pid = os.getpid()
+        self.created = 0
+
+    def get(self, key: str, factory: Callable[[], Any]) -> Any:
+        """Экземпляр по ключу; создается фабрикой при первом обращении"""
+        instance = self._instances.get(key)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                instance = factory()
+                self._instances[key] = instance
+                self.created += 1
+                logger.info(f"Реестр '{self.name}': создан экземпляр '{key}' (pid {self._pid})")
+            return instance
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Экземпляр без создания"""
+        return self._instances.get(key)
+
+    def _pop(self, key: Optional[str]) -> List[Any]:
+        with self._lock:
+            if key is None:
+                instances = list(self._instances.values())
+                self._instances = {}
+            else:
+                instance = self._instances.pop(key, None)
+                instances = [instance] if instance is not None else []
+        return instances
+
+    def close(self, key: Optional[str] = None) -> None:
+        """
+        Закрытие экземпляра (или всех при key=None): он удаляется из реестра,
+        затем вызывается его close(). Следующий get() создаст новый экземпляр.
+        """
+        for instance in self._pop(key):
+            close = getattr(instance, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.error(f"Ошибка закрытия сервиса в реестре '{self.name}': {e}")
+
+    async def aclose(self, key: Optional[str] = None) -> None:
+        """close() для async сервисов: используется aclose(), если он есть"""
+        for instance in self._pop(key):
+            close = getattr(instance, "aclose", None) or getattr(instance, "close", None)
+            if close is None:
+                continue
+            try:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Ошибка закрытия сервиса в реестре '{self.name}': {e}")
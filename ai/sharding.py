@@ -0,0 +1,192 @@
+"""
+Шардирование поискового индекса сделок OpenMineralHub
+Записи сделок раскладываются по коллекциям-шардам по значению ключа (commodity/region);
+запрос с фильтром по ключу идет только в нужные шарды, без фильтра — во все параллельно
+"""
+
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Разделитель имени базовой коллекции и значения ключа: openmineral_deals_shard_copper
+SHARD_SEPARATOR = "_shard_"
+# Шард записей без значения ключа в метаданных
+UNKNOWN_SHARD = "unknown"
+
+ROW_FIELDS = ("ids", "documents", "metadatas", "distances")
+
+
+def shard_slug(value: Any) -> str:
+    """Значение ключа → часть имени коллекции (допустимые для Chroma символы)"""
+    slug = re.sub(r"[^a-z0-9_-]+", "-", str(value if value is not None else "").lower()).strip("-_")
+    return slug or UNKNOWN_SHARD
+
+
+def shard_values(where: Optional[Dict[str, Any]], key: str) -> Optional[List[Any]]:
+    """
+    Значения ключа шардирования, которыми ограничен where-фильтр:
+    {key: v}, {key: {"$eq": v}}, {key: {"$in": [...]}} и они же внутри $and.
+    None — фильтр не ограничивает ключ (запрос идет во все шарды).
+    """
+    if not where:
+        return None
+    if key in where:
+        condition = where[key]
+        if not isinstance(condition, dict):
+            return [condition]
+        if "$eq" in condition:
+            return [condition["$eq"]]
+        if "$in" in condition:
+            return list(condition["$in"])
+        return None
+    for clause in where.get("$and", []):
+        values = shard_values(clause, key)
+        if values is not None:
+            return values
+    return None
+
+
+def merge_rows(rows: List[Dict[str, list]], n_results: int) -> Dict[str, list]:
+    """Top-k по дистанции из строк результатов нескольких шардов"""
+    ranked = sorted(
+        (item for row in rows for item in zip(*(row[field] for field in ROW_FIELDS))),
+        key=lambda item: item[3]
+    )[:n_results]
+    return {field: [item[i] for item in ranked] for i, field in enumerate(ROW_FIELDS)}
+
+
+class ShardedCollection:
+    """
+    Набор коллекций-шардов с интерфейсом коллекции Chroma
+    (upsert/get/delete/count/query), которого достаточно индексу чанков сервиса.
+
+    Шард создается при первой записи с новым значением ключа; существующие шарды
+    находятся по префиксу имени при создании объекта. Запись, у которой сменилось
+    значение ключа, удаляется из прежнего шарда в том же upsert().
+    """
+
+    def __init__(self, client, base_name: str, shard_key: str, metadata: Optional[Dict[str, Any]] = None, max_workers: int = 8):
+        self.client = client
+        self.base_name = base_name
+        self.shard_key = shard_key
+        self.prefix = base_name + SHARD_SEPARATOR
+        self._metadata = metadata or {}
+        self._shards: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chroma-shards")
+
+        for collection in client.list_collections():
+            name = getattr(collection, "name", collection)
+            if isinstance(name, str) and name.startswith(self.prefix):
+                self._shards[name[len(self.prefix):]] = client.get_or_create_collection(name=name)
+        if self._shards:
+            logger.info(f"Шарды '{base_name}' по '{shard_key}': {sorted(self._shards)}")
+
+    @property
+    def shards(self) -> Dict[str, Any]:
+        return dict(self._shards)
+
+    def names(self) -> List[str]:
+        return [self.prefix + slug for slug in sorted(self._shards)]
+
+    def _shard(self, slug: str):
+        shard = self._shards.get(slug)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._shards.get(slug)
+            if shard is None:
+                shard = self.client.get_or_create_collection(
+                    name=self.prefix + slug,
+                    metadata={**self._metadata, "shard_key": self.shard_key, "shard": slug}
+                )
+                self._shards[slug] = shard
+                logger.info(f"Создан шард {self.prefix + slug}")
+            return shard
+
+    def _map(self, func, slugs: List[str]) -> List[Any]:
+        """func(шард) для каждого шарда параллельно; порядок результатов — порядок slugs"""
+        shards = [self._shards[slug] for slug in slugs]
+        if len(shards) <= 1:
+            return [func(shard) for shard in shards]
+        return list(self._executor.map(func, shards))
+
+    def route(self, where: Optional[Dict[str, Any]]) -> List[str]:
+        """Шарды, которые нужно опросить для where-фильтра"""
+        values = shard_values(where, self.shard_key)
+        if values is None:
+            return sorted(self._shards)
+        return sorted({shard_slug(value) for value in values} & set(self._shards))
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: List[Any]) -> None:
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(shard_slug((metadata or {}).get(self.shard_key)), []).append(i)
+        targets = {ids[i]: slug for slug, positions in groups.items() for i in positions}
+
+        # Записи, переехавшие в другой шард, удаляются из прежнего
+        def drop_moved(slug: str) -> None:
+            moved = [doc_id for doc_id, target in targets.items() if target != slug]
+            if moved:
+                self._shards[slug].delete(ids=moved)
+
+        existing = sorted(self._shards)
+        if len(existing) <= 1:
+            for slug in existing:
+                drop_moved(slug)
+        else:
+            list(self._executor.map(drop_moved, existing))
+
+        for slug, positions in groups.items():
+            self._shard(slug).upsert(
+                ids=[ids[i] for i in positions],
+                documents=[documents[i] for i in positions],
+                metadatas=[metadatas[i] for i in positions],
+                embeddings=[embeddings[i] for i in positions]
+            )
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else include
+        parts = self._map(lambda shard: shard.get(ids=ids, where=where, include=include), self.route(where))
+        result = {"ids": [doc_id for part in parts for doc_id in part["ids"]]}
+        for field in include:
+            result[field] = [value for part in parts for value in (part.get(field) or [])]
+        start = offset or 0
+        end = start + limit if limit is not None else None
+        return {field: values[start:end] for field, values in result.items()}
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        self._map(lambda shard: shard.delete(ids=ids, where=where), self.route(where))
+
+    def count(self) -> int:
+        return sum(self.counts().values())
+
+    def counts(self) -> Dict[str, int]:
+        slugs = sorted(self._shards)
+        return dict(zip(slugs, self._map(lambda shard: shard.count(), slugs)))
+
+    def query(self, query_embeddings: List[Any], n_results: int, where: Optional[Dict[str, Any]] = None) -> Dict[str, list]:
+        """
+        Запрос к шардам из route(where) параллельно; по каждому запросу
+        результаты шардов сливаются в общий top-n по дистанции
+        """
+        slugs = self.route(where)
+        parts = self._map(
+            lambda shard: shard.query(query_embeddings=query_embeddings, n_results=n_results, where=where),
+            slugs
+        )
+        merged = {field: [] for field in ROW_FIELDS}
+        for pos in range(len(query_embeddings)):
+            rows = [{field: part[field][pos] or [] for field in ROW_FIELDS} for part in parts]
+            row = merge_rows(rows, n_results)
+            for field in ROW_FIELDS:
+                merged[field].append(row[field])
+        return merged
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+"""
+Общие фикстуры тестов AI сервисов OpenMineralHub
+"""
+
+import os
+import uuid
+
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+
+from ai.chroma_service import ChromaService, close_chroma_services, get_chroma_service
+from config.chroma_config import chroma_config
+
+
+def fake_embedding_function(texts):
+    """Детерминированные эмбеддинги без загрузки модели"""
+    return [np.array([len(t), sum(map(ord, t)) % 97, 1.0], dtype=np.float32) for t in texts]
+
+@pytest.fixture
+def mock_chroma_client():
+    """Мок клиента Chroma для unit тестов"""
+    mock_client = MagicMock()
+    mock_collection = MagicMock()
+    
+    # Моки методов коллекции
+    mock_collection.count.return_value = 0
+    mock_collection.query.return_value = {
+        "ids": [[]],
+        "documents": [[]],
+        "metadatas": [[]],
+        "distances": [[]]
+    }
+    mock_collection.get.return_value = {
+        "ids": [],
+        "documents": [],
+        "metadatas": []
+    }
+    mock_collection.add.return_value = None
+    
+    # Коллекции чанков — отдельный пустой мок, чтобы запись чанков не влияла на вызовы основных коллекций
+    chunk_collection = MagicMock()
+    chunk_collection.count.return_value = 0
+    chunk_collection.get.return_value = {"ids": [], "documents": [], "metadatas": []}
+    
+    def get_or_create_collection(name, **kwargs):
+        if name.endswith(ChromaService.CHUNK_COLLECTION_SUFFIX):
+            return chunk_collection
+        return mock_collection
+    
+    # Моки методов клиента
+    mock_client.get_or_create_collection.return_value = mock_collection
+    mock_client.get_or_create_collection.side_effect = get_or_create_collection
+    mock_client.create_collection.return_value = mock_collection
+    mock_client.list_collections.return_value = [mock_collection]
+    
+    return mock_client
+
+@pytest.fixture
+def mock_chroma_service(mock_chroma_client):
+    """ChromaService (test mode) поверх мок-клиента и фейковых эмбеддингов"""
+    with patch.object(ChromaService, "_test_client", return_value=mock_chroma_client):
+        service = ChromaService(is_test_mode=True)
+    service.embedding_function = fake_embedding_function
+    return service
+
+@pytest.fixture(scope="module")
+def ephemeral_chroma():
+    """
+    In-memory Chroma для модуля тестов: test mode сервиса (в т.ч. get_chroma_service
+    и DataLoader) работает с отдельной базой данных сессии вместо ./chroma_test_db.
+    Ключ сессии уникален для процесса, поэтому модули можно запускать параллельно.
+    Эмбеддинги — fake_embedding_function (без загрузки модели и сетевых запросов).
+    """
+    session = f"{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    with patch.object(chroma_config, "TEST_CLIENT", "ephemeral"), \
+         patch.object(chroma_config, "TEST_SESSION", session), \
+         patch.object(ChromaService, "_build_embedding_function", return_value=fake_embedding_function):
+        close_chroma_services()
+        yield session
+        close_chroma_services()
+
+@pytest.fixture(scope="module")
+def seeded_chroma_snapshot(ephemeral_chroma):
+    """Снимок тестовой БД с начальными данными: загрузка и эмбеддинги — один раз на модуль"""
+    service = get_chroma_service(is_test_mode=True)
+    service.cleanup_test_db()
+    assert service.load_initial_data() is True
+    return service.snapshot_test_db()
+
+@pytest.fixture
+def chroma_test_service(seeded_chroma_snapshot):
+    """get_chroma_service(is_test_mode=True) с начальными данными, восстановленными из снимка"""
+    service = get_chroma_service(is_test_mode=True)
+    assert service.restore_test_db(seeded_chroma_snapshot) is True
+    return service
@@ -0,0 +1,81 @@
+"""
+Тесты семантического кеша ответов RAG
+"""
+
+from unittest.mock import patch
+
+import numpy as np
+
+from ai.answer_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache:
+    """Поиск по косинусной близости, TTL, вытеснение и инвалидация"""
+
+    def test_lookup_by_similarity_and_scope(self):
+        cache = SemanticAnswerCache(threshold=0.9)
+        cache.store("цена меди", [1.0, 0.0, 0.1], "scope", ["cu"], {"response": "9500"})
+
+        hit = cache.lookup([0.98, 0.05, 0.1], "scope")
+        assert hit["payload"] == {"response": "9500"}
+        assert hit["similarity"] > 0.9
+        assert cache.lookup([0.0, 1.0, 0.0], "scope") is None  # другой запрос
+        assert cache.lookup([1.0, 0.0, 0.1], "other") is None  # другие фильтры
+
+    def test_ttl_and_size_bound(self):
+        cache = SemanticAnswerCache(threshold=0.9, ttl_seconds=10, max_entries=2)
+        with patch("ai.answer_cache.time.time", return_value=1000.0):
+            cache.store("a", [1, 0, 0], "s", ["a"], {})
+        with patch("ai.answer_cache.time.time", return_value=1001.0):
+            cache.store("b", [0, 1, 0], "s", ["b"], {})
+        with patch("ai.answer_cache.time.time", return_value=1002.0):
+            cache.lookup([1, 0, 0], "s")  # "a" использован последним
+            cache.store("c", [0, 0, 1], "s", ["c"], {})
+            assert cache.stats()["evictions"] == 1
+            assert cache.lookup([0, 1, 0], "s") is None  # вытеснен "b"
+        with patch("ai.answer_cache.time.time", return_value=1012.0):
+            assert cache.lookup([0, 0, 1], "s") is None  # истек TTL
+            assert cache.stats()["entries"] == 0
+
+    def test_invalidate_by_source_document(self):
+        cache = SemanticAnswerCache(threshold=0.9)
+        cache.store("медь", [1, 0], "s", ["cu", "li"], {})
+        cache.store("золото", [0, 1], "s", ["au"], {})
+        assert cache.invalidate_documents(["li"]) == 1
+        assert cache.lookup([1, 0], "s") is None
+        assert cache.lookup([0, 1], "s") is not None
+
+
+class TestRagQueryCache:
+    """Семантический кеш в ChromaService.rag_query"""
+
+    def test_paraphrase_served_from_cache_until_source_changes(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.embedding_function = lambda texts: [np.array([1.0, 0.0, 0.01 * len(t)], dtype=np.float32) for t in texts]
+        service.minerals_collection.query.return_value = {
+            "ids": [["cu_base_metal"]],
+            "documents": [["Медь (Cu)"]],
+            "metadatas": [[{"commodity": "copper", "current_price": 9500}]],
+            "distances": [[0.1]]
+        }
+
+        with patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False):
+            first = service.rag_query("цена меди")
+            second = service.rag_query("цена меди сейчас")
+            assert first["cache"] == {"hit": False}
+            assert second["cache"]["hit"] is True
+            assert second["query"] == "цена меди сейчас"
+            assert second["response"] == first["response"]
+
+            # Другие документы в выдаче — закешированный ответ не используется
+            service.minerals_collection.query.return_value = {
+                "ids": [["ni_base_metal"]],
+                "documents": [["Никель (Ni)"]],
+                "metadatas": [[{"commodity": "nickel", "current_price": 18000}]],
+                "distances": [[0.1]]
+            }
+            assert service.rag_query("цена меди?")["cache"] == {"hit": False}
+
+            # Изменение документа-источника удаляет ответ из кеша
+            service.upsert_documents("minerals", [{"id": "ni_base_metal", "document": "Никель", "metadata": {}}])
+            assert service.answer_cache.stats()["entries"] == 1
@@ -0,0 +1,123 @@
+"""
+Тесты async фасада ChromaService
+"""
+
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+from ai.async_chroma_service import AsyncChromaService
+
+
+class TestAsyncChromaService:
+    """Блокирующие вызовы не останавливают event loop"""
+
+    def test_concurrent_requests_overlap(self):
+        service = MagicMock()
+
+        def slow_search(query, n_results=3, filters=None, rerank=None):
+            time.sleep(0.2)
+            return {"success": True, "query": query}
+        service.search_minerals.side_effect = slow_search
+
+        async_service = AsyncChromaService(service, max_workers=4)
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker_task = asyncio.create_task(ticker())
+            started = time.perf_counter()
+            results = await asyncio.gather(*(async_service.search_minerals(f"q{i}") for i in range(4)))
+            elapsed = time.perf_counter() - started
+            ticker_task.cancel()
+            return results, elapsed, ticks
+
+        try:
+            results, elapsed, ticks = asyncio.run(run())
+        finally:
+            async_service.close()
+
+        assert [r["query"] for r in results] == ["q0", "q1", "q2", "q3"]
+        assert elapsed < 0.6  # 4 × 0.2s выполняются параллельно, а не последовательно
+        assert ticks > 5  # event loop продолжал обслуживать другие задачи
+
+
+class TestStreamRagQuery:
+    """Потоковый RAG через SSE события"""
+
+    def _service(self, is_test_mode):
+        service = MagicMock()
+        service.is_test_mode = is_test_mode
+        service.RAG_LLM_MODEL = "gpt-test"
+        service.RAG_MOCK_RESPONSE = "Мок ответ"
+        service.search_minerals.return_value = {
+            "success": True,
+            "results_count": 1,
+            "results": [{"document": "Медь", "metadata": {"commodity": "copper"}}],
+            "environment": "test"
+        }
+        service.rag_candidates.return_value = 4
+        service.rag_context.return_value = {
+            "context": "Медь",
+            "results": [{"document": "Медь", "metadata": {"commodity": "copper"}}]
+        }
+        service.context_stats.return_value = {"tokens": 2, "documents": 1}
+        return service
+
+    def test_sources_first_then_tokens(self):
+        async_service = AsyncChromaService(self._service(is_test_mode=True), max_workers=1)
+
+        async def collect():
+            return [event async for event in async_service.stream_rag_query("медь")]
+
+        try:
+            events = asyncio.run(collect())
+        finally:
+            async_service.close()
+
+        assert [e["event"] for e in events] == ["sources", "token", "token", "done"]
+        assert events[0]["data"]["sources"] == [{"commodity": "copper"}]
+        assert "".join(e["data"]["text"] for e in events if e["event"] == "token").strip() == "Мок ответ"
+
+    def test_closing_stream_stops_llm_generation(self):
+        service = self._service(is_test_mode=False)
+        produced = []
+        closed = []
+
+        async def fake_astream(inputs):
+            try:
+                for i in range(100):
+                    produced.append(i)
+                    yield f"t{i}"
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(True)
+        service.rag_chain.return_value.astream.side_effect = fake_astream
+
+        async_service = AsyncChromaService(service, max_workers=1)
+
+        async def consume_two_tokens():
+            events = async_service.stream_rag_query("медь")
+            received = []
+            async for event in events:
+                received.append(event)
+                if event["event"] == "token" and len(received) == 3:
+                    break  # клиент отключился
+            await events.aclose()
+            return received
+
+        try:
+            received = asyncio.run(consume_two_tokens())
+        finally:
+            async_service.close()
+
+        assert [e["event"] for e in received] == ["sources", "token", "token"]
+        assert closed == [True]
+        assert len(produced) < 5
+        service.rag_chain.assert_called_once_with(streaming=True)
@@ -5,11 +5,14 @@
 
 import pytest
 import sys
+import time
 import os
 import shutil
 from unittest.mock import patch, MagicMock
 from ai.chroma_service import ChromaService, get_chroma_service
 from ai.data_loader import DataLoader
+from config.chroma_config import chroma_config
+from ai.tests.conftest import fake_embedding_function
 
 # Константы для тестов
 TEST_DB_PATH = "./chroma_test_db"
@@ -19,33 +22,8 @@ COLLECTIONS = {
     "kyc": "openmineral_kyc"
 }
 
-@pytest.fixture
-def mock_chroma_client():
-    """Мок клиента Chroma для unit тестов"""
-    mock_client = MagicMock()
-    mock_collection = MagicMock()
-    
-    # Моки методов коллекции
-    mock_collection.count.return_value = 0
-    mock_collection.query.return_value = {
-        "ids": [[]],
-        "documents": [[]],
-        "metadatas": [[]],
-        "distances": [[]]
-    }
-    mock_collection.get.return_value = {
-        "ids": [],
-        "documents": [],
-        "metadatas": []
-    }
-    mock_collection.add.return_value = None
-    
-    # Моки методов клиента
-    mock_client.get_or_create_collection.return_value = mock_collection
-    mock_client.create_collection.return_value = mock_collection
-    mock_client.list_collections.return_value = [mock_collection]
-    
-    return mock_client
+# Test mode в этом модуле — in-memory Chroma (см. ephemeral_chroma в conftest.py)
+pytestmark = pytest.mark.usefixtures("ephemeral_chroma")
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_test_environment():
@@ -168,12 +146,9 @@ class TestChromaService:
         except Exception as e:
             pytest.skip(f"Production загрузка пропущена: {e}")
     
-    def test_search_minerals_test_mode(self):
+    def test_search_minerals_test_mode(self, chroma_test_service):
         """Тест поиска по минералам в test режиме"""
-        service = get_chroma_service(is_test_mode=True)
-        
-        # Загружаем тестовые данные
-        service.load_initial_data()
+        service = chroma_test_service
         
         # Поиск
         results = service.search_minerals("медь", n_results=2)
@@ -198,10 +173,9 @@ class TestChromaService:
         
         print(f"✅ Поиск минералов в test режиме: {test_results['results_count']} результатов")
     
-    def test_search_deals_with_filters(self):
+    def test_search_deals_with_filters(self, chroma_test_service):
         """Тест поиска сделок с фильтрами"""
-        service = get_chroma_service(is_test_mode=True)
-        service.load_initial_data()
+        service = chroma_test_service
         
         # Поиск с фильтрами
         results = service.search_deals(
@@ -222,10 +196,9 @@ class TestChromaService:
         
         print(f"✅ Поиск сделок с фильтрами: {results['results_count']} результатов")
     
-    def test_search_kyc_aml_filter(self):
+    def test_search_kyc_aml_filter(self, chroma_test_service):
         """Тест поиска KYC с AML фильтром"""
-        service = get_chroma_service(is_test_mode=True)
-        service.load_initial_data()
+        service = chroma_test_service
         
         # Поиск только clean компаний
         results = service.search_kyc("mining", aml_filter="clean")
@@ -292,12 +265,9 @@ class TestChromaService:
         
         print(f"✅ Документ добавлен в test БД: {result['document_id']}")
     
-    def test_cleanup_test_db(self):
+    def test_cleanup_test_db(self, chroma_test_service):
         """Тест очистки тестовой БД"""
-        service = get_chroma_service(is_test_mode=True)
-        
-        # Загружаем данные
-        service.load_initial_data()
+        service = chroma_test_service
         
         # Проверяем, что данные есть
         initial_stats = service.get_collection_stats()
@@ -318,17 +288,49 @@ class TestChromaService:
         assert service.deals_collection is not None
         assert service.kyc_collection is not None
         
-        # Проверяем, что директория БД пуста или пересоздана
-        assert os.path.exists(TEST_DB_PATH)
-        db_files = os.listdir(TEST_DB_PATH)
-        assert len(db_files) > 0  # Базовые файлы ChromaDB
+        # In-memory база данных сессии, без файлов на диске
+        assert service.is_ephemeral is True
+        assert service.test_database.startswith("omh_test_")
         
         print(f"✅ Тестовая БД очищена: {initial_total} → {final_total} документов")
     
-    def test_collection_stats_test_mode(self):
+    def test_cleanup_persistent_test_db(self, tmp_path):
+        """Тест очистки БД на диске: клиент остается рабочим после очистки"""
+        db_path = str(tmp_path / "chroma_test_db")
+        with patch.object(chroma_config, "TEST_CLIENT", "persistent"), \
+             patch.object(chroma_config, "TEST_DB_PATH", db_path):
+            service = ChromaService(is_test_mode=True)
+        service.embedding_function = fake_embedding_function
+        assert service.is_ephemeral is False
+        
+        assert service.load_initial_data() is True
+        assert service.get_collection_stats()["data"]["total_vectors"] == 14
+        assert service.cleanup_test_db() is True
+        assert service.get_collection_stats()["data"]["total_vectors"] == 0
+        
+        # Проверяем, что директория БД на месте и повторная загрузка работает
+        assert os.path.exists(db_path)
+        assert len(os.listdir(db_path)) > 0  # Базовые файлы ChromaDB
+        assert service.load_initial_data() is True
+        assert service.get_collection_stats()["data"]["total_vectors"] == 14
+        service.close()
+    
+    def test_snapshot_restore_isolates_tests(self, chroma_test_service, seeded_chroma_snapshot):
+        """Тест восстановления снимка: изменения одного теста не видны следующему"""
+        service = chroma_test_service
+        service.add_document("deals", "Временная сделка", {"status": "test"}, id="temp_deal")
+        assert service.get_collection_stats()["data"]["deals"] == 6
+        
+        assert service.restore_test_db(seeded_chroma_snapshot) is True
+        stats = service.get_collection_stats()["data"]
+        assert stats["deals"] == 5
+        assert stats["total_vectors"] == 14
+        assert service.deals_collection.get(ids=["temp_deal"])["ids"] == []
+        assert service.search_deals("медь", n_results=2)["results_count"] > 0
+    
+    def test_collection_stats_test_mode(self, chroma_test_service):
         """Тест статистики в test режиме"""
-        service = get_chroma_service(is_test_mode=True)
-        service.load_initial_data()
+        service = chroma_test_service
         
         stats = service.get_collection_stats()
         
@@ -356,6 +358,228 @@ class TestChromaService:
         assert stats["success"] is True
         print(f"✅ Production БД доступна: {stats['data']['total_vectors']} векторов")
 
+class TestBatchSearch:
+    """Тесты пакетного поиска"""
+    
+    def test_search_batch_groups_round_trips(self, mock_chroma_service):
+        """Запросы с одинаковым фильтром уходят одним query(), порядок ответов сохраняется"""
+        service = mock_chroma_service
+        collection = service.minerals_collection
+        
+        def fake_query(query_embeddings, n_results, where):
+            return {
+                "ids": [[f"q{j}_{i}" for i in range(n_results)] for j in range(len(query_embeddings))],
+                "documents": [["doc"] * n_results for _ in query_embeddings],
+                "metadatas": [[{"type": "base_metal", "total_amount_usd": 100}] * n_results for _ in query_embeddings],
+                "distances": [[0.1] * n_results for _ in query_embeddings]
+            }
+        collection.query.side_effect = fake_query
+        
+        results = service.search_batch([
+            {"collection": "minerals", "query": "медь", "n_results": 1},
+            {"collection": "minerals", "query": "литий", "n_results": 3},
+            {"collection": "deals", "query": "никель", "status_filter": "confirmed"},
+            {"collection": "unknown", "query": "x"}
+        ])
+        
+        assert results["round_trips"] == 2
+        assert collection.query.call_count == 2
+        assert results["success"] is False  # неизвестная коллекция
+        
+        minerals_first, minerals_second, deals, unknown = results["results"]
+        assert minerals_first["query"] == "медь" and minerals_first["results_count"] == 1
+        assert minerals_second["query"] == "литий" and minerals_second["results_count"] == 3
+        assert deals["total_deal_value_usd"] == 500
+        assert unknown["success"] is False
+        
+        first_call = collection.query.call_args_list[0].kwargs
+        assert len(first_call["query_embeddings"]) == 2  # медь + литий одним вызовом
+        assert first_call["n_results"] == 3
+        print("✅ Пакетный поиск объединяет запросы по коллекциям")
+
+class TestFederatedSearch:
+    """Тесты федеративного поиска по всем коллекциям"""
+    
+    def test_search_all_embeds_once_and_queries_concurrently(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.minerals_collection  # мок-клиент возвращает одну коллекцию для всех имен
+        embed_calls = []
+        base_embedding = service.embedding_function
+        
+        def counting_embedding(texts):
+            embed_calls.append(list(texts))
+            return base_embedding(texts)
+        service.embedding_function = counting_embedding
+        
+        def slow_query(query_embeddings, n_results, where):
+            time.sleep(0.2)
+            distance = 0.5 if "aml_status" in str(where) else 0.2
+            return {
+                "ids": [[f"doc_{distance}"]],
+                "documents": [["doc"]],
+                "metadatas": [[{"risk_score": 1, "total_amount_usd": 10}]],
+                "distances": [[distance]]
+            }
+        collection.query.side_effect = slow_query
+        
+        started = time.perf_counter()
+        result = service.search_all("никель Индонезия", n_results=1)
+        elapsed = time.perf_counter() - started
+        
+        assert result["success"] is True and result["partial"] is False
+        assert embed_calls == [["никель Индонезия"]]
+        assert collection.query.call_count == 3
+        assert elapsed < 0.5  # ~ самый медленный запрос, а не сумма трех
+        assert set(result["by_collection"]) == {"minerals", "deals", "kyc"}
+        assert result["results"][-1]["collection"] == "kyc"  # наибольшая дистанция — в конце
+        assert all(0 < item["score"] <= 1 for item in result["results"])
+    
+    def test_search_all_partial_failure(self, mock_chroma_service):
+        service = mock_chroma_service
+        
+        def failing_for_kyc(query_embeddings, n_results, where):
+            if "aml_status" in str(where):
+                raise RuntimeError("kyc unavailable")
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+        service.kyc_collection.query.side_effect = failing_for_kyc
+        
+        result = service.search_all("медь")
+        assert result["success"] is True
+        assert result["partial"] is True
+        assert result["errors"] == {"kyc": "kyc unavailable"}
+        assert service.search_all("медь", collections=["unknown"])["success"] is False
+
+class TestBulkIngestion:
+    """Тесты массовой загрузки документов"""
+    
+    def test_upsert_documents_chunks_and_reports_failures(self, mock_chroma_service):
+        """Документы пишутся чанками, ошибка одного чанка не прерывает загрузку"""
+        service = mock_chroma_service
+        collection = service.deals_collection
+        calls = []
+        
+        def fake_upsert(ids, documents, metadatas, embeddings):
+            calls.append(ids)
+            assert len(embeddings) == len(documents)
+            if "deal_2" in ids:
+                raise ValueError("write failed")
+        collection.upsert.side_effect = fake_upsert
+        
+        documents = (
+            {"id": f"deal_{i}", "document": f"Сделка {i}", "metadata": {"deal_id": f"OMH-{i}"}}
+            for i in range(5)
+        )
+        result = service.upsert_documents("deals", documents, batch_size=2)
+        
+        assert calls == [["deal_0", "deal_1"], ["deal_2", "deal_3"], ["deal_4"]]
+        assert result["success"] is False
+        assert result["written"] == 3
+        assert result["failed"] == 2
+        assert [c["success"] for c in result["chunks"]] == [True, False, True]
+        assert result["chunks"][1]["error"] == "write failed"
+        assert all(c["elapsed_ms"] >= 0 for c in result["chunks"])
+    
+    def test_chunk_index_failure_counted_once(self, mock_chroma_service):
+        """Ошибка записи чанков: документы чанка считаются только как failed"""
+        service = mock_chroma_service
+        
+        def fake_write_chunks(collection_name, ids, documents, metadatas):
+            if "deal_0" in ids:
+                raise ValueError("chunk index failed")
+            return len(ids)
+        
+        documents = [{"id": f"deal_{i}", "document": f"Сделка {i}", "metadata": {}} for i in range(4)]
+        with patch.object(service, "_write_chunks", side_effect=fake_write_chunks):
+            result = service.upsert_documents("deals", documents, batch_size=2)
+        
+        assert (result["written"], result["failed"], result["total"]) == (2, 2, 4)
+        assert result["document_chunks"] == 2
+        assert result["chunks"][0]["error"] == "chunk index failed"
+    
+    def test_add_documents_unknown_collection(self, mock_chroma_service):
+        """Неизвестная коллекция возвращает ошибку"""
+        result = mock_chroma_service.add_documents("unknown", [])
+        assert result["success"] is False
+        assert "Unknown collection" in result["error"]
+
+class TestIncrementalSync:
+    """Тесты инкрементальной загрузки по manifest"""
+    
+    def test_sync_writes_only_changed_and_deletes_removed(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.minerals_collection
+        stored = {}
+        
+        def fake_upsert(ids, documents, metadatas, embeddings):
+            stored.update(zip(ids, metadatas))
+        
+        def fake_get(where, include, limit=None, offset=0):
+            ids = [i for i, m in stored.items() if m["ingest_source"] == where["ingest_source"]]
+            return {"ids": ids, "metadatas": [stored[i] for i in ids]}
+        
+        def fake_delete(ids):
+            for i in ids:
+                stored.pop(i)
+        
+        collection.upsert.side_effect = fake_upsert
+        collection.get.side_effect = fake_get
+        collection.delete.side_effect = fake_delete
+        
+        def catalog(copper_price=9500, with_gold=True):
+            docs = [
+                {"id": "cu", "document": "Медь", "metadata": {"current_price": copper_price, "loaded_at": "t1"}},
+                {"id": "li", "document": "Литий", "metadata": {"current_price": 15000, "loaded_at": "t1"}}
+            ]
+            if with_gold:
+                docs.append({"id": "au", "document": "Золото", "metadata": {"current_price": 2650}})
+            return docs
+        
+        first = service.sync_documents("minerals", catalog(), source="catalog")
+        assert (first["written"], first["unchanged"], first["deleted"]) == (3, 0, 0)
+        
+        # Повторная загрузка без изменений (loaded_at не влияет на хеш): ни одной записи
+        collection.upsert.reset_mock()
+        unchanged = [dict(d, metadata={**d["metadata"], "loaded_at": "t2"}) for d in catalog()]
+        second = service.sync_documents("minerals", unchanged, source="catalog")
+        assert (second["written"], second["unchanged"], second["deleted"]) == (0, 3, 0)
+        assert collection.upsert.call_count == 0
+        assert collection.get.call_count == 2  # одно чтение метаданных на синхронизацию
+        
+        # Изменена цена меди, золото удалено из источника
+        third = service.sync_documents("minerals", catalog(copper_price=9800, with_gold=False), source="catalog")
+        assert (third["written"], third["unchanged"], third["deleted"]) == (1, 1, 1)
+        assert sorted(stored) == ["cu", "li"]
+        assert stored["cu"]["current_price"] == 9800
+        assert third["success"] is True
+
+class TestPagedScan:
+    """Тесты постраничного обхода коллекций"""
+    
+    def test_iter_documents_pages_and_requested_fields(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.kyc_collection
+        stored = [(f"kyc_{i}", {"aml_status": "clean" if i % 2 else "enhanced_monitoring"}) for i in range(5)]
+        
+        def fake_get(where, limit, offset, include):
+            rows = [(i, m) for i, m in stored if not where or m["aml_status"] == where["aml_status"]]
+            page = rows[offset:offset + limit]
+            return {"ids": [i for i, _ in page], "metadatas": [m for _, m in page], "documents": None}
+        collection.get.side_effect = fake_get
+        
+        items = service.iter_documents("kyc", include=["metadatas"], page_size=2)
+        assert next(items) == {"id": "kyc_0", "metadata": stored[0][1]}
+        assert collection.get.call_count == 1  # генератор читает страницы по мере обхода
+        assert [item["id"] for item in items] == ["kyc_1", "kyc_2", "kyc_3", "kyc_4"]
+        assert [c.kwargs["offset"] for c in collection.get.call_args_list] == [0, 2, 4]
+        assert all(c.kwargs["include"] == ["metadatas"] for c in collection.get.call_args_list)
+        
+        clean = list(service.iter_documents("kyc", where={"aml_status": "clean"}, page_size=2))
+        assert [item["id"] for item in clean] == ["kyc_1", "kyc_3"]
+    
+    def test_iter_documents_rejects_unknown_fields(self, mock_chroma_service):
+        with pytest.raises(ValueError):
+            list(mock_chroma_service.iter_documents("kyc", include=["distances"]))
+
 class TestDataLoader:
     """Тесты загрузчика данных"""
     
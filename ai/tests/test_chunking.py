@@ -0,0 +1,114 @@
+"""
+Тесты чанков документов и поиска с parent-document retrieval
+"""
+
+from unittest.mock import patch
+
+import chromadb
+import pytest
+
+from ai.chroma_service import ChromaService
+from ai.chunking import build_chunks, collapse_to_parents, count_words, split_text
+
+
+def contract(sentences):
+    return " ".join(f"Пункт {i}: поставка концентрата по графику {i}." for i in range(sentences))
+
+
+class TestSplitText:
+    """Окна по предложениям с перекрытием"""
+
+    def test_short_text_is_single_chunk(self):
+        assert split_text("Сделка OMH-001: медь.", max_tokens=80) == ["Сделка OMH-001: медь."]
+        assert split_text("   ") == []
+
+    def test_windows_respect_size_and_overlap(self):
+        text = contract(20)  # 7 слов в предложении
+        chunks = split_text(text, max_tokens=30, overlap_tokens=10)
+
+        assert len(chunks) > 1
+        assert all(count_words(chunk) <= 30 for chunk in chunks)
+        for previous, current in zip(chunks, chunks[1:]):
+            # следующий чанк начинается с последнего предложения предыдущего
+            assert current.startswith(previous.split(". ")[-1].rstrip("."))
+        assert "Пункт 0:" in chunks[0] and "Пункт 19:" in chunks[-1]
+
+    def test_long_sentence_split_by_words(self):
+        sentence = " ".join(f"слово{i}" for i in range(50))
+        chunks = split_text(sentence, max_tokens=20, overlap_tokens=5)
+        assert all(count_words(chunk) <= 20 for chunk in chunks)
+        assert chunks[1].split()[0] == "слово15"
+        assert chunks[-1].endswith("слово49")
+
+
+class TestCollapse:
+    """Свертка чанков к родительским документам"""
+
+    def test_best_chunk_represents_parent(self):
+        chunks = build_chunks("deal_1", contract(20), {"status": "confirmed"}, max_tokens=30, overlap_tokens=10)
+        assert chunks[0]["id"] == "deal_1#0"
+        assert chunks[0]["metadata"] == {"status": "confirmed", "parent_id": "deal_1", "chunk_index": 0, "chunk_count": len(chunks)}
+
+        row = {
+            "ids": ["deal_1#0", "deal_2#0", "deal_1#3"],
+            "documents": ["a", "b", "c"],
+            "metadatas": [{"parent_id": "deal_1", "chunk_index": 0}, {"parent_id": "deal_2", "chunk_index": 0}, {"parent_id": "deal_1", "chunk_index": 3}],
+            "distances": [0.4, 0.3, 0.1]
+        }
+        collapsed = collapse_to_parents(row, n_results=5)
+        assert collapsed["ids"] == ["deal_1", "deal_2"]
+        assert collapsed["documents"] == ["c", "b"]
+        assert collapsed["metadatas"] == [{}, {}]
+        assert collapsed["distances"] == [0.1, 0.3]
+        assert collapse_to_parents(row, n_results=1)["ids"] == ["deal_1"]
+
+
+class TestChunkedSearch:
+    """ChromaService: запись чанков, поиск по чанкам, удаление"""
+
+    @pytest.fixture
+    def service(self):
+        client = chromadb.EphemeralClient()
+        with patch("ai.chroma_service.chromadb.PersistentClient", return_value=client):
+            service = ChromaService(is_test_mode=True)
+        service.embedding_function = lambda texts: [[1.0 if "литий" in t else 0.5 if "меди" in t else 0.0, 0.0, 1.0] for t in texts]
+        yield service
+        for name in [c.name for c in client.list_collections()]:
+            client.delete_collection(name)
+
+    def test_search_over_chunks_returns_parents(self, service):
+        long_contract = contract(20) + " Особое условие: литий поставляется отдельно."
+        documents = [
+            {"id": "deal_long", "document": long_contract, "metadata": {"status": "confirmed"}},
+            {"id": "deal_short", "document": "Сделка по меди.", "metadata": {"status": "confirmed"}}
+        ]
+        with patch("ai.chroma_service.chroma_config.CHUNK_MAX_TOKENS", 30), \
+             patch("ai.chroma_service.chroma_config.CHUNK_OVERLAP_TOKENS", 10), \
+             patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False):
+            report = service.sync_documents("deals", documents, source="contracts")
+            chunk_count = service.chunk_collections["deals"].count()
+            assert report["document_chunks"] == chunk_count > 2
+
+            result = service.search_deals("литий", n_results=2)
+            assert [r["id"] for r in result["results"]] == ["deal_long", "deal_short"]
+            assert "литий" in result["results"][0]["document"]
+            assert len(result["results"][0]["document"]) < len(long_contract)  # чанк, а не весь договор
+            assert "parent_id" not in result["results"][0]["metadata"]
+
+            # Новая версия короче — лишние чанки прежней версии удаляются
+            documents[0]["document"] = "Договор расторгнут."
+            service.sync_documents("deals", documents, source="contracts")
+            assert service.chunk_collections["deals"].count() == 2
+
+            # Документы, удаленные из источника, удаляются вместе с чанками
+            service.sync_documents("deals", documents[1:], source="contracts")
+            assert service.chunk_collections["deals"].get(include=["metadatas"])["metadatas"][0]["parent_id"] == "deal_short"
+            assert service.chunk_collections["deals"].count() == 1
+
+    def test_rebuild_chunks_for_existing_documents(self, service):
+        service.deals_collection.add(ids=["legacy"], documents=[contract(20)], metadatas=[{"status": "executed"}], embeddings=[[0.0, 1.0, 1.0]])
+        with patch("ai.chroma_service.chroma_config.CHUNK_MAX_TOKENS", 30):
+            result = service.rebuild_chunks("deals")
+        assert result["success"] is True
+        assert result["chunks"] == service.chunk_collections["deals"].count() > 1
+        assert service.rebuild_chunks("minerals")["success"] is False
@@ -0,0 +1,93 @@
+"""
+Тесты упаковки контекста RAG в бюджет токенов
+"""
+
+from unittest.mock import patch
+
+from ai.context_builder import ContextBuilder, TokenCounter
+
+
+def text_counter(model_name):
+    """Детерминированный подсчет без tiktoken: ~3 символа на токен"""
+    counter = TokenCounter.__new__(TokenCounter)
+    counter.model_name = model_name
+    counter._encoding = None
+    return counter
+
+
+class TestContextBuilder:
+    """Бюджет из окна контекста модели, дедупликация, обрезка по предложениям"""
+
+    def _builder(self, **kwargs):
+        with patch("ai.context_builder.TokenCounter", text_counter):
+            return ContextBuilder("gpt-4-turbo-preview", **kwargs)
+
+    def test_budget_bounded_by_model_context_window(self):
+        with patch("ai.context_builder.TokenCounter", text_counter):
+            small = ContextBuilder("small", context_window=2048, max_context_tokens=3000, response_reserve_tokens=1024)
+            default = ContextBuilder("unknown-model", max_context_tokens=3000)
+        assert small.budget == 1024
+        assert default.budget == 3000  # окно по умолчанию 8192
+        assert self._builder(context_window=128000, max_context_tokens=3000).budget == 3000
+
+    def test_near_duplicates_dropped(self):
+        builder = self._builder()
+        results = [
+            {"id": "a", "document": "Медь (Cu) торгуется на LME по 9500 USD за тонну."},
+            {"id": "b", "document": "Медь (Cu) торгуется на LME по 9500 USD за тонну!"},
+            {"id": "c", "document": "Никель (Ni) торгуется по 18000 USD."}
+        ]
+
+        packed = builder.build("цена меди", results)
+        assert [r["id"] for r in packed["results"]] == ["a", "c"]
+        assert packed["duplicates"] == 1
+
+    def test_long_document_trimmed_to_relevant_sentences(self):
+        builder = self._builder(doc_max_tokens=30)
+        filler = " ".join(f"Предложение о логистике номер {i}." for i in range(10))
+        document = f"Литий (Li) — металл батарей. {filler} Цена лития упала на 20%."
+
+        packed = builder.build("цена лития", [{"id": "li", "document": document}])
+        assert packed["trimmed"] == 1
+        assert packed["context"] == "Литий (Li) — металл батарей. Цена лития упала на 20%."
+        assert packed["tokens"] <= 30
+
+    def test_packs_until_budget_exhausted(self):
+        builder = self._builder(max_context_tokens=100, doc_max_tokens=100)
+        results = [{"id": f"d{i}", "document": f"Сделка {i}: " + "поставка концентрата " * 4} for i in range(10)]
+
+        packed = builder.build("сделка", results)
+        assert 0 < len(packed["results"]) < 10
+        assert packed["tokens"] <= packed["budget"] == 100
+        assert packed["over_budget"] == 10 - len(packed["results"])
+
+    def test_encoding_loaded_on_first_count(self):
+        with patch("ai.context_builder._encoding", return_value=None) as load:
+            counter = TokenCounter("gpt-4-turbo-preview")
+            assert load.call_count == 0  # не при создании сервиса
+            assert counter.count("медь" * 3) == 4  # без tiktoken — оценка по длине
+            counter.count("никель")
+        assert load.call_count == 1
+        assert counter.exact is False
+
+
+class TestRagQueryContext:
+    """ChromaService.rag_query: over-fetch и упаковка контекста"""
+
+    def test_overfetches_and_reports_packed_sources(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.minerals_collection.query.return_value = {
+            "ids": [["cu", "cu_copy", "ni"]],
+            "documents": [["Медь (Cu) 9500 USD.", "Медь (Cu) 9500 USD.", "Никель (Ni) 18000 USD."]],
+            "metadatas": [[{"commodity": "copper"}, {"commodity": "copper"}, {"commodity": "nickel"}]],
+            "distances": [[0.1, 0.1, 0.2]]
+        }
+
+        with patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False), \
+             patch("ai.chroma_service.chroma_config.RAG_CACHE_ENABLED", False):
+            result = service.rag_query("цена меди", n_results=2)
+
+        assert service.minerals_collection.query.call_args.kwargs["n_results"] == 8  # 2 × RAG_CONTEXT_OVERFETCH
+        assert result["sources"] == [{"commodity": "copper"}, {"commodity": "nickel"}]
+        assert result["context"]["duplicates"] == 1
+        assert result["context"]["documents"] == 2
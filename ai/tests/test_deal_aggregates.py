@@ -0,0 +1,99 @@
+"""
+Тесты материализованных агрегатов сделок
+"""
+
+from unittest.mock import patch
+
+from ai.deal_aggregates import DealAggregates
+
+
+def _deal(amount, status="confirmed", commodity="copper", region="South_America"):
+    return {"total_amount_usd": amount, "status": status, "commodity": commodity, "region": region}
+
+
+class TestDealAggregates:
+    """Инкрементальное обновление агрегатов"""
+
+    def test_apply_upsert_and_remove(self):
+        aggregates = DealAggregates()
+        aggregates.apply(["a", "b"], [_deal(100), _deal(50, status="open", commodity="gold", region="Global")])
+        snapshot = aggregates.snapshot()
+        assert (snapshot["count"], snapshot["total_value_usd"], snapshot["confirmed"]) == (2, 150, 1)
+        assert snapshot["by_commodity"]["gold"] == {"count": 1, "value_usd": 50}
+
+        # upsert заменяет вклад сделки, а не добавляет его повторно
+        aggregates.apply(["a"], [_deal(300, status="executed")])
+        snapshot = aggregates.snapshot()
+        assert (snapshot["count"], snapshot["total_value_usd"], snapshot["confirmed"]) == (2, 350, 0)
+        assert "confirmed" not in snapshot["by_status"]
+
+        aggregates.remove(["b", "missing"])
+        snapshot = aggregates.snapshot()
+        assert snapshot["count"] == 1
+        assert snapshot["avg_value_usd"] == 300
+        assert set(snapshot["by_region"]) == {"South_America"}
+
+
+class TestCollectionStats:
+    """get_collection_stats без полного чтения коллекции"""
+
+    def test_stats_use_aggregates_after_first_build(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.deals_collection
+        collection.get.return_value = {"ids": ["a"], "metadatas": [_deal(100)]}
+        collection.count.return_value = 1
+
+        first = service.get_collection_stats()
+        assert first["data"]["deals_value_usd"] == 100
+        assert collection.get.call_count == 1  # ленивое построение постраничным чтением
+
+        service.upsert_documents("deals", [{"id": "b", "document": "Сделка", "metadata": _deal(50, status="open")}])
+        collection.count.return_value = 2
+        second = service.get_collection_stats()
+        assert collection.get.call_count == 1  # запись обновила агрегаты без повторного чтения
+        assert second["data"]["deals_value_usd"] == 150
+        assert second["data"]["confirmed_deals"] == 1
+        assert second["data"]["deals_by_status"]["open"]["count"] == 1
+
+    def test_chunk_counts_cached_until_write(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.deals_collection.count.return_value = 0
+        chunks = next(iter(service.chunk_collections.values()))
+
+        service.get_collection_stats()
+        counted = chunks.count.call_count
+        assert counted > 0
+        service.get_collection_stats()
+        assert chunks.count.call_count == counted  # счетчики из кеша
+
+        service.upsert_documents("minerals", [{"id": "cu", "document": "Медь", "metadata": {}}])
+        service.get_collection_stats()
+        assert chunks.count.call_count == 2 * counted  # запись сбросила кеш
+
+    def test_aggregates_refreshed_after_ttl_with_same_count(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.deals_collection
+        collection.get.return_value = {"ids": ["a"], "metadatas": [_deal(100)]}
+        collection.count.return_value = 1
+        assert service.get_collection_stats()["data"]["deals_value_usd"] == 100
+
+        # upsert другого процесса: число сделок то же, сумма другая
+        collection.get.return_value = {"ids": ["a"], "metadatas": [_deal(250)]}
+        assert service.get_collection_stats()["data"]["deals_value_usd"] == 100
+        with patch("ai.chroma_service.chroma_config.STATS_REFRESH_SECONDS", 0):
+            assert service.get_collection_stats()["data"]["deals_value_usd"] == 250
+
+    def test_rebuild_scans_outside_lock_and_replays_writes(self, mock_chroma_service):
+        service = mock_chroma_service
+
+        def scan_with_concurrent_write(collection_name, include, where=None, page_size=None):
+            yield {"ids": ["a"], "metadatas": [_deal(100)]}
+            # Запись во время чтения: блокировка агрегатов не удерживается
+            service.upsert_documents("deals", [{"id": "b", "document": "Сделка", "metadata": _deal(50, status="open")}])
+
+        with patch.object(service, "_scan_pages", side_effect=scan_with_concurrent_write):
+            aggregates = service._deals_aggregates()
+        snapshot = aggregates.snapshot()
+        assert snapshot["count"] == 2
+        assert snapshot["total_value_usd"] == 150
+        assert service.deal_aggregates is aggregates
@@ -0,0 +1,107 @@
+"""
+Тесты колоночной аналитики сделок
+"""
+
+import pytest
+
+from ai.deal_analytics import DealAnalytics
+
+
+def _deal(amount, tons, price=None, commodity="copper", region="South_America", status="confirmed", date="2025-01-15"):
+    metadata = {
+        "total_amount_usd": amount,
+        "quantity_tons": tons,
+        "commodity": commodity,
+        "region": region,
+        "status": status,
+        "date": date
+    }
+    if price is not None:
+        metadata["price_usd_per_ton"] = price
+    return metadata
+
+
+class TestDealAnalytics:
+    """Group-by по колонкам и инкрементальные обновления"""
+
+    def test_group_by_commodity_region_month(self):
+        analytics = DealAnalytics(capacity=1)  # емкость растет при добавлении
+        analytics.apply(
+            ["a", "b", "c"],
+            [
+                _deal(100, 10, price=10),
+                _deal(300, 10, price=30, date="2025-01-20"),
+                _deal(50, 5, commodity="gold", region="Global", status="open", date="2025-02-01")
+            ]
+        )
+
+        groups = analytics.group_by(("commodity", "region", "month"))
+        assert [(g["commodity"], g["month"], g["count"]) for g in groups] == [("copper", "2025-01", 2), ("gold", "2025-02", 1)]
+        copper = groups[0]
+        assert (copper["volume_tons"], copper["value_usd"]) == (20.0, 400.0)
+        assert copper["avg_price_usd_per_ton"] == 20.0
+        assert copper["value_per_ton_usd"] == 20.0
+        assert groups[1]["avg_price_usd_per_ton"] is None  # цена не указана
+
+        totals = analytics.group_by(())
+        assert totals == [{"count": 3, "volume_tons": 25.0, "value_usd": 450.0, "avg_price_usd_per_ton": 20.0, "value_per_ton_usd": 18.0}]
+
+    def test_filters_and_date_range(self):
+        analytics = DealAnalytics()
+        analytics.apply(
+            ["a", "b", "c"],
+            [_deal(100, 10), _deal(200, 10, date="2025-03-01"), _deal(400, 10, commodity="gold", date="2025-03-10")]
+        )
+
+        assert [g["value_usd"] for g in analytics.group_by(("month",), date_from="2025-02", date_to="2025-03-31")] == [600.0]
+        # Границы периода — с точностью до дня по колонке date_ts
+        assert [g["value_usd"] for g in analytics.group_by(("month",), date_from="2025-03-02", date_to="2025-03-10")] == [400.0]
+        assert [g["value_usd"] for g in analytics.group_by(("month",), date_from="2025-01-16", date_to="2025-03-01")] == [200.0]
+        assert analytics.group_by(("month",), date_to="2025-01-14") == []
+        with pytest.raises(ValueError):
+            analytics.group_by(("month",), date_from="15.01.2025")
+        assert [g["commodity"] for g in analytics.group_by(("commodity",), {"commodity": "copper"})] == ["copper"]
+        assert analytics.group_by(("commodity",), {"region": "Nowhere"}) == []
+        with pytest.raises(ValueError):
+            analytics.group_by(("counterparty",))
+
+    def test_upsert_remove_and_status_mix(self):
+        analytics = DealAnalytics()
+        analytics.apply(["a", "b"], [_deal(100, 10), _deal(300, 10, status="open")])
+
+        # upsert перезаписывает строку сделки, delete освобождает ее для следующей
+        analytics.apply(["a"], [_deal(100, 10, status="executed")])
+        analytics.remove(["b", "missing"])
+        analytics.apply(["c"], [_deal(100, 10, status="executed")])
+        assert len(analytics) == 2
+
+        mix = analytics.status_mix()
+        assert set(mix) == {"executed"}
+        assert mix["executed"]["count"] == 2
+        assert mix["executed"]["value_share"] == 1.0
+
+
+class TestDealAnalyticsService:
+    """get_deal_analytics строит колонки вместе с агрегатами и обновляет их при записи"""
+
+    def test_columns_built_once_and_updated_on_write(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.deals_collection
+        collection.get.return_value = {"ids": ["a"], "metadatas": [_deal(100, 10)]}
+        collection.count.return_value = 1
+
+        first = service.get_deal_analytics(("commodity",))
+        assert first["success"]
+        assert first["groups"][0]["value_usd"] == 100.0
+        assert collection.get.call_count == 1
+
+        service.upsert_documents("deals", [{"id": "b", "document": "Сделка", "metadata": _deal(50, 5, status="open")}])
+        collection.count.return_value = 2
+        second = service.get_deal_analytics(("commodity",))
+        assert collection.get.call_count == 1  # запись обновила колонки без повторного чтения
+        assert second["totals"]["value_usd"] == 150.0
+        assert second["status_mix"]["open"]["count"] == 1
+
+        stats = service.get_collection_stats()["data"]
+        assert collection.get.call_count == 1  # агрегаты статистики — та же структура
+        assert stats["deals_value_usd"] == 150.0
@@ -0,0 +1,80 @@
+"""
+Тесты дискового кеша эмбеддингов
+"""
+
+import numpy as np
+
+from ai.embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+
+
+class CountingEmbeddingFunction:
+    """Embedding функция, считающая тексты, переданные в модель"""
+
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(t)), 1.0, 0.5] for t in texts]
+
+
+class TestEmbeddingCache:
+    """Unit тесты EmbeddingCache"""
+
+    def test_roundtrip_survives_reopen(self, tmp_path):
+        """Векторы читаются из memmap после пересоздания кеша"""
+        cache = EmbeddingCache(str(tmp_path), model_name="test-model")
+        cache.put_many(["медь", "литий"], [[1.0, 2.0], [3.0, 4.0]])
+
+        reopened = EmbeddingCache(str(tmp_path), model_name="test-model")
+        copper, lithium, missing = reopened.get_many(["медь", "литий", "золото"])
+        assert np.allclose(copper, [1.0, 2.0])
+        assert np.allclose(lithium, [3.0, 4.0])
+        assert missing is None
+        assert reopened.stats()["entries"] == 2
+
+    def test_key_includes_model_name(self, tmp_path):
+        """Один и тот же текст для разных моделей — разные ключи"""
+        first = EmbeddingCache(str(tmp_path), model_name="model-a")
+        second = EmbeddingCache(str(tmp_path), model_name="model-b")
+        assert first.key("медь") != second.key("медь")
+        first.put_many(["медь"], [[1.0, 2.0]])
+        assert second.get_many(["медь"]) == [None]
+
+    def test_sees_rows_written_by_other_instance(self, tmp_path):
+        """Строки, дописанные другим экземпляром (процессом), подхватываются при промахе"""
+        reader = EmbeddingCache(str(tmp_path), model_name="test-model")
+        writer = EmbeddingCache(str(tmp_path), model_name="test-model")
+        writer.put_many(["никель"], [[5.0, 6.0]])
+        assert np.allclose(reader.get_many(["никель"])[0], [5.0, 6.0])
+
+
+class TestCachedEmbeddingFunction:
+    """Неизменные тексты не доходят до embedding функции"""
+
+    def test_only_misses_are_embedded(self, tmp_path):
+        inner = CountingEmbeddingFunction()
+        function = CachedEmbeddingFunction(inner, EmbeddingCache(str(tmp_path), model_name="test-model"))
+
+        first = function(["медь", "литий", "медь"])
+        assert inner.embedded == ["медь", "литий"]
+
+        second = function(["литий", "золото"])
+        assert inner.embedded == ["медь", "литий", "золото"]
+        assert np.allclose(first[1], second[0])
+        assert len(first) == 3 and np.allclose(first[0], first[2])
+
+    def test_queries_stay_in_memory(self, tmp_path):
+        """Запросы читают дисковый кеш, но не дописывают его; LRU ограничен query_cache_size"""
+        inner = CountingEmbeddingFunction()
+        cache = EmbeddingCache(str(tmp_path), model_name="test-model")
+        function = CachedEmbeddingFunction(inner, cache, query_cache_size=2)
+
+        function(["медь"])  # ингест документа
+        function.embed_queries(["медь", "литий", "литий"])
+        assert inner.embedded == ["медь", "литий"]  # медь — с диска, литий — один раз
+        assert cache.stats()["entries"] == 1
+
+        function.embed_queries(["золото", "никель"])
+        function.embed_queries(["литий"])  # вытеснен из LRU
+        assert inner.embedded == ["медь", "литий", "золото", "никель", "литий"]
@@ -0,0 +1,98 @@
+"""
+Тесты embedding провайдеров
+"""
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from ai.chroma_service import ChromaService
+from ai.embeddings import LocalEmbeddingFunction, build_embedding_function
+
+
+def fake_encoder_factory(calls):
+    def create(backend, model_name, num_threads):
+        def encode(batch):
+            calls.append(list(batch))
+            return np.array([[len(t), 1.0] for t in batch], dtype=np.float32)
+        return encode
+    return create
+
+
+class TestLocalEmbeddingFunction:
+    """Micro-batching локальной CPU модели"""
+
+    def test_texts_split_into_micro_batches_in_order(self):
+        calls = []
+        with patch("ai.embeddings._create_encoder", side_effect=fake_encoder_factory(calls)):
+            function = LocalEmbeddingFunction(backend="onnx", batch_size=2)
+            vectors = function(["a", "bb", "ccc", "dddd", "eeeee"])
+
+        assert calls == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+        assert [int(v[0]) for v in vectors] == [1, 2, 3, 4, 5]
+        assert all(v.dtype == np.float32 for v in vectors)
+
+    def test_model_loaded_once(self):
+        with patch("ai.embeddings._create_encoder", side_effect=fake_encoder_factory([])) as create:
+            function = LocalEmbeddingFunction(backend="onnx", num_threads=2)
+            function(["a"])
+            function(["b"])
+        create.assert_called_once_with("onnx", "all-MiniLM-L6-v2", 2)
+        assert function.model_id == "onnx/all-MiniLM-L6-v2"
+
+
+class TestBuildEmbeddingFunction:
+    """Выбор провайдера по get_embedding_config()"""
+
+    def test_local_provider(self):
+        function, model_id = build_embedding_function({
+            "provider": "sentence_transformers", "model": "all-MiniLM-L6-v2",
+            "backend": "onnx", "batch_size": 16, "num_threads": 1, "num_workers": 0
+        })
+        assert isinstance(function, LocalEmbeddingFunction)
+        assert function.batch_size == 16
+        assert model_id == "onnx/all-MiniLM-L6-v2"
+
+    def test_openai_without_key_falls_back_to_local(self):
+        function, model_id = build_embedding_function({
+            "provider": "openai", "model": "text-embedding-3-small", "api_key": "", "backend": "onnx"
+        })
+        assert isinstance(function, LocalEmbeddingFunction)
+        assert model_id == "onnx/all-MiniLM-L6-v2"
+
+    def test_openai_with_key(self):
+        function, model_id = build_embedding_function({
+            "provider": "openai", "model": "text-embedding-3-small", "api_key": "sk-test"
+        })
+        assert not isinstance(function, LocalEmbeddingFunction)
+        assert model_id == "openai/text-embedding-3-small"
+
+
+class TestEmbeddingModelGuard:
+    """Модель коллекций в метаданных и в хеше содержимого"""
+
+    def test_mismatched_model_refuses_to_start(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.embedding_model_id = "openai/text-embedding-3-small"
+        service.deals_collection.metadata = {"embedding_model": "onnx/all-MiniLM-L6-v2"}
+
+        with patch("ai.chroma_service.chroma_config.EMBEDDING_MODEL_MISMATCH", "error"):
+            with pytest.raises(RuntimeError, match="EMBEDDING_MODEL_MISMATCH=reindex"):
+                service._ensure_embedding_model()
+
+    def test_legacy_collection_tagged_with_default_model(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.embedding_model_id = "sentence_transformers/all-MiniLM-L6-v2"
+        collection = service.deals_collection
+        collection.metadata = {"description": "Сделки", "hnsw:space": "l2"}
+        collection.count.return_value = 5
+
+        service._ensure_embedding_model()  # векторы той же модели — без ошибки
+        metadata = collection.modify.call_args.kwargs["metadata"]
+        assert metadata == {"description": "Сделки", "embedding_model": "onnx/all-MiniLM-L6-v2"}
+
+    def test_content_hash_includes_model(self):
+        first = ChromaService.content_hash("Медь", {"commodity": "copper"}, "onnx/all-MiniLM-L6-v2")
+        second = ChromaService.content_hash("Медь", {"commodity": "copper"}, "openai/text-embedding-3-small")
+        assert first != second
@@ -0,0 +1,88 @@
+"""
+Тесты фильтров сделок: компиляция DealFilter в where-клаузы Chroma
+"""
+
+import pytest
+from pydantic import ValidationError
+
+from ai.filters import DealFilter, matches_where, to_epoch, with_epoch_dates
+
+
+class TestDealFilter:
+    """DealFilter → $and/$gte/$lte"""
+
+    def test_empty_and_single_condition(self):
+        assert DealFilter().to_where() == {}
+        assert DealFilter(region="Asia").to_where() == {"region": "Asia"}
+
+    def test_ranges_compile_to_and_clause(self):
+        where = DealFilter(
+            commodity="copper",
+            counterparty="Glencore International AG",
+            min_amount_usd=1_000_000,
+            max_amount_usd=5_000_000,
+            date_from="2025-01-01",
+            date_to="2025-01-31"
+        ).to_where(environment="test")
+
+        assert where == {"$and": [
+            {"commodity": "copper"},
+            {"counterparty": "Glencore International AG"},
+            {"total_amount_usd": {"$gte": 1_000_000}},
+            {"total_amount_usd": {"$lte": 5_000_000}},
+            {"date_ts": {"$gte": to_epoch("2025-01-01")}},
+            {"date_ts": {"$lte": to_epoch("2025-02-01") - 1}},  # date_to включает весь день
+            {"environment": "test"}
+        ]}
+
+        deal = with_epoch_dates({
+            "commodity": "copper",
+            "counterparty": "Glencore International AG",
+            "total_amount_usd": 4_750_000,
+            "date": "2025-01-31",
+            "environment": "test"
+        })
+        assert matches_where(deal, where)
+        assert not matches_where({**deal, "total_amount_usd": 9_800_000}, where)
+        assert not matches_where(with_epoch_dates({**deal, "date": "2025-02-01"}), where)
+
+    def test_dates(self):
+        assert to_epoch("2025-01-15") == 1736899200
+        assert to_epoch("2025-01-15T00:00:00Z") == 1736899200
+        assert to_epoch(None) is None
+        assert with_epoch_dates({"date": "не дата"}) == {"date": "не дата"}
+        with pytest.raises(ValidationError):
+            DealFilter(date_from="15.01.2025")
+
+
+class TestDealSearchPushdown:
+    """Фильтры сделок уходят в Chroma, даты хранятся как epoch"""
+
+    def test_where_passed_to_chroma_and_date_ts_ingested(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.deals_collection
+
+        service.upsert_documents("deals", [{"id": "d1", "document": "Сделка", "metadata": {"date": "2025-01-15"}}])
+        written = collection.upsert.call_args.kwargs["metadatas"][0]
+        assert written["date_ts"] == to_epoch("2025-01-15")
+
+        result = service.search_deals(
+            "медь",
+            region_filter="Asia",
+            deal_filter=DealFilter(min_amount_usd=100, date_to="2025-03-31")
+        )
+        assert result["success"]
+        assert result["filters"]["region"] == "Asia"
+        where = collection.query.call_args.kwargs["where"]
+        assert {"region": "Asia"} in where["$and"]
+        assert {"total_amount_usd": {"$gte": 100}} in where["$and"]
+        assert {"environment": "test"} in where["$and"]
+
+    def test_kyc_and_minerals_where_use_single_top_level_key(self, mock_chroma_service):
+        service = mock_chroma_service
+
+        assert service._kyc_where("clean") == {"$and": [{"aml_status": "clean"}, {"environment": "test"}]}
+        assert service._minerals_where({"type": "base_metal"}) == {"$and": [{"type": "base_metal"}, {"environment": "test"}]}
+        service.is_test_mode = False
+        assert service._kyc_where("clean") == {"aml_status": "clean"}
+        assert service._minerals_where() == {}
@@ -0,0 +1,99 @@
+"""
+Тесты таймингов поиска и RAG по стадиям
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ai.instrumentation import Instrumentation, LatencyHistogram, LogExporter, build_exporters, propagate, stage
+
+
+class _Collector:
+    """Экспортер, сохраняющий тайминги операций"""
+
+    def __init__(self):
+        self.exported = []
+
+    def export(self, timings):
+        self.exported.append(timings.as_dict())
+
+
+class TestInstrumentation:
+    """Стадии, вложенные операции и гистограммы"""
+
+    def test_stages_accumulate_and_nested_operations_merge(self):
+        collector = _Collector()
+        instrumentation = Instrumentation([collector])
+
+        with stage("embedding"):
+            pass  # без активной операции — no-op
+
+        with instrumentation.measure("rag_query") as outer:
+            with stage("embedding"):
+                time.sleep(0.005)
+            with instrumentation.measure("search_minerals"):
+                with stage("vector_query"):
+                    time.sleep(0.005)
+                with stage("vector_query"):
+                    pass
+            with stage("llm"):
+                pass
+
+        assert [e["operation"] for e in collector.exported] == ["search_minerals", "rag_query"]
+        assert set(outer.stages) == {"embedding", "vector_query", "llm"}
+        assert outer.stages["vector_query"] >= 5
+        assert outer.total_ms >= outer.stages["embedding"] + outer.stages["vector_query"]
+
+        snapshot = instrumentation.snapshot()
+        assert snapshot["search_minerals"]["vector_query"]["count"] == 1  # повторная стадия — одна запись
+        assert snapshot["rag_query"]["total"]["count"] == 1
+
+    def test_stages_from_fanout_threads(self):
+        instrumentation = Instrumentation()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with instrumentation.measure("search_all") as timings:
+                def leg():
+                    with stage("vector_query"):
+                        time.sleep(0.002)
+                futures = [executor.submit(propagate(leg)) for _ in range(3)]
+                for future in futures:
+                    future.result()
+        assert timings.stages["vector_query"] >= 6
+
+    def test_histogram_quantiles(self):
+        histogram = LatencyHistogram(buckets=(10, 100))
+        assert histogram.quantile(0.5) is None
+        for elapsed in (1, 2, 3, 50, 500):
+            histogram.observe(elapsed)
+        snapshot = histogram.snapshot()
+        assert snapshot["count"] == 5
+        assert snapshot["p50_ms"] == 10.0
+        assert snapshot["p99_ms"] == 500  # последний бакет — максимум
+        assert snapshot["avg_ms"] == 111.2
+
+    def test_build_exporters(self):
+        exporters = build_exporters("log, unknown")
+        assert [type(e) for e in exporters] == [LogExporter]
+        assert build_exporters("") == []
+
+
+class TestServiceTimings:
+    """processing_time_ms и тайминги стадий в ответах ChromaService"""
+
+    def test_search_reports_stages_in_debug_mode(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.instrumentation = Instrumentation()
+
+        result = service.search_minerals("медь")
+        assert result["success"]
+        assert result["processing_time_ms"] >= 0
+        assert "timings" not in result
+
+        service.instrumentation.include_timings = True
+        result = service.search_minerals("литий")
+        assert result["timings"]["operation"] == "search_minerals"
+        assert {"embedding", "vector_query", "postprocess"} <= set(result["timings"]["stages"])
+
+        rag = service.rag_query("медь")
+        assert {"prompt_build", "llm", "vector_query"} <= set(rag["timings"]["stages"])
+        assert service.get_collection_stats()["data"]["latency"]["rag_query"]["total"]["count"] == 1
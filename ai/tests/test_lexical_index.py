@@ -0,0 +1,193 @@
+"""
+Тесты лексического индекса и гибридного поиска
+"""
+
+import time
+from unittest.mock import patch
+
+from ai.filters import matches_where
+from ai.lexical_index import LexicalIndex, identifier_tokens, is_identifier_query, reciprocal_rank_fusion
+
+
+DEALS = [
+    ("deal_omh_001", "Сделка OMH-001: продажа меди Glencore (LEI: 213800E2AWGCG8J3CS80)",
+     {"deal_id": "OMH-001", "status": "confirmed", "environment": "test"}),
+    ("deal_omh_004", "Сделка OMH-004: закупка никеля у PT Vale Indonesia",
+     {"deal_id": "OMH-004", "status": "conditional", "environment": "test"}),
+    ("deal_omh_005", "Сделка OMH-005: хеджирование золота на COMEX",
+     {"deal_id": "OMH-005", "status": "open", "environment": "test"}),
+]
+
+
+def _wait_for_index(service, collection_name="deals", previous=None):
+    """Запуск фонового построения лексического индекса и ожидание нового индекса"""
+    service._lexical_index(collection_name)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        index = service.lexical_indexes.get(collection_name)
+        if index is not None and index is not previous:
+            return index
+        time.sleep(0.01)
+    raise AssertionError(f"лексический индекс '{collection_name}' не построен")
+
+
+def _index():
+    index = LexicalIndex()
+    for doc_id, document, metadata in DEALS:
+        index.add(doc_id, document, metadata)
+    return index
+
+
+class TestLexicalIndex:
+    """BM25 и точный поиск идентификаторов"""
+
+    def test_identifier_tokens(self):
+        assert identifier_tokens("сделка OMH-004, LEI 213800E2AWGCG8J3CS80 и Ni") == ["OMH-004", "213800E2AWGCG8J3CS80"]
+        assert identifier_tokens("сделка omh-004 и Ni", symbols={"NI"}) == ["omh-004", "Ni"]
+        assert is_identifier_query("OMH-004")
+        assert not is_identifier_query("никель OMH-004")
+
+    def test_words_are_not_identifiers(self):
+        assert identifier_tokens("long-term co-op e-mail COVID It Я Ok") == []
+        assert not is_identifier_query("long-term")
+        assert not is_identifier_query("It")
+        assert not is_identifier_query("OMH-4A")
+
+    def test_symbols_come_from_metadata(self):
+        index = _index()
+        index.add("price_ni", "Никель LME", {"symbol": "Ni"})
+        assert index.lookup("Ni") == ["price_ni"]
+        assert index.is_identifier_query("NI")
+        assert not index.is_identifier_query("Cu")
+        # Короткие слова текста документа символами не становятся
+        index.add("note", "It Ok Cu", {})
+        assert index.lookup("Cu") == []
+        index.remove(["price_ni"])
+        assert not index.is_identifier_query("Ni")
+
+    def test_exact_lookup_by_deal_id_and_lei(self):
+        index = _index()
+        assert index.lookup("omh-004") == ["deal_omh_004"]
+        assert index.lookup("213800E2AWGCG8J3CS80") == ["deal_omh_001"]
+        assert index.lookup("OMH-004", where={"status": "confirmed"}) == []
+
+    def test_bm25_ranks_matching_terms(self):
+        index = _index()
+        ranked = index.search("закупка никеля", limit=3)
+        assert ranked[0][0] == "deal_omh_004"
+        assert index.search("никеля", where={"status": "open"}) == []
+
+    def test_replace_and_remove(self):
+        index = _index()
+        index.add("deal_omh_004", "Сделка OMH-004: отменена", {"deal_id": "OMH-004"})
+        assert index.search("никеля") == []
+        index.remove(["deal_omh_004"])
+        assert index.lookup("OMH-004") == []
+        assert len(index) == 2
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b"]])
+        assert fused[0] == "b"
+        assert set(fused) == {"a", "b", "c"}
+
+    def test_matches_where_operators(self):
+        meta = {"status": "open", "total_amount_usd": 100}
+        assert matches_where(meta, {"$and": [{"status": {"$in": ["open", "confirmed"]}}, {"total_amount_usd": {"$gte": 50}}]})
+        assert not matches_where(meta, {"$or": [{"status": "closed"}, {"total_amount_usd": {"$lt": 50}}]})
+
+
+class TestHybridSearch:
+    """Гибридный поиск в ChromaService"""
+
+    def _service(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.deals_collection
+        self.stored = list(DEALS)  # содержимое Chroma, включая записи других процессов
+
+        def get(ids=None, **kwargs):
+            rows = [d for d in self.stored if ids is None or d[0] in ids]
+            return {"ids": [d[0] for d in rows], "documents": [d[1] for d in rows], "metadatas": [d[2] for d in rows]}
+        collection.get.side_effect = get
+        collection.query.return_value = {
+            "ids": [["deal_omh_005", "deal_omh_001"]],
+            "documents": [[DEALS[2][1], DEALS[0][1]]],
+            "metadatas": [[DEALS[2][2], DEALS[0][2]]],
+            "distances": [[0.3, 0.4]]
+        }
+        return service, collection
+
+    def test_first_search_does_not_wait_for_index(self, mock_chroma_service):
+        service, collection = self._service(mock_chroma_service)
+        result = service.search_deals("OMH-004")
+        # Индекс строится в фоне, запрос отвечен векторным поиском
+        assert collection.query.call_count == 1
+        assert result["success"]
+        _wait_for_index(service)
+        result = service.search_deals("omh-004")
+        assert collection.query.call_count == 1
+        assert result["results"][0]["metadata"]["deal_id"] == "OMH-004"
+
+    def test_writes_during_build_are_replayed(self, mock_chroma_service):
+        service, collection = self._service(mock_chroma_service)
+        scan = collection.get.side_effect
+
+        def get_with_concurrent_write(**kwargs):
+            page = scan(**kwargs)
+            if kwargs.get("ids") is None:
+                service._on_documents_written("deals", ["deal_omh_011"], ["Сделка OMH-011: кобальт"], [{"deal_id": "OMH-011"}])
+                service._on_documents_deleted("deals", ["deal_omh_001"])
+            return page
+        collection.get.side_effect = get_with_concurrent_write
+
+        index = _wait_for_index(service)
+        assert index.lookup("OMH-011") == ["deal_omh_011"]
+        assert index.lookup("OMH-001") == []
+
+    def test_identifier_query_skips_vector_search(self, mock_chroma_service):
+        service, collection = self._service(mock_chroma_service)
+        _wait_for_index(service)
+        result = service.search_deals("OMH-004")
+        assert collection.query.call_count == 0
+        assert result["results_count"] == 1
+        assert result["results"][0]["metadata"]["deal_id"] == "OMH-004"
+        assert result["results"][0]["relevance_score"] == 1.0
+
+    def test_lexical_and_vector_candidates_fused(self, mock_chroma_service):
+        service, collection = self._service(mock_chroma_service)
+        _wait_for_index(service)
+        result = service.search_deals("закупка никеля", n_results=3)
+        assert collection.query.call_count == 1
+        deal_ids = [r["metadata"]["deal_id"] for r in result["results"]]
+        assert set(deal_ids) == {"OMH-001", "OMH-004", "OMH-005"}
+        # OMH-004 найден только BM25 и получает худшую векторную дистанцию
+        lexical_only = next(r for r in result["results"] if r["metadata"]["deal_id"] == "OMH-004")
+        assert lexical_only["distance"] == 0.4
+
+    def test_index_follows_add_document(self, mock_chroma_service):
+        service, _ = self._service(mock_chroma_service)
+        _wait_for_index(service)
+        service.add_document("deals", "Сделка OMH-009: медь", {"deal_id": "OMH-009"}, id="deal_omh_009")
+        self.stored.append(("deal_omh_009", "Сделка OMH-009: медь", {"deal_id": "OMH-009", "environment": "test"}))
+        result = service.search_deals("OMH-009", status_filter=None)
+        assert [r["metadata"]["deal_id"] for r in result["results"]] == ["OMH-009"]
+
+    def test_exact_hit_deleted_elsewhere_falls_back_to_vector_search(self, mock_chroma_service):
+        service, collection = self._service(mock_chroma_service)
+        _wait_for_index(service)
+        self.stored = [d for d in self.stored if d[0] != "deal_omh_004"]  # удаление другим процессом
+
+        result = service.search_deals("OMH-004")
+        assert collection.query.call_count == 1
+        assert "OMH-004" not in [r["metadata"]["deal_id"] for r in result["results"]]
+        assert service.lexical_indexes["deals"].lookup("OMH-004") == []
+
+    def test_index_rebuilt_after_ttl(self, mock_chroma_service):
+        service, _ = self._service(mock_chroma_service)
+        previous = _wait_for_index(service)
+        self.stored.append(("deal_omh_010", "Сделка OMH-010: литий", {"deal_id": "OMH-010", "environment": "test"}))
+
+        with patch("ai.chroma_service.chroma_config.LEXICAL_INDEX_TTL_SECONDS", 0):
+            # Пока идет перестроение, отдается прежний индекс
+            assert service._lexical_index("deals") is previous
+            fresh = _wait_for_index(service, previous=previous)
+        assert fresh.lookup("OMH-010") == ["deal_omh_010"]
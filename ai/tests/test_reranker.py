@@ -0,0 +1,78 @@
+"""
+Тесты cross-encoder re-ranking
+"""
+
+import time
+from unittest.mock import patch
+
+from ai.reranker import CrossEncoderReranker
+
+
+def keyword_scorer(calls):
+    """Score = число вхождений слова 'никель' (вместо модели)"""
+    def score(pairs):
+        calls.append(len(pairs))
+        return [document.count("никель") for _, document in pairs]
+    return score
+
+
+class TestCrossEncoderReranker:
+    """Батчи, кеш score и бюджет времени"""
+
+    def test_reorders_in_batches_and_caches_scores(self):
+        calls = []
+        reranker = CrossEncoderReranker(batch_size=2, score_function=keyword_scorer(calls))
+        ids = ["a", "b", "c"]
+        documents = ["медь", "никель никель", "никель"]
+
+        result = reranker.rerank("никель", ids, documents)
+        assert result["order"] == [1, 2, 0]
+        assert result["reranked"] is True
+        assert calls == [2, 1]
+
+        again = reranker.rerank("  Никель ", ids, documents)
+        assert again["order"] == [1, 2, 0]
+        assert again["cached"] == 3 and again["scored"] == 0
+        assert calls == [2, 1]
+
+    def test_changed_document_is_rescored(self):
+        calls = []
+        reranker = CrossEncoderReranker(score_function=keyword_scorer(calls))
+        reranker.rerank("никель", ["a"], ["медь"])
+        result = reranker.rerank("никель", ["a"], ["никель"])
+        assert result["scored"] == 1
+        assert calls == [1, 1]
+
+    def test_budget_exhausted_keeps_vector_order(self):
+        def slow(pairs):
+            time.sleep(0.05)
+            return [len(document) for _, document in pairs]
+        reranker = CrossEncoderReranker(batch_size=1, score_function=slow)
+
+        result = reranker.rerank("q", ["a", "b", "c"], ["x", "xx", "xxx"], budget_ms=20)
+        assert result["reranked"] is False
+        assert result["order"] == [0, 1, 2]
+        assert result["scored"] == 1  # после первого батча бюджет исчерпан
+
+
+class TestSearchRerank:
+    """Re-ranking в ChromaService"""
+
+    def test_search_deals_oversamples_and_returns_top_k(self, mock_chroma_service):
+        service = mock_chroma_service
+        service.reranker = CrossEncoderReranker(score_function=keyword_scorer([]))
+        documents = ["медь", "никель", "золото", "никель никель"]
+        service.deals_collection.query.return_value = {
+            "ids": [[f"d{i}" for i in range(4)]],
+            "documents": [documents],
+            "metadatas": [[{"total_amount_usd": i} for i in range(4)]],
+            "distances": [[0.1, 0.2, 0.3, 0.4]]
+        }
+
+        with patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False):
+            result = service.search_deals("никель", n_results=2, rerank=True)
+
+        assert service.deals_collection.query.call_args.kwargs["n_results"] == 8  # 2 × RERANK_OVERSAMPLE
+        assert [r["document"] for r in result["results"]] == ["никель никель", "никель"]
+        assert result["rerank"]["reranked"] is True
+        assert result["rerank"]["candidates"] == 4
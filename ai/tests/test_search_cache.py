@@ -0,0 +1,83 @@
+"""
+Тесты кеша результатов поиска Chroma
+"""
+
+from unittest.mock import patch
+
+from ai.search_cache import SearchCache
+
+
+def _row(doc_id: str):
+    return {"ids": [doc_id], "documents": [f"doc {doc_id}"], "metadatas": [{}], "distances": [0.1]}
+
+
+class TestSearchCache:
+    """Unit тесты SearchCache"""
+
+    def test_key_normalizes_query(self):
+        """Регистр и пробелы запроса не влияют на ключ, фильтр и n_results влияют"""
+        cache = SearchCache()
+        key = cache.make_key("minerals", "  Медь ", {"type": "base_metal"}, 3)
+        assert key == cache.make_key("minerals", "медь", {"type": "base_metal"}, 3)
+        assert key != cache.make_key("minerals", "медь", {"type": "precious_metal"}, 3)
+        assert key != cache.make_key("minerals", "медь", {"type": "base_metal"}, 5)
+        assert key != cache.make_key("deals", "медь", {"type": "base_metal"}, 3)
+
+    def test_lru_eviction_and_counters(self):
+        """Вытесняются давно не использованные записи, счетчики hit/miss растут"""
+        cache = SearchCache(max_entries=2)
+        cache.set("minerals:a", _row("a"))
+        cache.set("minerals:b", _row("b"))
+        assert cache.get("minerals:a") is not None  # a становится самой свежей
+        cache.set("minerals:c", _row("c"))
+
+        assert cache.get("minerals:b") is None
+        assert cache.get("minerals:a") is not None
+        stats = cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+        assert stats["evictions"] == 1
+        assert stats["entries"] == 2
+
+    def test_ttl_expiry(self):
+        """Записи старше TTL не возвращаются"""
+        cache = SearchCache(ttl_seconds=10)
+        with patch("ai.search_cache.time.monotonic", return_value=100.0):
+            cache.set("kyc:a", _row("a"))
+        with patch("ai.search_cache.time.monotonic", return_value=105.0):
+            assert cache.get("kyc:a") is not None
+        with patch("ai.search_cache.time.monotonic", return_value=111.0):
+            assert cache.get("kyc:a") is None
+
+    def test_invalidate_only_touches_collection(self):
+        """Инвалидация коллекции не затрагивает другие коллекции"""
+        cache = SearchCache()
+        cache.set("deals:a", _row("a"))
+        cache.set("kyc:b", _row("b"))
+        cache.invalidate("deals")
+        assert cache.get("deals:a") is None
+        assert cache.get("kyc:b") is not None
+
+
+class TestChromaServiceCache:
+    """Кеш перед search_* методами ChromaService"""
+
+    def test_repeated_search_hits_cache_and_write_invalidates(self, mock_chroma_service):
+        service = mock_chroma_service
+        collection = service.minerals_collection
+        collection.query.return_value = {
+            "ids": [["cu"]], "documents": [["Медь"]], "metadatas": [[{"type": "base_metal"}]], "distances": [[0.2]]
+        }
+
+        first = service.search_minerals("медь", n_results=1)
+        second = service.search_minerals(" МЕДЬ", n_results=1)
+        assert first["results"] == second["results"]
+        assert collection.query.call_count == 1
+
+        service.add_document("minerals", "Новый документ", {"type": "base_metal"}, id="new_doc")
+        service.search_minerals("медь", n_results=1)
+        assert collection.query.call_count == 2
+
+        cache_stats = service.get_collection_stats()["data"]["search_cache"]
+        assert cache_stats["hits"] == 1
+        assert cache_stats["misses"] == 2
@@ -0,0 +1,129 @@
+"""
+Тесты потокобезопасного реестра сервисов
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from ai import chroma_service as chroma_module
+from ai.service_registry import ServiceRegistry
+
+
+class SlowService:
+    """Сервис с медленным конструктором (как открытие клиента Chroma)"""
+
+    instances = 0
+    lock = threading.Lock()
+
+    def __init__(self, is_test_mode=False):
+        time.sleep(0.05)
+        with SlowService.lock:
+            SlowService.instances += 1
+        self.is_test_mode = is_test_mode
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestServiceRegistry:
+    """Double-checked locking, close() и fork"""
+
+    def test_concurrent_get_builds_single_instance(self):
+        registry = ServiceRegistry("stress")
+        SlowService.instances = 0
+        barrier = threading.Barrier(64)
+
+        def worker(i):
+            barrier.wait()
+            key = "test" if i % 2 else "prod"
+            return registry.get(key, lambda: SlowService(is_test_mode=key == "test"))
+
+        with ThreadPoolExecutor(max_workers=64) as pool:
+            results = list(pool.map(worker, range(64)))
+
+        assert SlowService.instances == 2
+        assert registry.created == 2
+        assert len({id(r) for r in results if r.is_test_mode}) == 1
+        assert len({id(r) for r in results if not r.is_test_mode}) == 1
+
+    def test_factory_error_is_not_cached(self):
+        registry = ServiceRegistry("errors")
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("chroma down")
+            return SlowService()
+
+        with pytest.raises(ConnectionError):
+            registry.get("prod", flaky)
+        assert isinstance(registry.get("prod", flaky), SlowService)
+        assert len(calls) == 2
+
+    def test_close_removes_and_closes_instances(self):
+        registry = ServiceRegistry("close")
+        first = registry.get("prod", SlowService)
+        registry.close()
+        assert first.closed is True
+        assert registry.peek("prod") is None
+        assert registry.get("prod", SlowService) is not first
+
+    def test_aclose_prefers_async_close(self):
+        closed = []
+
+        class AsyncService:
+            async def aclose(self):
+                closed.append("aclose")
+
+            def close(self):
+                closed.append("close")
+
+        registry = ServiceRegistry("async")
+        registry.get("prod", AsyncService)
+        asyncio.run(registry.aclose())
+        assert closed == ["aclose"]
+
+    @pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="fork недоступен")
+    def test_child_process_gets_own_instance(self):
+        registry = ServiceRegistry("fork")
+        parent = registry.get("prod", SlowService)
+        queue = multiprocessing.get_context("fork").Queue()
+
+        def child():
+            instance = registry.get("prod", SlowService)
+            queue.put((instance is parent, registry.created))
+
+        process = multiprocessing.get_context("fork").Process(target=child)
+        process.start()
+        same_instance, created = queue.get(timeout=10)
+        process.join(timeout=10)
+
+        assert same_instance is False
+        assert created == 1  # счетчик дочернего реестра не унаследован
+        assert registry.get("prod", SlowService) is parent  # родитель не затронут
+
+
+class TestGetChromaService:
+    """get_chroma_service поверх реестра"""
+
+    def test_threads_share_one_service_and_close_resets(self):
+        with patch.object(chroma_module, "_services", ServiceRegistry("chroma-test")), \
+             patch.object(chroma_module, "ChromaService", SlowService):
+            SlowService.instances = 0
+            with ThreadPoolExecutor(max_workers=32) as pool:
+                services = list(pool.map(lambda _: chroma_module.get_chroma_service(is_test_mode=True), range(32)))
+
+            assert SlowService.instances == 1
+            assert all(service is services[0] for service in services)
+
+            chroma_module.close_chroma_services()
+            assert services[0].closed is True
+            assert chroma_module.get_chroma_service(is_test_mode=True) is not services[0]
@@ -0,0 +1,124 @@
+"""
+Тесты шардирования индекса сделок по commodity
+"""
+
+from unittest.mock import patch
+
+import chromadb
+import pytest
+
+from ai.chroma_service import ChromaService
+from ai.sharding import ShardedCollection, merge_rows, shard_slug, shard_values
+
+
+def embed(texts):
+    return [[1.0 if "медь" in t else 0.0, 1.0 if "литий" in t else 0.0, 0.5] for t in texts]
+
+
+@pytest.fixture
+def client():
+    client = chromadb.EphemeralClient()
+    yield client
+    for name in [c.name for c in client.list_collections()]:
+        client.delete_collection(name)
+
+
+class TestRouting:
+    """Разбор where-фильтра и слияние top-k"""
+
+    def test_shard_values(self):
+        assert shard_values({"commodity": "copper", "environment": "test"}, "commodity") == ["copper"]
+        assert shard_values({"commodity": {"$in": ["copper", "gold"]}}, "commodity") == ["copper", "gold"]
+        assert shard_values({"$and": [{"status": "confirmed"}, {"commodity": {"$eq": "gold"}}]}, "commodity") == ["gold"]
+        assert shard_values({"status": "confirmed"}, "commodity") is None
+        assert shard_values({"commodity": {"$ne": "gold"}}, "commodity") is None
+        assert shard_values(None, "commodity") is None
+
+    def test_shard_slug(self):
+        assert shard_slug("Iron Ore") == "iron-ore"
+        assert shard_slug("iron_ore") == "iron_ore"
+        assert shard_slug(None) == "unknown"
+
+    def test_merge_rows_keeps_global_top_k(self):
+        rows = [
+            {"ids": ["a", "b"], "documents": ["A", "B"], "metadatas": [{}, {}], "distances": [0.1, 0.5]},
+            {"ids": ["c"], "documents": ["C"], "metadatas": [{}], "distances": [0.3]}
+        ]
+        assert merge_rows(rows, 2)["ids"] == ["a", "c"]
+        assert merge_rows(rows, 2)["distances"] == [0.1, 0.3]
+
+
+class TestShardedCollection:
+    """Запись по шардам, маршрутизация запросов, переезд записи"""
+
+    def test_routes_filtered_query_to_single_shard(self, client):
+        shards = ShardedCollection(client, "openmineral_deals", "commodity")
+        texts = ["медь Чили", "литий Австралия", "медь Перу"]
+        shards.upsert(
+            ids=["d1#0", "d2#0", "d3#0"],
+            documents=texts,
+            metadatas=[{"commodity": "copper"}, {"commodity": "lithium"}, {"commodity": "copper"}],
+            embeddings=embed(texts)
+        )
+        assert shards.counts() == {"copper": 2, "lithium": 1}
+        assert shards.names() == ["openmineral_deals_shard_copper", "openmineral_deals_shard_lithium"]
+
+        with patch.object(shards.shards["lithium"], "query") as lithium_query:
+            result = shards.query(embed(["медь"]), n_results=5, where={"commodity": "copper"})
+        lithium_query.assert_not_called()
+        assert sorted(result["ids"][0]) == ["d1#0", "d3#0"]
+
+        # Без фильтра — все шарды, общий top-k по дистанции
+        result = shards.query(embed(["литий", "медь"]), n_results=1)
+        assert result["ids"] == [["d2#0"], [result["ids"][1][0]]]
+        assert result["ids"][1][0] in {"d1#0", "d3#0"}
+
+        # Фильтр по значению без шарда — пустой результат без запросов
+        assert shards.query(embed(["медь"]), n_results=3, where={"commodity": "gold"})["ids"] == [[]]
+
+    def test_moved_record_leaves_previous_shard(self, client):
+        shards = ShardedCollection(client, "openmineral_deals", "commodity")
+        shards.upsert(ids=["d1#0"], documents=["медь"], metadatas=[{"commodity": "copper"}], embeddings=embed(["медь"]))
+        shards.upsert(ids=["d1#0"], documents=["литий"], metadatas=[{"commodity": "lithium"}], embeddings=embed(["литий"]))
+        assert shards.counts() == {"copper": 0, "lithium": 1}
+
+        # Существующие шарды находятся при повторном создании
+        assert ShardedCollection(client, "openmineral_deals", "commodity").counts() == {"copper": 0, "lithium": 1}
+
+
+class TestShardedDealSearch:
+    """ChromaService с DEALS_SHARD_KEY=commodity"""
+
+    @pytest.fixture
+    def service(self, client):
+        with patch("ai.chroma_service.chromadb.PersistentClient", return_value=client), \
+             patch("ai.chroma_service.chroma_config.DEALS_SHARD_KEY", "commodity"):
+            service = ChromaService(is_test_mode=True)
+        service.embedding_function = embed
+        yield service
+        service.close()
+
+    def test_sync_writes_shards_and_search_fans_out(self, service):
+        documents = [
+            {"id": "deal_cu", "document": "Сделка: медь из Чили.", "metadata": {"commodity": "copper", "status": "confirmed"}},
+            {"id": "deal_li", "document": "Сделка: литий из Австралии.", "metadata": {"commodity": "lithium", "status": "confirmed"}}
+        ]
+        with patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False):
+            service.sync_documents("deals", documents, source="contracts")
+            assert isinstance(service.chunk_collections["deals"], ShardedCollection)
+            assert service.get_collection_stats()["data"]["deal_shards"] == {"key": "commodity", "counts": {"copper": 1, "lithium": 1}}
+
+            result = service.search_deals("литий", n_results=2)
+            assert [r["id"] for r in result["results"]] == ["deal_li", "deal_cu"]
+            assert "parent_id" not in result["results"][0]["metadata"]
+
+            # Удаленная из источника сделка удаляется из своего шарда
+            service.sync_documents("deals", documents[:1], source="contracts")
+            assert service.chunk_collections["deals"].counts() == {"copper": 1, "lithium": 0}
+
+    def test_cleanup_drops_shards(self, service, client):
+        service.add_document("deals", "Сделка: медь.", {"commodity": "copper"}, id="deal_cu")
+        assert "openmineral_deals_shard_copper" in [c.name for c in client.list_collections()]
+        with patch("ai.chroma_service.chromadb.PersistentClient", return_value=client):
+            assert service.cleanup_test_db() is True
+        assert not [c.name for c in client.list_collections() if "_shard_" in c.name]
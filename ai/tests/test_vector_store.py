@@ -0,0 +1,191 @@
+"""
+Тесты in-process векторного хранилища и реплики коллекций Chroma
+"""
+
+import random
+import time
+from unittest.mock import patch
+
+import chromadb
+import numpy as np
+import pytest
+
+from ai import vector_store
+from ai.chroma_service import ChromaService
+from ai.filters import matches_where
+from ai.vector_store import InMemoryVectorStore, ReplicatedCollection, VectorStore
+
+REGIONS = ["Chile", "Peru", "Australia"]
+
+
+def dataset(n=60, dim=8, seed=7):
+    rng = random.Random(seed)
+    ids = [f"doc_{i}" for i in range(n)]
+    embeddings = [[rng.uniform(-1, 1) for _ in range(dim)] for _ in range(n)]
+    metadatas = [{"region": REGIONS[i % 3], "price": i * 10, "environment": "test"} for i in range(n)]
+    documents = [f"Документ {i}" for i in range(n)]
+    return ids, documents, metadatas, embeddings
+
+
+@pytest.fixture
+def client():
+    client = chromadb.EphemeralClient()
+    yield client
+    for name in [c.name for c in client.list_collections()]:
+        client.delete_collection(name)
+
+
+class TestInMemoryVectorStore:
+    """Точный top-k и фильтры совпадают с Chroma"""
+
+    @pytest.mark.parametrize("space", ["l2", "cosine", "ip"])
+    def test_matches_chroma_results(self, client, space):
+        ids, documents, metadatas, embeddings = dataset()
+        collection = client.get_or_create_collection(f"replica_{space}", metadata={"hnsw:space": space})
+        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        store = InMemoryVectorStore(space=space)
+        store.replace(ids, documents, metadatas, embeddings)
+
+        queries = embeddings[:3]
+        for where in (None, {"region": "Peru"}):
+            expected = collection.query(query_embeddings=queries, n_results=5, where=where)
+            actual = store.query(queries, n_results=5, where=where)
+            assert actual["ids"] == expected["ids"]
+            assert np.allclose(actual["distances"], expected["distances"], atol=1e-4)
+            assert actual["metadatas"][0][0] == expected["metadatas"][0][0]
+
+    def test_where_operators_match_filters_module(self):
+        ids, documents, metadatas, embeddings = dataset()
+        store = InMemoryVectorStore()
+        store.replace(ids, documents, metadatas, embeddings)
+        wheres = [
+            {"region": {"$in": ["Chile", "Peru"]}, "price": {"$gte": 200}},
+            {"$or": [{"region": "Australia"}, {"price": {"$lt": 50}}]},
+            {"$and": [{"region": {"$ne": "Chile"}}, {"missing": {"$nin": [1]}}]},
+            {"price": {"$gt": 10000}}
+        ]
+        for where in wheres:
+            expected = {doc_id for doc_id, meta in zip(ids, metadatas) if matches_where(meta, where)}
+            result = store.query([embeddings[0]], n_results=len(ids), where=where)
+            assert set(result["ids"][0]) == expected
+
+    def test_upsert_and_delete(self):
+        store = InMemoryVectorStore()
+        store.upsert(["a", "b"], ["A", "B"], [{"region": "Chile"}, {"region": "Peru"}], [[1.0, 0.0], [0.0, 1.0]])
+        assert store.query([[0.0, 1.0]], n_results=1)["ids"] == [["b"]]
+        store.upsert(["b"], ["B2"], [{"region": "Peru"}], [[-1.0, 0.0]])
+        assert store.query([[0.0, 1.0]], n_results=2)["documents"] == [["A", "B2"]]
+        store.delete(where={"region": "Chile"})
+        assert store.count() == 1
+        assert store.query([[0.0, 1.0]], n_results=5)["ids"] == [["b"]]
+
+    def test_writes_go_to_delta_and_compact_in_background(self):
+        ids, documents, metadatas, embeddings = dataset()
+        store = InMemoryVectorStore(delta_limit=3)
+        store.replace(ids, documents, metadatas, embeddings)
+        base = store.snapshot()
+
+        # Запись не перестраивает снимок: дельта ищется перебором поверх него
+        store.upsert(["new"], ["Новый"], [{"region": "Peru"}], [embeddings[7]])
+        store.delete(ids=["doc_7"])
+        assert store.snapshot() is base
+        assert store.query([embeddings[7]], n_results=2)["ids"][0][0] == "new"
+        assert "doc_7" not in store.query([embeddings[7]], n_results=60)["ids"][0]
+
+        store.upsert(["doc_8"], ["Документ 8"], [{"region": "Chile"}], [embeddings[9]])
+        deadline = time.monotonic() + 5
+        while store.snapshot() is base and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.snapshot() is not base  # дельта достигла delta_limit — снимок перестроен в фоне
+        assert store.count() == 60
+        assert set(store.query([embeddings[9]], n_results=2)["ids"][0]) == {"doc_8", "doc_9"}
+
+    def test_interface_is_abstract(self):
+        with pytest.raises(TypeError):
+            VectorStore()
+
+    @pytest.mark.skipif(vector_store.hnswlib is None, reason="hnswlib не установлен")
+    def test_hnsw_above_threshold(self):
+        ids, documents, metadatas, embeddings = dataset(n=200)
+        store = InMemoryVectorStore(hnsw_threshold=100, hnsw_ef=200)
+        store.replace(ids, documents, metadatas, embeddings)
+        assert store.snapshot().hnsw is not None
+        result = store.query([embeddings[5]], n_results=3, where={"region": REGIONS[5 % 3]})
+        assert result["ids"][0][0] == "doc_5"
+
+
+class TestReplicatedCollection:
+    """Реплика: чтение без Chroma, запись насквозь, отказ Chroma"""
+
+    def test_queries_served_locally_and_survive_outage(self, client):
+        ids, documents, metadatas, embeddings = dataset()
+        collection = client.get_or_create_collection("replicated")
+        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        replica = ReplicatedCollection(collection, page_size=25)
+
+        expected = collection.query(query_embeddings=[embeddings[1]], n_results=3)["ids"]
+        assert replica.query(query_embeddings=[embeddings[1]], n_results=3)["ids"] == expected
+        assert replica.ready and replica.count() == 60
+
+        # Запись идет в Chroma и в реплику
+        replica.upsert(ids=["new"], documents=["Новый"], metadatas=[{"region": "Peru"}], embeddings=[embeddings[1]])
+        replica.delete(ids=["doc_1"])
+        assert collection.count() == 60
+        assert replica.query(query_embeddings=[embeddings[1]], n_results=1)["ids"] == [["new"]]
+
+        # Chroma недоступна: поиск продолжает работать по снимку
+        with patch.object(collection, "query", side_effect=ConnectionError("chroma down")), \
+             patch.object(collection, "get", side_effect=ConnectionError("chroma down")):
+            replica.synced_at -= replica.refresh_seconds + 1  # фоновая пересинхронизация упадет
+            assert replica.query(query_embeddings=[embeddings[2]], n_results=1)["ids"] == [["doc_2"]]
+
+    def test_writes_during_sync_are_replayed(self, client):
+        ids, documents, metadatas, embeddings = dataset(n=10)
+        collection = client.get_or_create_collection("replayed")
+        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        replica = ReplicatedCollection(collection)
+        scan = collection.get
+
+        def get_with_concurrent_write(**kwargs):
+            page = scan(**kwargs)
+            # Запись во время чтения Chroma: блокировка записей не удерживается
+            replica.upsert(ids=["new"], documents=["Новый"], metadatas=[{"region": "Peru"}], embeddings=[embeddings[3]])
+            replica.delete(ids=["doc_3"])
+            return page
+
+        with patch.object(collection, "get", side_effect=get_with_concurrent_write):
+            assert replica.sync() == 10
+        assert replica.count() == 10
+        assert replica.query(query_embeddings=[embeddings[3]], n_results=1)["ids"] == [["new"]]
+
+    def test_unsynced_replica_falls_back_to_chroma(self, client):
+        collection = client.get_or_create_collection("fallback")
+        collection.add(ids=["a"], documents=["A"], embeddings=[[1.0, 0.0]])
+        replica = ReplicatedCollection(collection)
+        with patch.object(collection, "get", side_effect=ConnectionError("timeout")):
+            assert replica.query(query_embeddings=[[1.0, 0.0]], n_results=1)["ids"] == [["a"]]
+        assert replica.ready is False
+        assert replica.stats()["sync_error"] == "timeout"
+
+
+class TestServiceReplicas:
+    """ChromaService с VECTOR_REPLICA_COLLECTIONS"""
+
+    def test_minerals_search_uses_replica(self, client):
+        with patch("ai.chroma_service.chromadb.PersistentClient", return_value=client), \
+             patch("ai.chroma_service.chroma_config.VECTOR_REPLICA_COLLECTIONS", "minerals"):
+            service = ChromaService(is_test_mode=True)
+        service.embedding_function = lambda texts: [[1.0 if "медь" in t else 0.0, 0.5] for t in texts]
+        try:
+            assert isinstance(service.minerals_collection, ReplicatedCollection)
+            service.add_document("minerals", "медь катодная", {"type": "base_metal"}, id="copper")
+            service.add_document("minerals", "золото", {"type": "precious_metal"}, id="gold")
+            assert service.sync_replicas() == {"minerals": 2}
+
+            with patch("ai.chroma_service.chroma_config.HYBRID_SEARCH_ENABLED", False), \
+                 patch.object(service.minerals_collection.collection, "query", side_effect=AssertionError("network call")):
+                result = service.search_minerals("медь", n_results=1)
+            assert result["results"][0]["id"] == "copper"
+            assert service.get_collection_stats()["data"]["vector_replicas"]["minerals"]["count"] == 2
+        finally:
+            service.close()
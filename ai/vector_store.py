@@ -0,0 +1,490 @@
+"""
+Векторные хранилища OpenMineralHub
+Интерфейс хранилища, in-process хранилище на numpy (опционально HNSW) и
+коллекция Chroma с in-process репликой для чтения
+"""
+
+import abc
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ai.filters import matches_where
+
+try:
+    import hnswlib
+except ImportError:  # HNSW опционален, без него — точный перебор
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+SPACES = ("l2", "cosine", "ip")
+
+
+class VectorStore(abc.ABC):
+    """
+    Интерфейс векторного хранилища сервиса. query() возвращает результат
+    в формате collection.query() Chroma (списки по каждому запросу),
+    дистанции — в метрике коллекции (l2 — квадрат евклидова расстояния).
+    """
+
+    @abc.abstractmethod
+    def replace(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any) -> None:
+        """Полная замена содержимого (снимок коллекции)"""
+
+    @abc.abstractmethod
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Any) -> None:
+        """Добавление или замена записей"""
+
+    @abc.abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        """Удаление записей по id и/или where"""
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        """Число записей"""
+
+    @abc.abstractmethod
+    def query(self, query_embeddings: Any, n_results: int, where: Optional[Dict[str, Any]] = None) -> Dict[str, list]:
+        """top-k ближайших записей для каждого запроса"""
+
+
+class _Snapshot:
+    """
+    Неизменяемый снимок хранилища: матрица float32, колонки метаданных, HNSW индекс
+    (hnsw_threshold=None — только точный перебор)
+    """
+
+    MAX_CACHED_MASKS = 256
+
+    def __init__(self, rows: Dict[str, tuple], space: str, hnsw_threshold: Optional[int], hnsw_ef: int):
+        self.ids = list(rows)
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.documents = [rows[doc_id][1] for doc_id in self.ids]
+        self.metadatas = [rows[doc_id][2] for doc_id in self.ids]
+        self.space = space
+        if self.ids:
+            self.matrix = np.ascontiguousarray(np.stack([rows[doc_id][0] for doc_id in self.ids]), dtype=np.float32)
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        if space == "cosine" and len(self.ids):
+            norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+            self.matrix /= np.where(norms == 0, 1, norms)
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+
+        # Колонки метаданных: ключ → массив значений (None, если ключа нет)
+        keys = {key for metadata in self.metadatas for key in (metadata or {})}
+        self.columns: Dict[str, np.ndarray] = {}
+        for key in keys:
+            column = np.empty(len(self.ids), dtype=object)
+            column[:] = [(metadata or {}).get(key) for metadata in self.metadatas]
+            self.columns[key] = column
+        self._masks: Dict[str, np.ndarray] = {}
+
+        self.hnsw = None
+        if hnswlib is not None and hnsw_threshold is not None and len(self.ids) >= hnsw_threshold:
+            self.hnsw = hnswlib.Index(space=space, dim=self.matrix.shape[1])
+            self.hnsw.init_index(max_elements=len(self.ids), ef_construction=200, M=16)
+            self.hnsw.add_items(self.matrix, np.arange(len(self.ids)))
+            self.hnsw.set_ef(max(hnsw_ef, 1))
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self.columns.get(key)
+        if column is None:
+            column = np.full(len(self.ids), None, dtype=object)
+        return column
+
+    def _build_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._build_mask(clause)
+            elif key == "$or":
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for clause in condition:
+                    any_mask |= self._build_mask(clause)
+                mask &= any_mask
+            else:
+                column = self._column(key)
+                operators = condition if isinstance(condition, dict) else {"$eq": condition}
+                for op, operand in operators.items():
+                    if op == "$eq":
+                        mask &= np.asarray(column == operand, dtype=bool)
+                    elif op == "$ne":
+                        mask &= np.asarray(column != operand, dtype=bool)
+                    else:
+                        clause = {key: {op: operand}}
+                        mask &= np.fromiter(
+                            (matches_where({key: value}, clause) for value in column),
+                            dtype=bool,
+                            count=len(self.ids)
+                        )
+        return mask
+
+    def mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Маска строк для where-фильтра (кешируется на время жизни снимка)"""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True, default=str)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._build_mask(where)
+            if len(self._masks) >= self.MAX_CACHED_MASKS:
+                self._masks.clear()
+            self._masks[key] = mask
+        return mask
+
+    def distances(self, queries: np.ndarray) -> np.ndarray:
+        """Дистанции всех строк до всех запросов одним матричным умножением: (запросы, строки)"""
+        dots = queries @ self.matrix.T
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            return 1.0 - dots / np.where(norms == 0, 1, norms)
+        q_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(q_norms + self.sq_norms[None, :] - 2.0 * dots, 0.0)
+
+    def search(self, queries: np.ndarray, n_results: int, mask: Optional[np.ndarray]) -> List[Tuple[Any, Any]]:
+        """top-k строк снимка среди разрешенных маской: (позиции, дистанции) для каждого запроса"""
+        allowed = len(self.ids) if mask is None else int(mask.sum())
+        k = min(n_results, allowed)
+        if k <= 0:
+            return [([], []) for _ in range(len(queries))]
+
+        if self.hnsw is not None:
+            try:
+                labels, distances = self.hnsw.knn_query(queries, k=k, filter=None if mask is None else (lambda label: bool(mask[label])))
+                return list(zip(labels, distances))
+            except RuntimeError as e:
+                logger.debug(f"HNSW не вернул {k} результатов, точный перебор: {e}")
+
+        distances = self.distances(queries)
+        if mask is not None:
+            distances[:, ~mask] = np.inf
+        found = []
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < len(row) else np.arange(len(row))
+            top = top[np.argsort(row[top], kind="stable")]
+            found.append((top, row[top]))
+        return found
+
+
+class _View:
+    """
+    Состояние хранилища для чтения: базовый снимок, маска его устаревших строк
+    (перезаписанных или удаленных после построения) и снимок дельты записей
+    """
+
+    def __init__(self, base: _Snapshot, stale: Optional[np.ndarray], delta: Optional[_Snapshot]):
+        self.base = base
+        self.stale = stale
+        self.delta = delta
+
+
+class InMemoryVectorStore(VectorStore):
+    """
+    In-process хранилище: непрерывная матрица float32 и колонки метаданных.
+    Точный top-k — одно матричное умножение на пакет запросов и argpartition;
+    при hnswlib и размере от hnsw_threshold используется HNSW индекс.
+
+    Записи не перестраивают снимок: они попадают в дельту, которая ищется точным
+    перебором и сливается с результатами снимка (устаревшие строки снимка
+    исключаются маской). Когда дельта достигает delta_limit записей, снимок
+    перестраивается в фоновом потоке, чтение продолжается по прежнему.
+    """
+
+    def __init__(self, space: str = "l2", hnsw_threshold: int = 20000, hnsw_ef: int = 64, delta_limit: int = 1000):
+        if space not in SPACES:
+            raise ValueError(f"Неподдерживаемая метрика: {space}")
+        self.space = space
+        self.hnsw_threshold = hnsw_threshold
+        self.hnsw_ef = hnsw_ef
+        self.delta_limit = delta_limit
+        self._rows: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._base = self._build({})
+        # id → номер записи, изменившей строку после построения снимка
+        self._dirty: Dict[str, int] = {}
+        self._seq = 0
+        self._generation = 0
+        self._compacting = False
+        self._view: Optional[_View] = None
+
+    @staticmethod
+    def _vectors(embeddings: Any) -> np.ndarray:
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+
+    def _build(self, rows: Dict[str, tuple]) -> _Snapshot:
+        return _Snapshot(rows, self.space, self.hnsw_threshold, self.hnsw_ef)
+
+    def replace(self, ids, documents, metadatas, embeddings) -> None:
+        vectors = self._vectors(embeddings) if len(ids) else []
+        rows = {doc_id: (vectors[i], documents[i], metadatas[i]) for i, doc_id in enumerate(ids)}
+        base = self._build(rows)
+        with self._lock:
+            self._rows = rows
+            self._base = base
+            self._dirty.clear()
+            self._generation += 1
+            self._view = None
+
+    def _touch(self, ids) -> None:
+        """Учет записи в дельте (под self._lock); при переполнении — фоновое перестроение снимка"""
+        for doc_id in ids:
+            self._seq += 1
+            self._dirty[doc_id] = self._seq
+        self._view = None
+        if len(self._dirty) >= self.delta_limit and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, name="vector-store-compact", daemon=True).start()
+
+    def _compact(self) -> None:
+        """Перестроение снимка из текущих записей вне блокировки"""
+        try:
+            with self._lock:
+                rows, seq, generation = dict(self._rows), self._seq, self._generation
+            base = self._build(rows)
+            with self._lock:
+                if generation != self._generation:
+                    return  # содержимое заменено replace() во время перестроения
+                self._base = base
+                self._dirty = {doc_id: n for doc_id, n in self._dirty.items() if n > seq}
+                self._view = None
+        except Exception as e:
+            logger.warning(f"Снимок векторного хранилища не перестроен, поиск по дельте: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def upsert(self, ids, documents, metadatas, embeddings) -> None:
+        if not len(ids):
+            return
+        vectors = self._vectors(embeddings)
+        with self._lock:
+            for i, doc_id in enumerate(ids):
+                self._rows[doc_id] = (vectors[i], documents[i] if documents else None, metadatas[i] if metadatas else None)
+            self._touch(ids)
+
+    def delete(self, ids=None, where=None) -> None:
+        with self._lock:
+            targets = set(ids) if ids is not None else set(self._rows)
+            targets = {
+                doc_id for doc_id in targets
+                if doc_id in self._rows and (not where or matches_where(self._rows[doc_id][2], where))
+            }
+            for doc_id in targets:
+                del self._rows[doc_id]
+            self._touch(targets)
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    def snapshot(self) -> _Snapshot:
+        """Базовый снимок (без записей дельты)"""
+        return self._base
+
+    def _current_view(self) -> _View:
+        view = self._view
+        if view is not None:
+            return view
+        with self._lock:
+            if self._view is None:
+                base = self._base
+                stale = None
+                if self._dirty:
+                    stale = np.zeros(len(base.ids), dtype=bool)
+                    stale[[base.positions[d] for d in self._dirty if d in base.positions]] = True
+                delta_rows = {d: self._rows[d] for d in self._dirty if d in self._rows}
+                delta = _Snapshot(delta_rows, self.space, None, self.hnsw_ef) if delta_rows else None
+                self._view = _View(base, stale, delta)
+            return self._view
+
+    def query(self, query_embeddings, n_results, where=None) -> Dict[str, list]:
+        view = self._current_view()
+        queries = self._vectors(query_embeddings)
+        hits: List[List[tuple]] = [[] for _ in range(len(queries))]
+
+        for snapshot, stale in ((view.base, view.stale), (view.delta, None)):
+            if snapshot is None or not snapshot.ids:
+                continue
+            mask = snapshot.mask(where)
+            if stale is not None:
+                mask = ~stale if mask is None else mask & ~stale
+            for row_hits, (positions, distances) in zip(hits, snapshot.search(queries, n_results, mask)):
+                row_hits.extend((float(d), snapshot, p) for p, d in zip(positions, distances))
+
+        results: Dict[str, list] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row_hits in hits:
+            row_hits.sort(key=lambda hit: hit[0])
+            top = row_hits[:n_results]
+            results["ids"].append([snapshot.ids[p] for _, snapshot, p in top])
+            results["documents"].append([snapshot.documents[p] for _, snapshot, p in top])
+            results["metadatas"].append([snapshot.metadatas[p] for _, snapshot, p in top])
+            results["distances"].append([d for d, _, _ in top])
+        return results
+
+
+class ReplicatedCollection:
+    """
+    Коллекция Chroma с in-process репликой для query()
+
+    Запись (add/upsert/delete) идет в Chroma, затем в реплику. query() после первой
+    синхронизации обслуживается репликой без сетевого запроса; раз в refresh_seconds
+    реплика пересинхронизируется из Chroma в фоновом потоке (подхватывает записи
+    других процессов). Если Chroma недоступна, поиск продолжает работать по последнему
+    снимку. Остальные методы (get, count до синхронизации, modify, ...) — коллекции Chroma.
+    """
+
+    def __init__(self, collection, store: Optional[VectorStore] = None, refresh_seconds: float = 300, page_size: int = 500):
+        self.collection = collection
+        if store is None:
+            space = (collection.metadata or {}).get("hnsw:space", "l2")
+            store = InMemoryVectorStore(space=space if space in SPACES else "l2")
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.page_size = page_size
+        self.synced_at: Optional[float] = None
+        self.sync_error: Optional[str] = None
+        # _sync_lock — записи в реплику, _scan_lock — одна синхронизация за раз
+        self._sync_lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        # Записи, пришедшие во время чтения Chroma (None — синхронизация не идет)
+        self._pending: Optional[List[tuple]] = None
+        self._refreshing = False
+
+    def __getattr__(self, name: str):
+        return getattr(self.collection, name)
+
+    @property
+    def ready(self) -> bool:
+        return self.synced_at is not None
+
+    def sync(self) -> int:
+        """
+        Полная синхронизация реплики из Chroma (постранично); возвращает число записей.
+        Чтение Chroma не блокирует запись: записи, пришедшие во время чтения,
+        повторяются поверх нового снимка.
+        """
+        with self._scan_lock:
+            with self._sync_lock:
+                self._pending = []
+            try:
+                ids: List[str] = []
+                documents: List[str] = []
+                metadatas: List[Dict[str, Any]] = []
+                embeddings: List[Any] = []
+                offset = 0
+                while True:
+                    page = self.collection.get(limit=self.page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+                    page_ids = page["ids"] or []
+                    ids.extend(page_ids)
+                    documents.extend(page["documents"] or [None] * len(page_ids))
+                    metadatas.extend(page["metadatas"] or [None] * len(page_ids))
+                    if len(page_ids):
+                        embeddings.extend(page["embeddings"])
+                    if len(page_ids) < self.page_size:
+                        break
+                    offset += self.page_size
+                self.store.replace(ids, documents, metadatas, embeddings)
+            except Exception:
+                with self._sync_lock:
+                    self._pending = None
+                raise
+            with self._sync_lock:
+                pending, self._pending = self._pending, None
+                invalidated = self._replay(pending)
+                # Запись без эмбеддингов во время чтения — реплика синхронизируется заново
+                self.synced_at = None if invalidated else time.monotonic()
+                self.sync_error = None
+        logger.info(f"Реплика '{self.collection.name}' синхронизирована: {len(ids)} записей")
+        return len(ids)
+
+    def _replay(self, pending: List[tuple]) -> bool:
+        """Повтор записей поверх снимка (по порядку; upsert и delete идемпотентны)"""
+        invalidated = False
+        for op, args in pending:
+            if op == "upsert":
+                self.store.upsert(*args)
+            elif op == "delete":
+                self.store.delete(*args)
+            else:
+                invalidated = True
+        return invalidated
+
+    def _record(self, op: str, *args) -> None:
+        if self._pending is not None:
+            self._pending.append((op, args))
+
+    def _refresh(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            self.sync_error = str(e)
+            logger.warning(f"Реплика '{self.collection.name}' не обновлена, используется прежний снимок: {e}")
+        finally:
+            self._refreshing = False
+
+    def _refresh_if_expired(self) -> None:
+        if self._refreshing or time.monotonic() - self.synced_at < self.refresh_seconds:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._refresh, name="vector-replica-refresh", daemon=True).start()
+
+    def _mirror(self, ids, documents, metadatas, embeddings) -> None:
+        with self._sync_lock:
+            if embeddings is None:
+                # Эмбеддинги посчитала Chroma — реплика синхронизируется заново при следующем чтении
+                self._record("invalidate")
+                self.synced_at = None
+                return
+            self._record("upsert", ids, documents, metadatas, embeddings)
+            if self.ready:
+                self.store.upsert(ids, documents, metadatas, embeddings)
+
+    def add(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs):
+        result = self.collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+        self._mirror(ids, documents, metadatas, embeddings)
+        return result
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None, **kwargs):
+        result = self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings, **kwargs)
+        self._mirror(ids, documents, metadatas, embeddings)
+        return result
+
+    def delete(self, ids=None, where=None, **kwargs):
+        result = self.collection.delete(ids=ids, where=where, **kwargs)
+        with self._sync_lock:
+            self._record("delete", ids, where)
+            if self.ready:
+                self.store.delete(ids=ids, where=where)
+        return result
+
+    def count(self) -> int:
+        return self.store.count() if self.ready else self.collection.count()
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None, **kwargs) -> Dict[str, list]:
+        if not self.ready:
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_error = str(e)
+                logger.warning(f"Реплика '{self.collection.name}' не синхронизирована, запрос в Chroma: {e}")
+                return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where, **kwargs)
+        else:
+            self._refresh_if_expired()
+        return self.store.query(query_embeddings, n_results, where)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "count": self.store.count() if self.ready else None,
+            "age_seconds": round(time.monotonic() - self.synced_at, 1) if self.ready else None,
+            "backend": type(self.store).__name__,
+            "sync_error": self.sync_error
+        }
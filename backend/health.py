@@ -0,0 +1,232 @@
+"""
+Background dependency prober for liveness/readiness endpoints.
+
+Probes run on their own interval, off the request path; the probe endpoints
+only read the cached results, so Kubernetes probing never reaches Chroma.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# A check returns None (healthy), a status string such as "disabled" / "mock",
+# or a dict with "status" and extra details, and raises on failure. Checks that
+# hold clients expose close(), called from HealthProber.stop().
+Check = Callable[[], Union[None, str, Dict[str, Any]]]
+
+# Statuses that fail readiness for a required dependency
+NOT_READY_STATUSES = {"unhealthy", "not_initialized"}
+
+
+class HealthProber:
+    """
+    Periodically runs dependency checks in worker threads and caches
+    {status, latency_ms, checked_at, error} per dependency.
+    """
+
+    def __init__(
+        self,
+        checks: Dict[str, Check],
+        required: Iterable[str] = (),
+        interval_seconds: float = 15.0,
+        timeout_seconds: float = 5.0,
+    ):
+        self.checks = checks
+        self.required = set(required)
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.time()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, name: str, check: Check) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(asyncio.to_thread(check), timeout=self.timeout_seconds)
+            details = {}
+            if isinstance(status, dict):
+                details = {k: v for k, v in status.items() if k != "status"}
+                status = status.get("status")
+            result = {"status": status or "healthy", "error": None, "details": details}
+        except asyncio.TimeoutError:
+            result = {"status": "unhealthy", "error": f"timeout after {self.timeout_seconds}s", "details": {}}
+        except Exception as e:
+            result = {"status": "unhealthy", "error": str(e)[:200], "details": {}}
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["checked_at"] = datetime.now(timezone.utc).isoformat()
+        result["checked_at_ts"] = time.time()
+        if result["status"] == "unhealthy":
+            logger.warning(f"Health probe '{name}' failed: {result['error']}")
+        return result
+
+    async def probe_once(self) -> Dict[str, Dict[str, Any]]:
+        """Run all checks concurrently and store the results."""
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._probe(n, self.checks[n]) for n in names))
+        self.results = dict(zip(names, results))
+        return self.results
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except Exception as e:  # never let the prober loop die
+                logger.error(f"Health prober iteration failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        """Start the background probe loop on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the probe loop and close the clients held by the checks."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for name, check in self.checks.items():
+            close = getattr(check, "close", None)
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Health probe '{name}' client not closed: {e}")
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Readiness from cached results only. Not ready until the first probe
+        completes, when a required dependency is unhealthy or not initialized
+        (e.g. Chroma after a failed or disabled warm-up), or when its last
+        result is older than three probe intervals.
+        """
+        now = time.time()
+        max_age = self.interval_seconds * 3
+        dependencies = {}
+        ready = bool(self.results)
+        for name in self.checks:
+            result = self.results.get(name)
+            if result is None:
+                dependencies[name] = {"status": "unknown"}
+                ready = ready and name not in self.required
+                continue
+            age = now - result["checked_at_ts"]
+            stale = age > max_age
+            dependencies[name] = {
+                "status": result["status"],
+                "latency_ms": result["latency_ms"],
+                "checked_at": result["checked_at"],
+                "age_seconds": round(age, 1),
+                "stale": stale,
+                "required": name in self.required,
+                "error": result["error"],
+                "details": result.get("details", {}),
+            }
+            if name in self.required and (result["status"] in NOT_READY_STATUSES or stale):
+                ready = False
+        return {"ready": ready, "dependencies": dependencies}
+
+
+class ChromaCheck:
+    """
+    Heartbeat of the already created Chroma service plus its vector count.
+    The service is looked up with peek(), so probing never builds it;
+    peek defaults to ai.chroma_service.peek_chroma_service.
+    """
+
+    def __init__(self, is_test_mode: bool, peek: Optional[Callable[[bool], Any]] = None):
+        self.is_test_mode = is_test_mode
+        self._peek = peek
+
+    def __call__(self) -> Union[str, Dict[str, Any]]:
+        if self._peek is None:
+            from ai.chroma_service import peek_chroma_service
+
+            self._peek = peek_chroma_service
+        service = self._peek(self.is_test_mode)
+        if service is None:
+            return "not_initialized"
+        service.client.heartbeat()
+        vectors = sum(getattr(service, f"{key}_collection").count() for key in ("minerals", "deals", "kyc"))
+        return {"status": None, "vectors": vectors}
+
+
+class LLMCheck:
+    """Model metadata call (no tokens billed) through one client per prober."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._client = None
+
+    def __call__(self) -> Optional[str]:
+        settings = self.settings
+        if settings.testing or settings.use_mock_ai:
+            return "mock"
+        if not settings.openai_api_key:
+            return "not_configured"
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(api_key=settings.openai_api_key, timeout=settings.health_probe_timeout_seconds, max_retries=0)
+        self._client.models.retrieve(settings.openai_model)
+        return None
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+def _redis_client(timeout_seconds: float):
+    import redis
+    from config.chroma_config import chroma_config
+
+    return redis.Redis.from_url(chroma_config.REDIS_URL, socket_timeout=timeout_seconds)
+
+
+class RedisCheck:
+    """
+    Redis ping through one client (and connection pool) per prober.
+    client_factory(timeout_seconds) defaults to redis.Redis.from_url(REDIS_URL).
+    """
+
+    def __init__(self, settings, client_factory: Optional[Callable[[float], Any]] = None):
+        self.settings = settings
+        self.client_factory = client_factory or _redis_client
+        self._client = None
+
+    def __call__(self) -> Optional[str]:
+        if not self.settings.redis_enabled:
+            return "disabled"
+        if self._client is None:
+            self._client = self.client_factory(self.settings.health_probe_timeout_seconds)
+        self._client.ping()
+        return None
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+def build_health_prober(settings) -> HealthProber:
+    """Prober for Chroma, the LLM provider and Redis (required when enabled)."""
+    required = ["chroma"] + (["redis"] if settings.redis_enabled else [])
+    return HealthProber(
+        checks={
+            "chroma": ChromaCheck(settings.testing),
+            "llm": LLMCheck(settings),
+            "redis": RedisCheck(settings),
+        },
+        required=required,
+        interval_seconds=settings.health_probe_interval_seconds,
+        timeout_seconds=settings.health_probe_timeout_seconds,
+    )
@@ -5,6 +5,9 @@ Main entry point for the trading platform API
 
 import sys
 import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # Add root directory to Python path for imports
@@ -16,15 +19,42 @@ from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 # Import after sys.path fix
+from fastapi.responses import JSONResponse
 from config.settings import settings
+from backend.health import build_health_prober
+from backend.warmup import warm_up
 from backend.routers import auth, deals, market, kyc, risk, workflow, bc_parser
 
+# Dependency prober: checks Chroma, LLM and Redis on its own interval
+health_prober = build_health_prober(settings)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build and warm Chroma, embedding and LLM clients before serving requests,
+    then close them on shutdown. A failed warm-up does not stop startup:
+    services are still created lazily and readiness reports the outage.
+    """
+    from ai.async_chroma_service import close_async_chroma_services
+
+    if settings.warmup_enabled:
+        app.state.warmup = await asyncio.to_thread(warm_up, settings.testing)
+    else:
+        app.state.warmup = {"ready": None, "steps": {}, "disabled": True}
+    health_prober.start()
+    try:
+        yield
+    finally:
+        await health_prober.stop()
+        await close_async_chroma_services()
+
 app = FastAPI(
     title="OpenMineral Trading Platform API",
     description="AI-driven trading platform for mineral commodities with Chroma vector search",
     version="0.1.0",
     docs_url="/docs" if settings.debug else None,
-    redoc_url="/redoc" if settings.debug else None
+    redoc_url="/redoc" if settings.debug else None,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -56,34 +86,52 @@ async def root():
         "docs": "/docs" if settings.debug else None
     }
 
-@app.get("/api/health")
-async def health_check():
-    """Health check endpoint"""
-    from ai.chroma_service import get_chroma_service
-    
-    try:
-        # Quick Chroma check
-        service = get_chroma_service(is_test_mode=settings.testing)
-        stats = service.get_collection_stats()
-        chroma_status = "healthy" if stats["success"] else "degraded"
-        
-        return {
-            "status": "healthy",
-            "version": settings.app_version,
-            "environment": settings.environment,
-            "chroma_status": chroma_status,
-            "chroma_vectors": stats["data"]["total_vectors"] if stats["success"] else 0,
-            "debug": settings.debug,
-            "testing": settings.testing
-        }
-    except Exception as e:
-        return {
-            "status": "degraded",
+@app.get("/api/health/live")
+async def liveness():
+    """Liveness probe: in-process only, never touches dependencies"""
+    return {
+        "status": "alive",
+        "version": settings.app_version,
+        "uptime_seconds": round(time.time() - health_prober.started_at, 1)
+    }
+
+@app.get("/api/health/ready")
+async def readiness():
+    """Readiness probe: cached dependency status from the background prober"""
+    report = health_prober.readiness()
+    return JSONResponse(
+        status_code=200 if report["ready"] else 503,
+        content={
+            "status": "ready" if report["ready"] else "not_ready",
             "version": settings.app_version,
             "environment": settings.environment,
-            "chroma_status": "unavailable",
-            "error": str(e)[:100]
+            **report
         }
+    )
+
+@app.get("/api/health/warmup")
+async def warmup_report():
+    """Startup warm-up timings per step (Chroma client, embedding, LLM)"""
+    return getattr(app.state, "warmup", {"ready": None, "steps": {}})
+
+@app.get("/api/health")
+async def health_check():
+    """Health check endpoint (cached dependency status, no Chroma round trip)"""
+    report = health_prober.readiness()
+    chroma = report["dependencies"].get("chroma", {})
+    chroma_status = {"healthy": "healthy", "unhealthy": "unavailable", "not_initialized": "not_initialized"}.get(chroma.get("status"), "unknown")
+    
+    return {
+        "status": "healthy" if report["ready"] else "degraded",
+        "version": settings.app_version,
+        "environment": settings.environment,
+        "chroma_status": chroma_status,
+        "chroma_vectors": chroma.get("details", {}).get("vectors", 0),
+        "dependencies": report["dependencies"],
+        "warmup": {key: value for key, value in getattr(app.state, "warmup", {}).items() if key in ("ready", "total_ms")},
+        "debug": settings.debug,
+        "testing": settings.testing
+    }
 
 @app.get("/api/chroma/test")
 async def test_chroma():
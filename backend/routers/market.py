@@ -1,7 +1,12 @@
 from fastapi import APIRouter, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from pydantic import BaseModel
-from ai.chroma_service import get_chroma_service
+import asyncio
+import json
+from pydantic import BaseModel, Field, ValidationError
+from ai.async_chroma_service import get_async_chroma_service
+from ai.deal_analytics import DIMENSIONS as ANALYTICS_DIMENSIONS
+from ai.filters import DealFilter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -54,19 +59,50 @@ class DealSearchRequest(BaseModel):
     risk_level: Optional[str] = None
     region: Optional[str] = None
 
+class BatchSearchQuery(BaseModel):
+    """Один запрос в пакетном поиске"""
+    collection: str = Field("minerals", description="Коллекция: minerals, deals или kyc")
+    query: str
+    n_results: int = Field(5, ge=1, le=20)
+    commodity_type: Optional[str] = None
+    market: Optional[str] = None
+    status: Optional[str] = None
+    risk_level: Optional[str] = None
+    deal_filter: Optional[DealFilter] = Field(None, description="Фильтр сделок как в /search/deals: суммы, даты, commodity, region, ...")
+    aml_filter: Optional[str] = "clean"
+
+class BatchSearchRequest(BaseModel):
+    """Запрос пакетного поиска"""
+    queries: List[BatchSearchQuery] = Field(..., min_length=1, max_length=50)
+
+async def _chroma_service(is_test_mode: bool = False):
+    """
+    Async фасад Chroma сервиса. Первый вызов создает клиент и коллекции
+    (сетевые запросы), поэтому выполняется в потоке, а не в event loop
+    """
+    return await asyncio.to_thread(get_async_chroma_service, is_test_mode=is_test_mode)
+
+def _timings(results: dict) -> dict:
+    """Время обработки сервиса и тайминги по стадиям (при TIMINGS_IN_RESPONSE)"""
+    data = {"processing_time_ms": results.get("processing_time_ms", 0)}
+    if "timings" in results:
+        data["timings"] = results["timings"]
+    return data
+
 @router.get("/search/minerals")
 async def search_minerals(
     query: str = Query(..., description="Поисковый запрос по минералам"),
     n_results: int = Query(5, ge=1, le=10),
     commodity_type: Optional[str] = Query(None, description="Тип минерала"),
-    market: Optional[str] = Query(None, description="Биржа/рынок")
+    market: Optional[str] = Query(None, description="Биржа/рынок"),
+    rerank: Optional[bool] = Query(None, description="Re-ranking cross-encoder (по умолчанию RERANK_ENABLED)")
 ):
     """
     Семантический поиск по каталогу минералов
     Использует Chroma для поиска по описаниям, характеристикам, ценам
     """
     try:
-        service = get_chroma_service()
+        service = await _chroma_service()
         
         # Формирование фильтров
         filters = {}
@@ -76,10 +112,11 @@ async def search_minerals(
             filters["market"] = market
         
         # Поиск в Chroma
-        results = service.search_minerals(
+        results = await service.search_minerals(
             query=query,
             n_results=n_results,
-            filters=filters
+            filters=filters,
+            rerank=rerank
         )
         
         if not results["success"]:
@@ -112,9 +149,10 @@ async def search_minerals(
                 "query": query,
                 "filters": filters,
                 "results_count": results["results_count"],
-                "processing_time_ms": results.get("processing_time_ms", 0),
+                "rerank": results.get("rerank"),
                 "results": enriched_results,
-                "ai_analysis": ai_insights
+                "ai_analysis": ai_insights,
+                **_timings(results)
             }
         )
         
@@ -130,21 +168,44 @@ async def search_deals(
     n_results: int = Query(5, ge=1, le=20),
     status: Optional[str] = Query(None, description="Статус сделки"),
     risk_level: Optional[str] = Query(None, description="Уровень риска"),
-    region: Optional[str] = Query(None, description="Регион")
+    commodity: Optional[str] = Query(None, description="Товар (copper, lithium, ...)"),
+    region: Optional[str] = Query(None, description="Регион"),
+    counterparty: Optional[str] = Query(None, description="Контрагент"),
+    min_amount_usd: Optional[float] = Query(None, ge=0, description="Минимальная сумма сделки, USD"),
+    max_amount_usd: Optional[float] = Query(None, ge=0, description="Максимальная сумма сделки, USD"),
+    date_from: Optional[str] = Query(None, description="Дата сделки с (YYYY-MM-DD или ISO 8601)"),
+    date_to: Optional[str] = Query(None, description="Дата сделки по, включительно (YYYY-MM-DD или ISO 8601)"),
+    rerank: Optional[bool] = Query(None, description="Re-ranking cross-encoder (по умолчанию RERANK_ENABLED)")
 ):
     """
     Поиск по торговым сделкам с фильтрами
+    Все фильтры (включая диапазоны суммы и дат) выполняются в Chroma.
     Возвращает релевантные сделки + общую статистику
     """
     try:
-        service = get_chroma_service()
+        deal_filter = DealFilter(
+            status=status,
+            risk_level=risk_level,
+            commodity=commodity,
+            region=region,
+            counterparty=counterparty,
+            min_amount_usd=min_amount_usd,
+            max_amount_usd=max_amount_usd,
+            date_from=date_from,
+            date_to=date_to
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный фильтр сделок: {e.errors()[0]['msg']}")
+    
+    try:
+        service = await _chroma_service()
         
         # Поиск в Chroma
-        results = service.search_deals(
+        results = await service.search_deals(
             query=query,
             n_results=n_results,
-            status_filter=status,
-            risk_filter=risk_level
+            rerank=rerank,
+            deal_filter=deal_filter
         )
         
         if not results["success"]:
@@ -174,14 +235,12 @@ async def search_deals(
             success=True,
             data={
                 "query": query,
-                "filters": {
-                    "status": status,
-                    "risk_level": risk_level,
-                    "region": region
-                },
+                "filters": deal_filter.model_dump(),
                 "results_count": results["results_count"],
                 "total_deal_value_usd": results["total_deal_value_usd"],
-                "results": formatted_results
+                "rerank": results.get("rerank"),
+                "results": formatted_results,
+                **_timings(results)
             }
         )
         
@@ -191,14 +250,108 @@ async def search_deals(
         logger.error(f"Ошибка API поиска сделок: {e}")
         raise HTTPException(status_code=500, detail=f"Search deals error: {str(e)}")
 
+@router.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    """
+    Пакетный поиск: несколько запросов к minerals/deals/kyc за один вызов
+    Запросы с одинаковыми фильтрами объединяются в один round trip к Chroma
+    """
+    try:
+        service = await _chroma_service()
+        
+        queries = []
+        for item in request.queries:
+            spec = {"collection": item.collection, "query": item.query, "n_results": item.n_results}
+            if item.collection == "minerals":
+                filters = {}
+                if item.commodity_type:
+                    filters["type"] = item.commodity_type
+                if item.market:
+                    filters["market"] = item.market
+                spec["filters"] = filters
+            elif item.collection == "deals":
+                # status/risk_level — прежние поля запроса, имеют приоритет над deal_filter
+                overrides = {"status": item.status, "risk_level": item.risk_level}
+                deal_filter = (item.deal_filter or DealFilter()).model_copy(
+                    update={key: value for key, value in overrides.items() if value}
+                )
+                spec["deal_filter"] = deal_filter.model_dump()
+            elif item.collection == "kyc":
+                spec["aml_filter"] = item.aml_filter
+            else:
+                raise HTTPException(status_code=400, detail=f"Unknown collection: {item.collection}")
+            queries.append(spec)
+        
+        results = await service.search_batch(queries)
+        
+        return APIResponse(
+            success=results["success"],
+            data={
+                "results_count": results["results_count"],
+                "round_trips": results["round_trips"],
+                "results": results["results"],
+                **_timings(results)
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка API пакетного поиска: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch search error: {str(e)}")
+
+@router.get("/search/all")
+async def search_all(
+    query: str = Query(..., description="Поисковый запрос по всем коллекциям"),
+    n_results: int = Query(3, ge=1, le=10, description="Результатов на коллекцию"),
+    collections: Optional[List[str]] = Query(None, description="Коллекции: minerals, deals, kyc (по умолчанию все)"),
+    aml_filter: Optional[str] = Query("clean", description="AML статус для KYC")
+):
+    """
+    Федеративный поиск по минералам, сделкам и KYC
+    Запрос эмбеддится один раз, коллекции опрашиваются параллельно
+    """
+    try:
+        service = await _chroma_service()
+        results = await service.search_all(
+            query=query,
+            n_results=n_results,
+            collections=collections,
+            aml_filter=aml_filter
+        )
+        
+        if not results["success"]:
+            error = results.get("error") or "; ".join(f"{k}: {v}" for k, v in results.get("errors", {}).items())
+            status_code = 400 if "Unknown collection" in error else 500
+            raise HTTPException(status_code=status_code, detail=f"Ошибка федеративного поиска: {error}")
+        
+        return APIResponse(
+            success=True,
+            data={
+                "query": query,
+                "results_count": results["results_count"],
+                "partial": results["partial"],
+                "errors": results["errors"],
+                "results": results["results"],
+                "by_collection": results["by_collection"],
+                **_timings(results)
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка API федеративного поиска: {e}")
+        raise HTTPException(status_code=500, detail=f"Search all error: {str(e)}")
+
 @router.get("/stats")
 async def market_stats():
     """
     Статистика рынка и Chroma коллекций
     """
     try:
-        service = get_chroma_service()
-        stats = service.get_collection_stats()
+        service = await _chroma_service()
+        stats = await service.get_collection_stats()
         
         if not stats["success"]:
             raise HTTPException(
@@ -217,13 +370,16 @@ async def market_stats():
             "confirmed_deals_count": confirmed_deals,
             "total_knowledge_vectors": total_vectors,
             "data_freshness": stats_data.get("last_updated", "unknown"),
-            "system_status": stats_data.get("status", "unknown")
+            "system_status": stats_data.get("status", "unknown"),
+            "deals_by_status": stats_data.get("deals_by_status", {}),
+            "deals_by_commodity": stats_data.get("deals_by_commodity", {}),
+            "deals_by_region": stats_data.get("deals_by_region", {})
         }
         
         return APIResponse(
             success=True,
             data={
-                "chroma_stats": stats_data["stats"],
+                "chroma_stats": stats_data,
                 "market_analysis": analysis
             }
         )
@@ -234,6 +390,56 @@ async def market_stats():
         logger.error(f"Ошибка получения статистики рынка: {e}")
         raise HTTPException(status_code=500, detail=f"Stats error: {str(e)}")
 
+@router.get("/analytics")
+async def market_analytics(
+    group_by: str = Query("commodity,region,month", description="Измерения через запятую: commodity, region, month, status"),
+    commodity: Optional[str] = Query(None, description="Товар"),
+    region: Optional[str] = Query(None, description="Регион"),
+    status: Optional[str] = Query(None, description="Статус сделки"),
+    date_from: Optional[str] = Query(None, description="Начало периода (YYYY-MM или YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="Конец периода (YYYY-MM или YYYY-MM-DD)")
+):
+    """
+    Аналитика портфеля сделок: объем и стоимость по группам
+    (commodity × region × month), структура статусов, средняя цена.
+    Считается по колонкам метаданных сделок в памяти, без чтения коллекции.
+    """
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in ANALYTICS_DIMENSIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестные измерения: {', '.join(unknown)} (доступны: {', '.join(ANALYTICS_DIMENSIONS)})"
+        )
+    
+    try:
+        service = await _chroma_service()
+        result = await service.get_deal_analytics(
+            dimensions,
+            commodity=commodity,
+            region=region,
+            status=status,
+            date_from=date_from,
+            date_to=date_to
+        )
+        
+        if not result["success"]:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Ошибка аналитики сделок: {result.get('error')}"
+            )
+        
+        return APIResponse(
+            success=True,
+            data={key: value for key, value in result.items() if key != "success"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка API аналитики сделок: {e}")
+        raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
+
 @router.get("/search/kyc")
 async def search_kyc(
     query: str = Query(..., description="Поисковый запрос по KYC"),
@@ -245,9 +451,9 @@ async def search_kyc(
     Поиск KYC документов с compliance фильтрами
     """
     try:
-        service = get_chroma_service(is_test_mode=test_mode)
+        service = await _chroma_service(is_test_mode=test_mode)
         
-        results = service.search_kyc(
+        results = await service.search_kyc(
             query=query,
             n_results=n_results,
             aml_filter=aml_filter
@@ -269,7 +475,8 @@ async def search_kyc(
                 "results_count": results["results_count"],
                 "clean_entities": results["clean_entities"],
                 "average_risk_score": results["average_risk_score"],
-                "results": results["results"]
+                "results": results["results"],
+                **_timings(results)
             }
         )
         
@@ -290,7 +497,7 @@ async def rag_search(
     RAG endpoint: Семантический поиск + AI summary через OpenAI
     """
     try:
-        service = get_chroma_service(is_test_mode=test_mode)
+        service = await _chroma_service(is_test_mode=test_mode)
         
         # Фильтры
         filters = {}
@@ -298,7 +505,7 @@ async def rag_search(
             filters["type"] = commodity_type
         
         # RAG query
-        rag_results = service.rag_query(
+        rag_results = await service.rag_query(
             query=query,
             n_results=n_results,
             filters=filters
@@ -320,7 +527,9 @@ async def rag_search(
                 "chroma_results_count": rag_results["chroma_results_count"],
                 "ai_response": rag_results["response"],
                 "sources": rag_results["sources"],
-                "environment": rag_results["environment"]
+                "cache": rag_results.get("cache"),
+                "environment": rag_results["environment"],
+                **_timings(rag_results)
             }
         )
         
@@ -329,3 +538,44 @@ async def rag_search(
     except Exception as e:
         logger.error(f"Ошибка RAG API: {e}")
         raise HTTPException(status_code=500, detail=f"RAG error: {str(e)}")
+
+def _sse(event: str, data: dict) -> str:
+    """Форматирование события Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@router.get("/rag/stream")
+async def rag_search_stream(
+    query: str = Query(..., description="RAG запрос (Chroma + LLM)"),
+    n_results: int = Query(3, ge=1, le=5),
+    commodity_type: Optional[str] = Query(None, description="Тип минерала для фильтра"),
+    test_mode: bool = Query(False, description="Тестовый режим (mock LLM)")
+):
+    """
+    Потоковый RAG endpoint (text/event-stream)
+    События: sources (сразу после поиска), token (фрагменты ответа LLM), done или error
+    """
+    service = await _chroma_service(is_test_mode=test_mode)
+    
+    filters = {}
+    if commodity_type:
+        filters["type"] = commodity_type
+    
+    async def event_stream():
+        events = service.stream_rag_query(query=query, n_results=n_results, filters=filters)
+        try:
+            async for event in events:
+                yield _sse(event["event"], event["data"])
+        except asyncio.CancelledError:
+            # StreamingResponse слушает disconnect параллельно с отправкой и отменяет
+            # генератор сразу, в том числе во время ожидания токена LLM
+            logger.info(f"Клиент отключился, потоковый RAG остановлен: '{query}'")
+            raise
+        finally:
+            # Закрытие потока сервиса обрывает astream LLM, чтобы не расходовать токены
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
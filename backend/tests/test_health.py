@@ -0,0 +1,137 @@
+# Tests for the background health prober behind /api/health/live and /api/health/ready.
+
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from backend.health import ChromaCheck, HealthProber, RedisCheck
+
+
+def _failing():
+    raise ConnectionError("chroma down")
+
+
+def _slow():
+    time.sleep(1)
+
+
+def test_not_ready_before_first_probe():
+    prober = HealthProber({"chroma": lambda: None}, required=["chroma"])
+    report = prober.readiness()
+    assert report["ready"] is False
+    assert report["dependencies"]["chroma"]["status"] == "unknown"
+
+
+def test_ready_when_required_dependencies_healthy():
+    prober = HealthProber(
+        {"chroma": lambda: None, "llm": _failing, "redis": lambda: "disabled"},
+        required=["chroma"],
+    )
+    asyncio.run(prober.probe_once())
+    report = prober.readiness()
+    assert report["ready"] is True  # optional LLM failure does not fail readiness
+    assert report["dependencies"]["llm"]["status"] == "unhealthy"
+    assert report["dependencies"]["redis"]["status"] == "disabled"
+    assert report["dependencies"]["chroma"]["checked_at"]
+
+
+def test_required_failure_and_timeout():
+    prober = HealthProber({"chroma": _failing, "redis": _slow}, required=["chroma", "redis"], timeout_seconds=0.1)
+    asyncio.run(prober.probe_once())
+    report = prober.readiness()
+    assert report["ready"] is False
+    assert report["dependencies"]["chroma"]["error"] == "chroma down"
+    assert "timeout" in report["dependencies"]["redis"]["error"]
+
+
+def test_uninitialized_required_dependency_is_not_ready():
+    # Warm-up failed or disabled: the Chroma service was never created
+    prober = HealthProber({"chroma": lambda: "not_initialized", "llm": lambda: "not_initialized"}, required=["chroma"])
+    asyncio.run(prober.probe_once())
+    report = prober.readiness()
+    assert report["ready"] is False
+    assert report["dependencies"]["chroma"]["status"] == "not_initialized"
+
+    optional = HealthProber({"chroma": lambda: None, "llm": lambda: "not_initialized"}, required=["chroma"])
+    asyncio.run(optional.probe_once())
+    assert optional.readiness()["ready"] is True
+
+
+def test_stale_results_are_not_ready():
+    prober = HealthProber({"chroma": lambda: None}, required=["chroma"], interval_seconds=1)
+    asyncio.run(prober.probe_once())
+    prober.results["chroma"]["checked_at_ts"] -= 10
+    report = prober.readiness()
+    assert report["ready"] is False
+    assert report["dependencies"]["chroma"]["stale"] is True
+
+
+def test_readiness_does_not_run_checks():
+    calls = []
+    prober = HealthProber({"chroma": lambda: calls.append(1)}, required=["chroma"])
+    asyncio.run(prober.probe_once())
+    for _ in range(10):
+        prober.readiness()
+    assert len(calls) == 1
+
+
+def test_background_loop_refreshes_results():
+    calls = []
+    prober = HealthProber({"chroma": lambda: calls.append(1)}, required=["chroma"], interval_seconds=0.01)
+
+    async def run():
+        prober.start()
+        await asyncio.sleep(0.1)
+        await prober.stop()
+
+    asyncio.run(run())
+    assert len(calls) >= 2
+    assert prober.readiness()["ready"] is True
+
+
+def test_check_details_and_clients_closed_on_stop():
+    class Closing:
+        closed = False
+
+        def __call__(self):
+            return {"status": None, "vectors": 14}
+
+        def close(self):
+            self.closed = True
+
+    check = Closing()
+    prober = HealthProber({"chroma": check}, required=["chroma"])
+
+    async def run():
+        await prober.probe_once()
+        await prober.stop()
+
+    asyncio.run(run())
+    chroma = prober.readiness()["dependencies"]["chroma"]
+    assert chroma["status"] == "healthy"
+    assert chroma["details"] == {"vectors": 14}
+    assert check.closed is True
+
+
+def test_redis_client_reused_across_probes():
+    settings = SimpleNamespace(redis_enabled=True, health_probe_timeout_seconds=1)
+    factory = MagicMock()
+    check = RedisCheck(settings, client_factory=factory)
+    check()
+    check()
+    check.close()
+    factory.assert_called_once_with(1)
+    assert factory.return_value.ping.call_count == 2
+    factory.return_value.close.assert_called_once()
+
+
+def test_chroma_check_does_not_create_service():
+    assert ChromaCheck(is_test_mode=True, peek=lambda is_test_mode: None)() == "not_initialized"
+
+    service = MagicMock()
+    service.minerals_collection.count.return_value = 3
+    service.deals_collection.count.return_value = 5
+    service.kyc_collection.count.return_value = 6
+    assert ChromaCheck(is_test_mode=True, peek=lambda is_test_mode: service)() == {"status": None, "vectors": 14}
+    service.client.heartbeat.assert_called_once()
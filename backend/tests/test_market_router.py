@@ -0,0 +1,81 @@
+# Tests for the market router: request parsing before the Chroma service is called.
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from ai.filters import DealFilter
+from backend.routers.market import rag_search_stream, router
+
+
+@pytest.fixture
+def service():
+    service = MagicMock()
+    service.search_batch = AsyncMock(return_value={"success": True, "results_count": 1, "round_trips": 1, "results": []})
+    with patch("backend.routers.market.get_async_chroma_service", return_value=service):
+        yield service
+
+
+@pytest.fixture
+def client(service):
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_batch_deal_filter_compiles_like_search_deals(client, service):
+    response = client.post("/market/search/batch", json={"queries": [{
+        "collection": "deals",
+        "query": "медь",
+        "status": "confirmed",
+        "deal_filter": {"status": "open", "commodity": "copper", "min_amount_usd": 1000000, "date_from": "2024-01-01"}
+    }]})
+
+    assert response.status_code == 200
+    spec = service.search_batch.await_args.args[0][0]
+    expected = DealFilter(status="confirmed", commodity="copper", min_amount_usd=1000000, date_from="2024-01-01")
+    assert spec["deal_filter"] == expected.model_dump()
+    assert DealFilter(**spec["deal_filter"]).to_where() == expected.to_where()
+
+
+def test_batch_invalid_deal_filter_rejected(client, service):
+    response = client.post("/market/search/batch", json={"queries": [{
+        "collection": "deals",
+        "query": "медь",
+        "deal_filter": {"date_to": "not-a-date"}
+    }]})
+
+    assert response.status_code == 422
+    service.search_batch.assert_not_called()
+
+
+def test_stream_cancelled_while_waiting_for_llm_closes_upstream(service):
+    closed = []
+
+    async def stream_rag_query(**kwargs):
+        try:
+            yield {"event": "sources", "data": {"sources": []}}
+            await asyncio.Event().wait()  # LLM не отвечает
+        finally:
+            closed.append(True)
+    service.stream_rag_query = stream_rag_query
+
+    async def disconnect_mid_generation():
+        response = await rag_search_stream(query="медь", n_results=3, commodity_type=None, test_mode=True)
+        body = response.body_iterator
+        first = await body.__anext__()
+        pending = asyncio.ensure_future(body.__anext__())
+        await asyncio.sleep(0.01)
+        pending.cancel()  # так StreamingResponse отменяет отправку при отключении клиента
+        try:
+            await pending
+        except asyncio.CancelledError:
+            pass
+        return first
+
+    first = asyncio.run(disconnect_mid_generation())
+    assert first.startswith("event: sources")
+    assert closed == [True]
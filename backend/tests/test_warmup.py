@@ -0,0 +1,51 @@
+# Tests for the startup warm-up run from the FastAPI lifespan.
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from backend.warmup import warm_up
+
+
+def _service():
+    service = MagicMock()
+    service._embed.return_value = [[0.1, 0.2, 0.3]]
+    service.warm_up_llm.return_value = "mock"
+    service.sync_replicas.return_value = {}
+    service.startup_timings = {"client_ms": 5.0, "collections_ms": 12.0}
+    return service
+
+
+def test_warm_up_runs_all_steps_with_timings():
+    service = _service()
+    with patch("ai.chroma_service.get_chroma_service", return_value=service), \
+         patch("ai.async_chroma_service.get_async_chroma_service", return_value=SimpleNamespace()) as facade:
+        report = warm_up(is_test_mode=True)
+
+    assert report["ready"] is True
+    assert list(report["steps"]) == ["chroma", "embedding", "vector_replicas", "vector_query", "llm", "async_facade"]
+    assert report["steps"]["llm"]["status"] == "mock"
+    assert all(step["elapsed_ms"] >= 0 for step in report["steps"].values())
+    assert report["service_timings"] == {"client_ms": 5.0, "collections_ms": 12.0}
+    service.minerals_collection.query.assert_called_once_with(query_embeddings=[[0.1, 0.2, 0.3]], n_results=1)
+    facade.assert_called_once_with(is_test_mode=True)
+
+
+def test_optional_llm_failure_keeps_ready():
+    service = _service()
+    service.warm_up_llm.side_effect = ConnectionError("openai unreachable")
+    with patch("ai.chroma_service.get_chroma_service", return_value=service), \
+         patch("ai.async_chroma_service.get_async_chroma_service"):
+        report = warm_up(is_test_mode=False)
+
+    assert report["ready"] is True
+    assert report["steps"]["llm"] == {"status": "failed", "error": "openai unreachable", "elapsed_ms": report["steps"]["llm"]["elapsed_ms"]}
+
+
+def test_chroma_down_is_reported_not_raised():
+    with patch("ai.chroma_service.get_chroma_service", side_effect=RuntimeError("Chroma init error")):
+        report = warm_up(is_test_mode=False)
+
+    assert report["ready"] is False
+    assert list(report["steps"]) == ["chroma"]
+    assert report["steps"]["chroma"]["error"] == "Chroma init error"
+    assert report["service_timings"] == {}
@@ -0,0 +1,76 @@
+"""
+Application warm-up run from the FastAPI lifespan.
+
+Builds the Chroma client, collections, embedding function and LLM clients
+before the first request is served, so no request pays for cold start, and
+records per-step timings for /api/health/warmup.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMUP_QUERY = "warm-up"
+# Steps whose failure means search cannot serve requests; llm is optional like in the health prober
+REQUIRED_STEPS = ("chroma", "embedding", "vector_query")
+
+
+def _step(steps: Dict[str, Dict[str, Any]], name: str, func: Callable[[], Any]) -> Optional[Any]:
+    """Run one warm-up step; a failure is recorded and does not abort startup."""
+    started = time.perf_counter()
+    value = None
+    try:
+        value = func()
+        result = {"status": value if isinstance(value, str) else "ok", "error": None}
+    except Exception as e:
+        result = {"status": "failed", "error": str(e)[:200]}
+        logger.warning(f"Warm-up step '{name}' failed: {e}")
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    steps[name] = result
+    return value if result["status"] != "failed" else None
+
+
+def warm_up(is_test_mode: bool) -> Dict[str, Any]:
+    """
+    Warm the shared services:
+
+    - chroma: ChromaService construction (client, collections, embedding function);
+    - embedding: first embedding call (loads the model);
+    - vector_replicas: initial sync of the in-process read replicas (VECTOR_REPLICA_COLLECTIONS);
+    - vector_query: a dummy one-result query against the minerals collection;
+    - llm: LLM client construction plus a metadata request (no tokens billed);
+    - async_facade: the thread pool used by the routers.
+
+    Returns {"ready", "total_ms", "steps", "service_timings", "completed_at"};
+    ready is False unless all REQUIRED_STEPS succeeded.
+    """
+    from ai.async_chroma_service import get_async_chroma_service
+    from ai.chroma_service import get_chroma_service
+
+    started = time.perf_counter()
+    steps: Dict[str, Dict[str, Any]] = {}
+
+    service = _step(steps, "chroma", lambda: get_chroma_service(is_test_mode=is_test_mode))
+    if service is not None:
+        embedding = _step(steps, "embedding", lambda: service._embed([WARMUP_QUERY], query=True)[0])
+        _step(steps, "vector_replicas", service.sync_replicas)
+        if embedding is not None:
+            _step(steps, "vector_query", lambda: service.minerals_collection.query(query_embeddings=[embedding], n_results=1))
+        _step(steps, "llm", service.warm_up_llm)
+        _step(steps, "async_facade", lambda: get_async_chroma_service(is_test_mode=is_test_mode))
+
+    report = {
+        "ready": all(steps.get(name, {}).get("status") == "ok" for name in REQUIRED_STEPS),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "steps": steps,
+        "service_timings": dict(service.startup_timings) if service is not None else {},
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    logger.info(
+        f"Warm-up finished in {report['total_ms']} ms: "
+        + ", ".join(f"{name}={step['status']} ({step['elapsed_ms']} ms)" for name, step in steps.items())
+    )
+    return report
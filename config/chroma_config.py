@@ -12,6 +12,10 @@ class ChromaConfig(BaseSettings):
     API_KEY: str = os.getenv("CHROMA_API_KEY", "ck-5AiP5CxC5ina18h2TYNusGxe4SxNs5xf4Xeep82CbF79")
     TENANT: str = os.getenv("CHROMA_TENANT", "c74ab4c5-d45c-4b29-96ac-d995b6e9bc33")
     DATABASE: str = os.getenv("CHROMA_DATABASE", "Test")
+    # Тестовый режим: локальная БД на диске (persistent) или in-memory база данных сессии (ephemeral)
+    TEST_CLIENT: str = os.getenv("CHROMA_TEST_CLIENT", "persistent")
+    TEST_DB_PATH: str = os.getenv("CHROMA_TEST_DB_PATH", "./chroma_test_db")
+    TEST_SESSION: str = os.getenv("CHROMA_TEST_SESSION", "")
     
     # Коллекции OpenMineralHub
     COLLECTIONS = {
@@ -26,19 +30,86 @@ class ChromaConfig(BaseSettings):
     EMBEDDING_PROVIDER: str = os.getenv("CHROMA_EMBEDDING_PROVIDER", "openai")
     EMBEDDING_MODEL: str = os.getenv("CHROMA_EMBEDDING_MODEL", "text-embedding-3-small")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    # Модель локального провайдера (sentence_transformers / onnx); EMBEDDING_MODEL — модель OpenAI
+    EMBEDDING_LOCAL_MODEL: str = os.getenv("EMBEDDING_LOCAL_MODEL", "all-MiniLM-L6-v2")
+    # Коллекции, записанные другой embedding моделью: error — отказ при старте, reindex — переиндексация
+    EMBEDDING_MODEL_MISMATCH: str = os.getenv("EMBEDDING_MODEL_MISMATCH", "error")
+    # Локальная CPU модель (sentence_transformers / onnx)
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "auto")
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_NUM_THREADS: int = int(os.getenv("EMBEDDING_NUM_THREADS", "4"))
+    EMBEDDING_NUM_WORKERS: int = int(os.getenv("EMBEDDING_NUM_WORKERS", "0"))
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "./.embedding_cache")
+    # Эмбеддинги поисковых запросов — только в памяти (LRU), на диск пишутся эмбеддинги документов
+    EMBEDDING_QUERY_CACHE_SIZE: int = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
     
     # Сервисные параметры
     RAG_ENABLED: bool = os.getenv("RAG_ENABLED", "true").lower() == "true"
     SEARCH_RESULTS_DEFAULT: int = int(os.getenv("SEARCH_RESULTS_DEFAULT", "5"))
+    CHROMA_THREAD_POOL_SIZE: int = int(os.getenv("CHROMA_THREAD_POOL_SIZE", "8"))
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+    SCAN_PAGE_SIZE: int = int(os.getenv("SCAN_PAGE_SIZE", "500"))
+    # Чанки длинных документов: поиск по чанкам со сверткой к родительским документам
+    CHUNKING_ENABLED: bool = os.getenv("CHUNKING_ENABLED", "true").lower() == "true"
+    CHUNKED_COLLECTIONS: str = os.getenv("CHUNKED_COLLECTIONS", "deals,kyc")
+    CHUNK_MAX_TOKENS: int = int(os.getenv("CHUNK_MAX_TOKENS", "80"))
+    CHUNK_OVERLAP_TOKENS: int = int(os.getenv("CHUNK_OVERLAP_TOKENS", "20"))
+    CHUNK_OVERSAMPLE: int = int(os.getenv("CHUNK_OVERSAMPLE", "3"))
+    # Шардирование поискового индекса сделок по commodity или region ("" — без шардов)
+    DEALS_SHARD_KEY: str = os.getenv("DEALS_SHARD_KEY", "")
+    DEALS_SHARD_FANOUT_WORKERS: int = int(os.getenv("DEALS_SHARD_FANOUT_WORKERS", "8"))
+    # In-process реплики для чтения (numpy, HNSW при hnswlib) — например, "minerals,kyc"
+    VECTOR_REPLICA_COLLECTIONS: str = os.getenv("VECTOR_REPLICA_COLLECTIONS", "")
+    VECTOR_REPLICA_REFRESH_SECONDS: int = int(os.getenv("VECTOR_REPLICA_REFRESH_SECONDS", "300"))
+    VECTOR_REPLICA_HNSW_THRESHOLD: int = int(os.getenv("VECTOR_REPLICA_HNSW_THRESHOLD", "20000"))
+    VECTOR_REPLICA_HNSW_EF: int = int(os.getenv("VECTOR_REPLICA_HNSW_EF", "64"))
+    # Записи поверх снимка реплики, после которых снимок перестраивается в фоне
+    VECTOR_REPLICA_DELTA_LIMIT: int = int(os.getenv("VECTOR_REPLICA_DELTA_LIMIT", "1000"))
+    # Гибридный поиск: BM25 + вектор (reciprocal-rank fusion) и точный поиск идентификаторов
+    HYBRID_SEARCH_ENABLED: bool = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", "60"))
+    # Возраст лексического индекса, после которого он перечитывается (записи других процессов)
+    LEXICAL_INDEX_TTL_SECONDS: int = int(os.getenv("LEXICAL_INDEX_TTL_SECONDS", "300"))
+    # Возраст агрегатов сделок и счетчиков чанков/шардов в статистике, после которого
+    # они перечитываются (записи других процессов при неизменном числе сделок)
+    STATS_REFRESH_SECONDS: int = int(os.getenv("STATS_REFRESH_SECONDS", "300"))
+    # Re-ranking кандидатов локальным cross-encoder (второй этап поиска)
+    RERANK_ENABLED: bool = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+    RERANK_MODEL: str = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_OVERSAMPLE: int = int(os.getenv("RERANK_OVERSAMPLE", "4"))
+    RERANK_MAX_CANDIDATES: int = int(os.getenv("RERANK_MAX_CANDIDATES", "40"))
+    RERANK_BATCH_SIZE: int = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    RERANK_BUDGET_MS: float = float(os.getenv("RERANK_BUDGET_MS", "150"))
+    RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+    # Семантический кеш ответов RAG
+    RAG_CACHE_ENABLED: bool = os.getenv("RAG_CACHE_ENABLED", "true").lower() == "true"
+    RAG_CACHE_THRESHOLD: float = float(os.getenv("RAG_CACHE_THRESHOLD", "0.92"))
+    RAG_CACHE_TTL_SECONDS: int = int(os.getenv("RAG_CACHE_TTL_SECONDS", "900"))
+    RAG_CACHE_MAX_ENTRIES: int = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512"))
+    # Упаковка контекста RAG в бюджет токенов (окно контекста — модели RAG, gpt-4-turbo-preview)
+    RAG_CONTEXT_WINDOW_TOKENS: int = int(os.getenv("RAG_CONTEXT_WINDOW_TOKENS", "128000"))
+    RAG_CONTEXT_MAX_TOKENS: int = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "3000"))
+    RAG_CONTEXT_DOC_MAX_TOKENS: int = int(os.getenv("RAG_CONTEXT_DOC_MAX_TOKENS", "600"))
+    RAG_RESPONSE_RESERVE_TOKENS: int = int(os.getenv("RAG_RESPONSE_RESERVE_TOKENS", "1024"))
+    RAG_CONTEXT_OVERFETCH: int = int(os.getenv("RAG_CONTEXT_OVERFETCH", "4"))
+    RAG_CONTEXT_MAX_CANDIDATES: int = int(os.getenv("RAG_CONTEXT_MAX_CANDIDATES", "20"))
+    RAG_CONTEXT_DEDUP_THRESHOLD: float = float(os.getenv("RAG_CONTEXT_DEDUP_THRESHOLD", "0.85"))
     
     # Кеширование (Redis)
     REDIS_ENABLED: bool = os.getenv("REDIS_ENABLED", "false").lower() == "true"
     CACHE_TTL_SECONDS: int = int(os.getenv("CACHE_TTL_SECONDS", "3600"))
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     
     # Мониторинг
     MONITORING_ENABLED: bool = os.getenv("CHROMA_MONITORING", "true").lower() == "true"
     OTEL_ENABLED: bool = os.getenv("OTEL_ENABLED", "false").lower() == "true"
     OTEL_SERVICE_NAME: str = os.getenv("OTEL_SERVICE_NAME", "openmineral-chroma")
+    # Тайминги поиска и RAG по стадиям: экспортеры (log, prometheus, otel) и отладочный вывод в ответах
+    TIMING_EXPORTERS: str = os.getenv("TIMING_EXPORTERS", "log")
+    TIMING_SLOW_MS: float = float(os.getenv("TIMING_SLOW_MS", "1000"))
+    TIMINGS_IN_RESPONSE: bool = os.getenv("TIMINGS_IN_RESPONSE", "false").lower() == "true"
     
     @classmethod
     def validate(cls) -> bool:
@@ -66,21 +137,24 @@ class ChromaConfig(BaseSettings):
     @classmethod
     def get_embedding_config(cls) -> dict:
         """Конфигурация embedding модели"""
+        local = {
+            "backend": cls.EMBEDDING_BACKEND,
+            "batch_size": cls.EMBEDDING_BATCH_SIZE,
+            "num_threads": cls.EMBEDDING_NUM_THREADS,
+            "num_workers": cls.EMBEDDING_NUM_WORKERS
+        }
         if cls.EMBEDDING_PROVIDER == "openai":
             return {
                 "provider": "openai",
                 "model": cls.EMBEDDING_MODEL,
-                "api_key": cls.OPENAI_API_KEY
-            }
-        elif cls.EMBEDDING_PROVIDER == "sentence_transformers":
-            return {
-                "provider": "sentence_transformers",
-                "model": "all-MiniLM-L6-v2"
+                "api_key": cls.OPENAI_API_KEY,
+                **local
             }
         else:
             return {
                 "provider": "sentence_transformers",
-                "model": cls.EMBEDDING_MODEL
+                "model": cls.EMBEDDING_LOCAL_MODEL,
+                **local
             }
 
 # Создание глобальной конфигурации
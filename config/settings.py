@@ -77,6 +77,12 @@ class Settings(BaseSettings):
     # Logging
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
     
+    # Health probes (background dependency prober)
+    health_probe_interval_seconds: float = float(os.getenv("HEALTH_CHECK_INTERVAL", "30"))
+    health_probe_timeout_seconds: float = float(os.getenv("HEALTH_CHECK_TIMEOUT", "10"))
+    # Warm-up of Chroma/embedding/LLM clients in the application lifespan
+    warmup_enabled: bool = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    
     # Test Users
     test_user_email: str = os.getenv("TEST_USER_EMAIL", "testuser@openmineral.dev")
     test_user_password: str = os.getenv("TEST_USER_PASSWORD", "testpassword123")